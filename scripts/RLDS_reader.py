@@ -9,19 +9,33 @@ format datasets and extract video sequences with annotations for robotic learnin
 import os
 import json
 import re
+import time
 import argparse
 import logging
+import shutil
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing as mp
 from typing import List, Dict, Tuple, Optional, Any
 from pathlib import Path
 
 import numpy as np
-import tensorflow_datasets as tfds
 from tqdm import tqdm
 
 try:
-    from .utils import save_video, generate_meta_information, dataset_mapping
+    from .utils import save_video, generate_meta_information, dataset_mapping, StreamingVideoWriter
+    from .ledger import ProgressLedger
+    from .video_encoders import ENCODERS, parse_encoder_options
+    from .frame_store import FrameStoreWriter, merge_frame_stores, DEFAULT_SHARD_BYTES, FRAME_STORE_DIRNAME
+    from .jsonl_io import JsonlWriter, iter_jsonl
+    from .metrics import metrics, setup_metrics
 except ImportError:
-    from scripts.utils import save_video, generate_meta_information, dataset_mapping
+    from scripts.utils import save_video, generate_meta_information, dataset_mapping, StreamingVideoWriter
+    from scripts.ledger import ProgressLedger
+    from scripts.video_encoders import ENCODERS, parse_encoder_options
+    from scripts.frame_store import FrameStoreWriter, merge_frame_stores, DEFAULT_SHARD_BYTES, FRAME_STORE_DIRNAME
+    from scripts.jsonl_io import JsonlWriter, iter_jsonl
+    from scripts.metrics import metrics, setup_metrics
 
 
 # Configure logging
@@ -31,6 +45,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+LEDGER_FILENAME = 'progress.jsonl'
+PART_ANNOTATION_FILENAME = 'annotation.jsonl'
+PENDING_VIDEO_PATTERN = re.compile(r'^\.pending_(\d{8})')
+OUTPUT_FORMATS = ('video', 'frame_store')
+ANNOTATION_FORMATS = ('json', 'jsonl')
+
+
 class RLDSDatasetExtractor:
     IMAGE_KEYS = {
         'taco_play': 'rgb_static',
@@ -54,9 +75,99 @@ class RLDSDatasetExtractor:
         'utokyo_xarm_pick_and_place_converted_externally_to_rlds'
     }
 
-    def __init__(self, base_dataset_path: str = ''):
+    def __init__(self, base_dataset_path: str = '', streaming: bool = False, early_reject: bool = False,
+                 encoder: str = 'imageio', encoder_options: Optional[Dict[str, Any]] = None,
+                 encode_errors: str = 'count', encode_workers: int = 0,
+                 encode_executor: str = 'thread', queue_depth: Optional[int] = None,
+                 output_format: str = 'video', frame_store_shard_bytes: int = DEFAULT_SHARD_BYTES,
+                 merge_repeated_steps: bool = True, annotation_format: str = 'json'):
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown encoder '{encoder}'. Available: {list(ENCODERS.keys())}")
+        if encode_errors not in ('raise', 'count'):
+            raise ValueError(f"encode_errors must be 'raise' or 'count', got '{encode_errors}'")
+        if encode_executor not in ('thread', 'process'):
+            raise ValueError(f"encode_executor must be 'thread' or 'process', got '{encode_executor}'")
+        if streaming and encode_workers > 0:
+            raise ValueError("streaming encodes inline and cannot be combined with encode_workers")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got '{output_format}'")
+        if annotation_format not in ANNOTATION_FORMATS:
+            raise ValueError(f"annotation_format must be one of {ANNOTATION_FORMATS}, got '{annotation_format}'")
+        if output_format == 'frame_store' and encode_workers > 0:
+            raise ValueError("the frame store is written inline and cannot be combined with encode_workers")
         self.base_dataset_path = base_dataset_path
-        self.dataset_path_mapping = dataset_mapping(base_dataset_path)
+        self.streaming = streaming
+        self.early_reject = early_reject
+        self.encoder = encoder
+        self.encoder_options = encoder_options or {}
+        self.encode_errors = encode_errors
+        self.output_format = output_format
+        self.frame_store_shard_bytes = frame_store_shard_bytes
+        self.merge_repeated_steps = merge_repeated_steps
+        self.annotation_format = annotation_format
+        # Frame store episodes are addressed by bare id rather than a file name.
+        self.video_extension = '' if output_format == 'frame_store' else ENCODERS[encoder].extension
+        self.encode_workers = encode_workers
+        self.encode_executor = encode_executor
+        self.queue_depth = queue_depth or 2 * max(1, encode_workers)
+        self.dataset_path_mapping, _ = dataset_mapping(base_dataset_path)
+        self.counters = self._initialize_counters()
+        self._image_feature = None
+        self._frame_store: Optional[FrameStoreWriter] = None
+
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        """Constructor arguments used to rebuild this extractor in a worker process."""
+        return {
+            'base_dataset_path': self.base_dataset_path,
+            'streaming': self.streaming,
+            'early_reject': self.early_reject,
+            'encoder': self.encoder,
+            'encoder_options': self.encoder_options,
+            'encode_errors': self.encode_errors,
+            'encode_workers': self.encode_workers,
+            'encode_executor': self.encode_executor,
+            'queue_depth': self.queue_depth,
+            'output_format': self.output_format,
+            'frame_store_shard_bytes': self.frame_store_shard_bytes,
+            'merge_repeated_steps': self.merge_repeated_steps,
+            'annotation_format': self.annotation_format,
+        }
+
+    def _open_writer(self, video_path: str) -> Any:
+        """Incremental writer for one episode: a video file or a frame store entry."""
+        if self._frame_store is not None:
+            return self._frame_store.episode_writer(os.path.basename(video_path))
+        return StreamingVideoWriter(video_path, backend=self.encoder, **self.encoder_options)
+
+    def _write_episode(self, video_path: str, images: List[np.ndarray]) -> int:
+        """Write a buffered episode as a video file or a frame store entry; returns the frame count."""
+        if self._frame_store is not None:
+            with metrics.timer('frame_store_write'):
+                return self._frame_store.add_episode(os.path.basename(video_path), np.stack(images))
+        return save_video(frames=images, output_path=video_path, backend=self.encoder, **self.encoder_options)
+
+    def _load_episodes(self, dataset_name: str, split: str) -> Any:
+        """
+        Open ``split`` of a dataset as a tf.data pipeline.
+
+        In early-reject mode the camera image is read with ``SkipDecoding`` so
+        it stays as encoded bytes until the episode has passed validation.
+        """
+        # TensorFlow takes seconds to load, so only the extraction paths import it.
+        import tensorflow_datasets as tfds
+        builder = tfds.builder_from_directory(self.dataset_path_mapping[dataset_name])
+        if not self.early_reject:
+            return builder.as_dataset(split=split)
+        image_key = self.IMAGE_KEYS.get(dataset_name, self.IMAGE_KEYS['default'])
+        self._image_feature = builder.info.features['steps']['observation'][image_key]
+        decoders = {'steps': {'observation': {image_key: tfds.decode.SkipDecoding()}}}
+        return builder.as_dataset(split=split, decoders=decoders)
+
+    def _split_sizes(self, dataset_name: str) -> List[Tuple[str, int]]:
+        """Episode count of every split, in the order the builder lists them."""
+        import tensorflow_datasets as tfds
+        builder = tfds.builder_from_directory(self.dataset_path_mapping[dataset_name])
+        return [(name, split.num_examples) for name, split in builder.info.splits.items()]
 
     def get_camera_image(self, step: Dict[str, Any], dataset_name: str) -> np.ndarray:
         observation = step["observation"]
@@ -77,47 +188,404 @@ class RLDSDatasetExtractor:
             return True
         return bool(re.search(r'^[a-zA-Z]+( [a-zA-Z]+)*\.?$', instruction))
 
-    def process_dataset(self, dataset_name: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+    def process_dataset(self, dataset_name: str, output_dir: Optional[str] = None,
+                        workers: int = 1, resume: bool = True) -> Dict[str, Any]:
         if dataset_name not in self.dataset_path_mapping:
             raise ValueError(f"Dataset '{dataset_name}' not found. Available: {list(self.dataset_path_mapping.keys())}")
         logger.info(f"Processing dataset: {dataset_name}")
         base_dir = self.dataset_path_mapping[dataset_name]
         video_dir = output_dir or os.path.join(base_dir, 'video')
         os.makedirs(video_dir, exist_ok=True)
-        annotation_path = os.path.join(video_dir, 'annotation.json')
+        annotation_path = os.path.join(video_dir, f'annotation.{self.annotation_format}')
         meta_info_path = os.path.join(video_dir, 'meta_information.json')
         stats = self._initialize_stats()
-        annotations = []
-        video_count = 0
+        annotations = self._open_annotations(annotation_path)
         try:
-            episodes = tfds.builder_from_directory(base_dir).as_dataset(split='all')
-            for episode in tqdm(episodes, desc=f"Processing {dataset_name}"):
-                stats['total_episodes'] += 1
-                episode_data = self._process_episode(episode, dataset_name)
-                if episode_data['is_valid']:
-                    video_filename = f"{video_count:06d}.mp4"
-                    video_path = os.path.join(video_dir, video_filename)
-                    save_video(frames=episode_data['images'], output_path=video_path)
-                    annotation = generate_meta_information(
-                        id=video_filename,
-                        view="third_person",
-                        instructions=episode_data['instructions'],
-                        meta_information=stats
-                    )
-                    annotations.append(annotation)
-                    video_count += 1
-                else:
-                    stats['filtered_episodes'] += 1
+            if workers > 1:
+                self._process_parallel(dataset_name, video_dir, stats, annotations, workers, resume)
+                ledger = None
+            else:
+                ledger = ProgressLedger(os.path.join(video_dir, LEDGER_FILENAME))
+                self._extract_with_ledger(
+                    dataset_name, video_dir, stats, ledger, annotations,
+                    resume=resume, desc=f"Processing {dataset_name}"
+                )
             stats['useful_episodes'] = stats['total_episodes'] - stats['filtered_episodes']
             self._save_results(annotation_path, meta_info_path, annotations, stats)
+            if ledger is not None:
+                ledger.remove()
             logger.info(f"Processing completed for {dataset_name}")
             logger.info(f"Total episodes: {stats['total_episodes']}")
             logger.info(f"Useful episodes: {stats['useful_episodes']}")
             logger.info(f"Filtered episodes: {stats['filtered_episodes']}")
+            if self.early_reject:
+                self._log_timing()
+            if self.counters['encode_failures']:
+                logger.warning(f"Encode failures: {self.counters['encode_failures']}")
+            if metrics.enabled:
+                logger.info(f"Stage timings: {metrics.summary()}")
             return stats
         except Exception as e:
             logger.error(f"Error processing dataset {dataset_name}: {str(e)}")
             raise
+        finally:
+            if isinstance(annotations, JsonlWriter):
+                annotations.close()
+
+    def _open_annotations(self, annotation_path: str) -> Any:
+        """
+        Where committed annotations go: a list for ``annotation.json``, or a
+        ``JsonlWriter`` on a temporary file for ``annotation.jsonl`` so every
+        annotation is written as its episode is committed.
+
+        The temporary file is always started afresh; on resume the ledger
+        replays the finished episodes into it.
+        """
+        if self.annotation_format != 'jsonl':
+            return []
+        tmp_path = annotation_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return JsonlWriter(tmp_path)
+
+    def _extract_with_ledger(self, dataset_name: str, video_dir: str, stats: Dict[str, Any],
+                             ledger: ProgressLedger, annotations: Any, start: int = 0, end: Optional[int] = None,
+                             resume: bool = True, desc: Optional[str] = None) -> int:
+        """
+        Process episodes ``[start, end)`` of the ``all`` split, resuming after
+        the episodes already recorded in ``ledger``. Episodes are numbered
+        across the builder's splits in the order it lists them.
+
+        Finished episodes are replayed into ``stats`` and ``annotations`` (a
+        list or a ``JsonlWriter``), and video numbering continues after the
+        last recorded video so existing MP4s are never renumbered or
+        overwritten.
+
+        Returns:
+            Number of videos recorded for the range
+        """
+        if not resume:
+            ledger.remove()
+        num_records, video_count = self._replay_ledger(ledger, stats, annotations)
+        first_episode = start + num_records
+        self._remove_pending_videos(video_dir, first_episode)
+        if num_records:
+            logger.info(f"Resuming {dataset_name} at episode {first_episode} ({video_count} videos done)")
+        if end is not None and first_episode >= end:
+            return video_count
+
+        split = episode_range_split(self._split_sizes(dataset_name), first_episode, end)
+        if split is None:
+            return video_count
+        episodes = self._load_episodes(dataset_name, split)
+        if self.output_format == 'frame_store':
+            self._frame_store = FrameStoreWriter(os.path.join(video_dir, FRAME_STORE_DIRNAME),
+                                                 self.frame_store_shard_bytes)
+        try:
+            with ledger:
+                video_count = self._process_episodes(
+                    episodes, dataset_name, video_dir, stats, annotations, desc=desc, ledger=ledger,
+                    episode_index=first_episode, video_count=video_count
+                )
+        finally:
+            if self._frame_store is not None:
+                self._frame_store.close()
+                self._frame_store = None
+        return video_count
+
+    @staticmethod
+    def _remove_pending_videos(video_dir: str, first_episode: int) -> None:
+        """Delete pending encodes left by a crash for episodes the ledger has not recorded."""
+        if not os.path.isdir(video_dir):
+            return
+        for name in os.listdir(video_dir):
+            match = PENDING_VIDEO_PATTERN.match(name)
+            if match and int(match.group(1)) >= first_episode:
+                os.remove(os.path.join(video_dir, name))
+
+    def _replay_ledger(self, ledger: ProgressLedger, stats: Dict[str, Any], annotations: Any) -> Tuple[int, int]:
+        """Stream ledger records into stats and ``annotations``; returns the record and video counts."""
+        num_records, video_count = 0, 0
+        for record in ledger.iter_records():
+            num_records += 1
+            stats['total_episodes'] += 1
+            annotation = record['annotation']
+            if annotation is None:
+                stats['filtered_episodes'] += 1
+            else:
+                self._record_episode_index(stats, annotation)
+                annotations.append(annotation)
+                video_count += 1
+        return num_records, video_count
+
+    def _process_episodes(self, episodes: Any, dataset_name: str, video_dir: str,
+                          stats: Dict[str, Any], annotations: Any, desc: Optional[str] = None,
+                          ledger: Optional[ProgressLedger] = None,
+                          episode_index: int = 0, video_count: int = 0) -> int:
+        """
+        Extract videos and annotations for an iterable of episodes.
+
+        Videos are numbered from ``video_count`` in iteration order, so the
+        output of a serial run and of a single worker chunk is laid out the
+        same way. Every finished episode is appended to ``annotations`` and
+        ``ledger``. Returns the video count after the last episode.
+        """
+        if self.encode_workers > 0:
+            return self._process_episodes_pipelined(
+                episodes, dataset_name, video_dir, stats, annotations, desc, ledger, episode_index, video_count
+            )
+        for episode in metrics.timed_iter(tqdm(episodes, desc=desc, disable=desc is None), 'tfds_read_episode'):
+            stats['total_episodes'] += 1
+            video_filename = f"{video_count:06d}{self.video_extension}"
+            video_path = os.path.join(video_dir, video_filename)
+            try:
+                if self.early_reject:
+                    episode_data = self._process_episode_early_reject(episode, dataset_name, video_path)
+                elif self.streaming:
+                    episode_data = self._process_episode_streaming(episode, dataset_name, video_path)
+                else:
+                    episode_data = self._process_episode(episode, dataset_name)
+                if episode_data['is_valid'] and not self.streaming:
+                    self.counters['encoded_frames'] += self._write_episode(video_path, episode_data['images'])
+            except Exception as e:
+                self._handle_encode_failure(video_path, e)
+                episode_data = {'is_valid': False}
+            if episode_data['is_valid']:
+                video_count += 1
+                self._commit_episode(episode_index, video_filename, episode_data['instructions'],
+                                     stats, annotations, ledger)
+            else:
+                self._commit_episode(episode_index, None, None, stats, annotations, ledger)
+            episode_index += 1
+        return video_count
+
+    def _process_episodes_pipelined(self, episodes: Any, dataset_name: str, video_dir: str,
+                                    stats: Dict[str, Any], annotations: Any, desc: Optional[str],
+                                    ledger: Optional[ProgressLedger],
+                                    episode_index: int, video_count: int) -> int:
+        """
+        Producer/consumer variant of ``_process_episodes``.
+
+        The calling thread reads and validates episodes and submits their
+        frames to a pool of ``encode_workers`` encoders. Each video is written
+        under a pending name and only renamed to its ``NNNNNN`` id when it is
+        committed; commits happen strictly in episode order, so ids,
+        annotations and the ledger match a serial run whatever order encodes
+        finish in. At most ``queue_depth`` episodes are in flight at once.
+        """
+        in_flight = deque()
+
+        def commit_head() -> None:
+            nonlocal video_count
+            index, instructions, pending_path, future = in_flight.popleft()
+            stats['total_episodes'] += 1
+            if future is not None:
+                try:
+                    num_frames = future.result()
+                    if self.encode_executor == 'process':
+                        num_frames, snapshot = num_frames
+                        metrics.merge(snapshot)
+                    self.counters['encoded_frames'] += num_frames
+                except Exception as e:
+                    self._handle_encode_failure(pending_path, e)
+                    future = None
+            if future is None:
+                self._commit_episode(index, None, None, stats, annotations, ledger)
+                return
+            video_filename = f"{video_count:06d}{self.video_extension}"
+            os.replace(pending_path, os.path.join(video_dir, video_filename))
+            video_count += 1
+            self._commit_episode(index, video_filename, instructions, stats, annotations, ledger)
+
+        with self._make_encode_executor() as executor:
+            for episode in metrics.timed_iter(tqdm(episodes, desc=desc, disable=desc is None), 'tfds_read_episode'):
+                if self.early_reject:
+                    episode_data = self._process_episode_early_reject(episode, dataset_name, None)
+                else:
+                    episode_data = self._process_episode(episode, dataset_name)
+                pending_path, future = None, None
+                if episode_data['is_valid']:
+                    pending_path = os.path.join(video_dir, f".pending_{episode_index:08d}{self.video_extension}")
+                    if self.encode_executor == 'process':
+                        future = executor.submit(_save_video_in_process, metrics.enabled, episode_data['images'],
+                                                 pending_path, 30, self.encoder, **self.encoder_options)
+                    else:
+                        future = executor.submit(save_video, episode_data['images'], pending_path,
+                                                 30, self.encoder, **self.encoder_options)
+                in_flight.append((episode_index, episode_data['instructions'], pending_path, future))
+                del episode_data
+                episode_index += 1
+
+                # Commit whatever is finished at the head; block only when the queue is full.
+                while in_flight and (len(in_flight) >= self.queue_depth
+                                     or in_flight[0][3] is None or in_flight[0][3].done()):
+                    commit_head()
+            while in_flight:
+                commit_head()
+        return video_count
+
+    def _make_encode_executor(self) -> Executor:
+        if self.encode_executor == 'process':
+            return ProcessPoolExecutor(max_workers=self.encode_workers, mp_context=mp.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.encode_workers, thread_name_prefix='encoder')
+
+    def _handle_encode_failure(self, video_path: str, error: Exception) -> None:
+        """Raise or count a failed encode, removing any partial output."""
+        if self.encode_errors == 'raise':
+            raise error
+        logger.warning(f"Error encoding {video_path}: {str(error)}")
+        self.counters['encode_failures'] += 1
+        metrics.count('encode_failures')
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+    def _commit_episode(self, episode_index: int, video_filename: Optional[str], instructions: Optional[List[str]],
+                        stats: Dict[str, Any], annotations: Any,
+                        ledger: Optional[ProgressLedger]) -> None:
+        """Record a finished episode; ``video_filename`` is None for filtered episodes."""
+        annotation = None
+        if video_filename is not None:
+            annotation = generate_meta_information(
+                id=video_filename,
+                view="third_person",
+                instructions=instructions,
+                meta_information=stats,
+                merge_repeats=self.merge_repeated_steps
+            )
+            annotations.append(annotation)
+            metrics.count('useful_episodes')
+        else:
+            stats['filtered_episodes'] += 1
+            metrics.count('filtered_episodes')
+        if ledger is not None:
+            ledger.append({'episode_index': episode_index, 'annotation': annotation})
+
+    def extract_episode_range(self, dataset_name: str, start: int, end: int, part_dir: str) -> str:
+        """
+        Process episodes ``[start, end)`` of the ``all`` split into ``part_dir``.
+
+        Videos are written with part-local ids, the annotations are streamed
+        to ``part_dir/annotation.jsonl`` and the partial stats are stored in
+        ``part_dir/part.json`` for the merge step. A part that already has a
+        ``part.json`` is skipped, and an interrupted part resumes from its own
+        ledger.
+
+        Returns:
+            Path of the written ``part.json``
+        """
+        part_path = os.path.join(part_dir, 'part.json')
+        if os.path.exists(part_path):
+            return part_path
+        os.makedirs(part_dir, exist_ok=True)
+        stats = self._initialize_stats()
+        ledger = ProgressLedger(os.path.join(part_dir, LEDGER_FILENAME))
+        annotation_path = os.path.join(part_dir, PART_ANNOTATION_FILENAME)
+        # The ledger replays finished episodes, so the part annotations are rewritten from scratch.
+        if os.path.exists(annotation_path):
+            os.remove(annotation_path)
+        with JsonlWriter(annotation_path) as annotations:
+            self._extract_with_ledger(dataset_name, part_dir, stats, ledger, annotations, start=start, end=end)
+        tmp_path = part_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'start': start,
+                'end': end,
+                'total_episodes': stats['total_episodes'],
+                'filtered_episodes': stats['filtered_episodes'],
+                'counters': self.counters,
+                'metrics': metrics.snapshot() if metrics.enabled else None,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, part_path)
+        ledger.remove()
+        return part_path
+
+    def _process_parallel(self, dataset_name: str, video_dir: str, stats: Dict[str, Any], annotations: Any,
+                          workers: int, resume: bool = True) -> None:
+        """
+        Split the ``all`` split into contiguous episode ranges and process them
+        in a pool of worker processes, then merge the parts in range order.
+        Each worker reads its range as per-split slices, so chunks may span
+        split boundaries.
+
+        The chunk plan is stored in ``.parts/plan.json`` so a resumed run keeps
+        the original ranges even if ``workers`` changed.
+        """
+        parts_root = os.path.join(video_dir, '.parts')
+        plan_path = os.path.join(parts_root, 'plan.json')
+        if not resume:
+            shutil.rmtree(parts_root, ignore_errors=True)
+        if os.path.exists(plan_path):
+            with open(plan_path, 'r', encoding='utf-8') as f:
+                ranges = [tuple(r) for r in json.load(f)['ranges']]
+            logger.info(f"Resuming parallel run with {len(ranges)} chunks")
+        else:
+            # Chunks index the same split order that episode_range_split maps back onto.
+            num_episodes = sum(size for _, size in self._split_sizes(dataset_name))
+            # A few chunks per worker keeps the pool busy when episode lengths vary.
+            ranges = split_episode_ranges(num_episodes, workers * 4)
+            os.makedirs(parts_root, exist_ok=True)
+            with open(plan_path, 'w', encoding='utf-8') as f:
+                json.dump({'num_episodes': num_episodes, 'ranges': ranges}, f)
+            logger.info(f"Splitting {num_episodes} episodes into {len(ranges)} chunks across {workers} workers")
+        part_dirs = [os.path.join(parts_root, f"{i:05d}") for i in range(len(ranges))]
+
+        # TensorFlow is not fork-safe, so workers are always spawned.
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(_extract_episode_range, self._worker_kwargs(), dataset_name, start, end, part_dir,
+                            metrics.enabled)
+                for (start, end), part_dir in zip(ranges, part_dirs)
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=f"Processing {dataset_name}"):
+                future.result()
+
+        self._merge_parts(part_dirs, video_dir, stats, annotations)
+        shutil.rmtree(parts_root, ignore_errors=True)
+
+    def _merge_parts(self, part_dirs: List[str], video_dir: str, stats: Dict[str, Any], annotations: Any) -> None:
+        """
+        Move part videos to their global ``NNNNNN.mp4`` ids and stream the
+        part annotations into ``annotations``, rebuilding the ids and episode
+        indices exactly as a serial run would.
+
+        Ids are a pure function of the part order, so re-running an
+        interrupted merge is safe.
+        """
+        video_count = 0
+        frame_store_sources = []
+        for part_dir in part_dirs:
+            with open(os.path.join(part_dir, 'part.json'), 'r', encoding='utf-8') as f:
+                part = json.load(f)
+            stats['total_episodes'] += part['total_episodes']
+            stats['filtered_episodes'] += part['filtered_episodes']
+            for key, value in part.get('counters', {}).items():
+                self.counters[key] += value
+            metrics.merge(part.get('metrics'))
+            id_map = {}
+            for annotation in iter_jsonl(os.path.join(part_dir, PART_ANNOTATION_FILENAME)):
+                video_filename = f"{video_count:06d}{self.video_extension}"
+                part_video = os.path.join(part_dir, annotation['id'])
+                if os.path.exists(part_video):
+                    os.replace(part_video, os.path.join(video_dir, video_filename))
+                id_map[annotation['id']] = video_filename
+                annotation['id'] = video_filename
+                self._record_episode_index(stats, annotation)
+                annotations.append(annotation)
+                video_count += 1
+            frame_store_sources.append((os.path.join(part_dir, FRAME_STORE_DIRNAME), id_map))
+        if self.output_format == 'frame_store':
+            merge_frame_stores(frame_store_sources, os.path.join(video_dir, FRAME_STORE_DIRNAME))
+
+    @staticmethod
+    def _record_episode_index(stats: Dict[str, Any], annotation: Dict[str, Any]) -> None:
+        """Update short/long episode bookkeeping the way generate_meta_information does."""
+        if annotation['horizon'] > 1:
+            stats["long_episode_index"].append(annotation['id'])
+            stats["long_episodes"] += 1
+        else:
+            stats["short_episode_index"].append(annotation['id'])
+            stats["short_episodes"] += 1
 
     def _process_episode(self, episode: Any, dataset_name: str) -> Dict[str, Any]:
         images = []
@@ -125,15 +593,18 @@ class RLDSDatasetExtractor:
         is_valid = True
         reward = None
 
-        for step in episode["steps"]:
+        for step in metrics.timed_iter(episode["steps"], 'tfds_read_step'):
             try:
-                image = self.get_camera_image(step, dataset_name)
+                with metrics.timer('image_to_numpy'):
+                    image = self.get_camera_image(step, dataset_name)
                 instruction = self.get_natural_language_instruction(step, dataset_name)
 
                 if step["is_terminal"]:
                     reward = step["reward"].numpy()
 
-                if not self.is_episode_valid(instruction, dataset_name):
+                with metrics.timer('validate_instruction'):
+                    valid = self.is_episode_valid(instruction, dataset_name)
+                if not valid:
                     is_valid = False
                     break
 
@@ -152,6 +623,165 @@ class RLDSDatasetExtractor:
             'reward': reward
         }
 
+    def _process_episode_streaming(self, episode: Any, dataset_name: str, video_path: str) -> Dict[str, Any]:
+        """
+        Streaming variant of ``_process_episode``.
+
+        Each step is validated and its frame is pushed straight into an open
+        video writer, so only the current frame is held in memory. Invalid
+        episodes abort the writer and leave no partial file behind.
+        """
+        instructions = []
+        is_valid = True
+        reward = None
+
+        writer = self._open_writer(video_path)
+        try:
+            for step in metrics.timed_iter(episode["steps"], 'tfds_read_step'):
+                try:
+                    instruction = self.get_natural_language_instruction(step, dataset_name)
+
+                    if step["is_terminal"]:
+                        reward = step["reward"].numpy()
+
+                    with metrics.timer('validate_instruction'):
+                        valid = self.is_episode_valid(instruction, dataset_name)
+                    if not valid:
+                        is_valid = False
+                        break
+
+                    with metrics.timer('image_to_numpy'):
+                        image = self.get_camera_image(step, dataset_name)
+
+                except Exception as e:
+                    logger.warning(f"Error processing step in episode: {str(e)}")
+                    is_valid = False
+                    break
+
+                # Encoder errors propagate to the caller, which counts or raises them.
+                writer.append(image)
+                instructions.append(instruction)
+        except Exception:
+            writer.abort()
+            raise
+
+        if is_valid and instructions:
+            writer.close()
+            self.counters['encoded_frames'] += writer.num_frames
+        else:
+            writer.abort()
+            is_valid = is_valid and bool(instructions)
+
+        return {
+            'instructions': instructions,
+            'is_valid': is_valid,
+            'reward': reward
+        }
+
+    def _process_episode_early_reject(self, episode: Any, dataset_name: str, video_path: str) -> Dict[str, Any]:
+        """
+        Two-pass variant of ``_process_episode`` for early-reject mode.
+
+        The first pass reads only each step's instruction and terminal reward
+        and validates the episode while images are still encoded bytes. Only
+        episodes that pass are decoded in the second pass, either into a frame
+        list or straight into a video writer when streaming.
+        """
+        instructions = []
+        reward = None
+        image_key = self.IMAGE_KEYS.get(dataset_name, self.IMAGE_KEYS['default'])
+
+        start = time.perf_counter()
+        is_valid = True
+        num_steps = 0
+        try:
+            for step in metrics.timed_iter(episode["steps"], 'tfds_read_step'):
+                num_steps += 1
+                instruction = self.get_natural_language_instruction(step, dataset_name)
+                if step["is_terminal"]:
+                    reward = step["reward"].numpy()
+                with metrics.timer('validate_instruction'):
+                    valid = self.is_episode_valid(instruction, dataset_name)
+                if not valid:
+                    is_valid = False
+                    break
+                instructions.append(instruction)
+        except Exception as e:
+            logger.warning(f"Error processing step in episode: {str(e)}")
+            is_valid = False
+        self.counters['instruction_pass_seconds'] += time.perf_counter() - start
+
+        if not is_valid or not instructions:
+            self.counters['early_rejected_episodes'] += 1
+            self.counters['early_rejected_steps'] += num_steps
+            return {'images': [], 'instructions': [], 'is_valid': False, 'reward': reward}
+
+        start = time.perf_counter()
+        images = []
+        writer = self._open_writer(video_path) if self.streaming else None
+        steps = iter(metrics.timed_iter(episode["steps"], 'tfds_read_step'))
+        try:
+            while True:
+                # Errors reading or decoding a step reject the episode, as in the first pass.
+                try:
+                    step = next(steps, None)
+                    if step is None:
+                        break
+                    with metrics.timer('image_decode'):
+                        image = self._image_feature.decode_example(step["observation"][image_key]).numpy()
+                except Exception as e:
+                    logger.warning(f"Error decoding images in episode: {str(e)}")
+                    is_valid = False
+                    break
+                if writer is not None:
+                    # Encoder errors propagate to the caller, which counts or raises them.
+                    writer.append(image)
+                else:
+                    images.append(image)
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            if is_valid:
+                writer.close()
+                self.counters['encoded_frames'] += writer.num_frames
+            else:
+                writer.abort()
+        self.counters['image_decode_seconds'] += time.perf_counter() - start
+        self.counters['decoded_steps'] += len(instructions)
+
+        return {
+            'images': images,
+            'instructions': instructions if is_valid else [],
+            'is_valid': is_valid,
+            'reward': reward
+        }
+
+    def _initialize_counters(self) -> Dict[str, Any]:
+        """Initialize run counters that are reported but not written to meta_information.json."""
+        return {
+            "encoded_frames": 0,
+            "encode_failures": 0,
+            "early_rejected_episodes": 0,
+            "early_rejected_steps": 0,
+            "decoded_steps": 0,
+            "instruction_pass_seconds": 0.0,
+            "image_decode_seconds": 0.0,
+        }
+
+    def _log_timing(self) -> None:
+        """Report early-reject counters and an estimate of the decode time saved."""
+        counters = self.counters
+        per_step = counters['image_decode_seconds'] / counters['decoded_steps'] if counters['decoded_steps'] else 0.0
+        saved = per_step * counters['early_rejected_steps']
+        logger.info(f"Early-rejected episodes: {counters['early_rejected_episodes']} "
+                    f"({counters['early_rejected_steps']} steps never decoded)")
+        logger.info(f"Instruction pass: {counters['instruction_pass_seconds']:.1f}s, "
+                    f"image decode: {counters['image_decode_seconds']:.1f}s "
+                    f"({per_step * 1000:.2f} ms/step)")
+        logger.info(f"Estimated decode time saved: {saved:.1f}s")
+
     def _initialize_stats(self) -> Dict[str, Any]:
         """Initialize statistics tracking dictionary."""
         return {
@@ -165,22 +795,30 @@ class RLDSDatasetExtractor:
         }
 
     def _save_results(self, annotation_path: str, meta_info_path: str,
-                     annotations: List[Dict], stats: Dict[str, Any]) -> None:
+                     annotations: Any, stats: Dict[str, Any]) -> None:
         """
         Save annotations and metadata to JSON files.
 
         Args:
-            annotation_path: Path to save annotations
+            annotation_path: Path to save annotations (one per line for ``annotation.jsonl``)
             meta_info_path: Path to save metadata
-            annotations: List of annotation dictionaries
+            annotations: List of annotation dictionaries, or the ``JsonlWriter``
+                they were streamed to, which is closed and moved into place
             stats: Statistics dictionary
         """
         try:
-            with open(annotation_path, 'w', encoding='utf-8') as f:
-                json.dump(annotations, f, indent=4, ensure_ascii=False)
+            with metrics.timer('write_annotations'):
+                if isinstance(annotations, JsonlWriter):
+                    annotations.close()
+                    os.replace(annotations.path, annotation_path)
+                else:
+                    with open(annotation_path, 'w', encoding='utf-8') as f:
+                        json.dump(annotations, f, indent=4, ensure_ascii=False)
 
-            with open(meta_info_path, 'w', encoding='utf-8') as f:
-                json.dump(stats, f, indent=4, ensure_ascii=False)
+                with open(meta_info_path, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f, indent=4, ensure_ascii=False)
+            if metrics.enabled:
+                metrics.count('annotation_bytes_written', os.path.getsize(annotation_path))
 
             logger.info(f"Results saved to {annotation_path} and {meta_info_path}")
 
@@ -189,6 +827,64 @@ class RLDSDatasetExtractor:
             raise
 
 
+def split_episode_ranges(num_episodes: int, num_chunks: int) -> List[Tuple[int, int]]:
+    """
+    Split ``num_episodes`` into at most ``num_chunks`` contiguous, near-equal
+    ``(start, end)`` ranges.
+    """
+    num_chunks = max(1, min(num_chunks, num_episodes))
+    chunk_size, remainder = divmod(num_episodes, num_chunks)
+    ranges = []
+    start = 0
+    for i in range(num_chunks):
+        end = start + chunk_size + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def episode_range_split(split_sizes: List[Tuple[str, int]], start: int,
+                        end: Optional[int] = None) -> Optional[str]:
+    """
+    Translate the global episode range ``[start, end)`` of the ``all`` split
+    into a TFDS split spec such as ``'train[40:]+val[:12]'``.
+
+    TFDS does not accept slices of ``all``, so the range is mapped onto the
+    individual splits in ``split_sizes`` order. Returns None when the range
+    holds no episodes.
+    """
+    parts = []
+    offset = 0
+    for name, size in split_sizes:
+        lo = max(start - offset, 0)
+        hi = size if end is None else min(end - offset, size)
+        if lo < hi:
+            if lo == 0 and hi == size:
+                parts.append(name)
+            else:
+                parts.append(f"{name}[{lo}:{hi}]")
+        offset += size
+    return '+'.join(parts) or None
+
+
+def _extract_episode_range(extractor_kwargs: Dict[str, Any], dataset_name: str,
+                           start: int, end: int, part_dir: str, collect_metrics: bool = False) -> str:
+    """Worker entry point for parallel extraction; collected metrics go to the part for the merge."""
+    metrics.enable(collect_metrics)
+    metrics.reset()
+    extractor = RLDSDatasetExtractor(**extractor_kwargs)
+    return extractor.extract_episode_range(dataset_name, start, end, part_dir)
+
+
+def _save_video_in_process(collect_metrics: bool, frames: List[np.ndarray], output_path: str, fps: int,
+                           backend: str, **encoder_options: Any) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """Encoder process entry point; returns the frame count and this encode's metrics for the parent to merge."""
+    metrics.enable(collect_metrics)
+    metrics.reset()
+    num_frames = save_video(frames, output_path, fps, backend, **encoder_options)
+    return num_frames, metrics.snapshot() if collect_metrics else None
+
+
 def get_available_datasets(base_path: str = '') -> List[str]:
     """
     Get list of available datasets.
@@ -199,7 +895,7 @@ def get_available_datasets(base_path: str = '') -> List[str]:
     Returns:
         List of available dataset names
     """
-    dataset_mapping_dict = dataset_mapping(base_path)
+    dataset_mapping_dict, _ = dataset_mapping(base_path)
     return list(dataset_mapping_dict.keys())
 
 
@@ -225,6 +921,106 @@ def main():
         type=str,
         help='Output directory for videos and annotations (optional)'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes; episodes are split into ranges and merged afterwards'
+    )
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Encode frames as steps are read instead of buffering whole episodes in memory'
+    )
+    parser.add_argument(
+        '--early-reject',
+        action='store_true',
+        help='Validate instructions before decoding any images and report the decode time saved'
+    )
+    parser.add_argument(
+        '--encoder',
+        type=str,
+        default='imageio',
+        choices=sorted(ENCODERS.keys()),
+        help='Video encoder backend (npy writes raw uint8 frames for debugging)'
+    )
+    parser.add_argument(
+        '--encoder-option',
+        action='append',
+        metavar='KEY=VALUE',
+        help='Backend option, repeatable (e.g. preset=veryfast crf=28 threads=4 for pyav)'
+    )
+    parser.add_argument(
+        '--encode-errors',
+        type=str,
+        default='count',
+        choices=['count', 'raise'],
+        help='Count failed encodes as filtered episodes, or abort the run'
+    )
+    parser.add_argument(
+        '--encode-workers',
+        type=int,
+        default=0,
+        help='Encode videos in a background pool of this size while the next episodes are read'
+    )
+    parser.add_argument(
+        '--encode-executor',
+        type=str,
+        default='thread',
+        choices=['thread', 'process'],
+        help='Run background encoders as threads or processes'
+    )
+    parser.add_argument(
+        '--queue-depth',
+        type=int,
+        help='Maximum episodes held in memory waiting for an encoder (default: 2 x encode workers)'
+    )
+    parser.add_argument(
+        '--output-format',
+        type=str,
+        default='video',
+        choices=list(OUTPUT_FORMATS),
+        help='Write per-episode videos, or raw frames into a sharded memory-mapped frame store'
+    )
+    parser.add_argument(
+        '--frame-store-shard-gb',
+        type=float,
+        default=DEFAULT_SHARD_BYTES / 1024 ** 3,
+        help='Target shard size of the frame store in GiB'
+    )
+    parser.add_argument(
+        '--annotation-format',
+        type=str,
+        default='json',
+        choices=list(ANNOTATION_FORMATS),
+        help='Write annotation.json, or one annotation per line to annotation.jsonl'
+    )
+    parser.add_argument(
+        '--keep-repeated-steps',
+        action='store_true',
+        help='Start a new step whenever the instruction changes, instead of merging repeats of an earlier instruction'
+    )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help='Ignore any progress ledger from an interrupted run and start over'
+    )
+    parser.add_argument(
+        '--metrics-json',
+        type=str,
+        help='Periodically write per-stage timings and counters to this JSON file'
+    )
+    parser.add_argument(
+        '--metrics-prom',
+        type=str,
+        help='Periodically write the same metrics as a Prometheus textfile'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=30.0,
+        help='Seconds between metrics exports'
+    )
     parser.add_argument(
         '--list-datasets',
         action='store_true',
@@ -240,9 +1036,19 @@ def main():
             print(f"  - {dataset}")
         return
 
-    extractor = RLDSDatasetExtractor(args.base_path)
+    extractor = RLDSDatasetExtractor(args.base_path, streaming=args.streaming,
+                                     early_reject=args.early_reject, encoder=args.encoder,
+                                     encoder_options=parse_encoder_options(args.encoder_option),
+                                     encode_errors=args.encode_errors, encode_workers=args.encode_workers,
+                                     encode_executor=args.encode_executor, queue_depth=args.queue_depth,
+                                     output_format=args.output_format,
+                                     frame_store_shard_bytes=int(args.frame_store_shard_gb * 1024 ** 3),
+                                     merge_repeated_steps=not args.keep_repeated_steps,
+                                     annotation_format=args.annotation_format)
+    reporter = setup_metrics(args.metrics_json, args.metrics_prom, args.metrics_interval)
     try:
-        stats = extractor.process_dataset(args.dataset, args.output_dir)
+        stats = extractor.process_dataset(args.dataset, args.output_dir, workers=args.workers,
+                                          resume=not args.no_resume)
         print(f"\nProcessing completed successfully!")
         print(f"Dataset: {args.dataset}")
         print(f"Total episodes: {stats['total_episodes']}")
@@ -252,6 +1058,9 @@ def main():
         logger.error(f"Processing failed: {str(e)}")
         import sys
         sys.exit(1)
+    finally:
+        if reporter is not None:
+            reporter.stop()
     import sys
     sys.exit(0)
 
@@ -0,0 +1,420 @@
+"""
+Annotation Catalog
+
+One SQLite database indexing the ``annotation.json`` (or ``annotation.jsonl``)
+and ``meta_information.json`` of every extracted dataset of
+``dataset_mapping``, so training mixes can be selected with an indexed query
+instead of loading and scanning every dataset's JSON:
+
+    datasets      one row per dataset: source files and their size/mtime, and
+                  the episode counts of meta_information.json
+    episodes      dataset, id, view, total_frames, horizon, episode_class
+                  ('short'/'long' from short_/long_episode_index), position in
+                  annotation.json and the step_instructions/frame_segment/
+                  temporal_segment lists as JSON
+    segments      one row per step: instruction, frame_start, frame_end,
+                  frames, time_start, time_end
+    episode_text  FTS5 index over the step_instructions of each episode
+                  (porter stemming, so ``open drawer`` also finds "opening the drawer")
+
+``update`` only re-reads datasets whose files changed since they were
+indexed; a changed dataset is replaced in one transaction, so readers never
+see it half written, and datasets whose annotations disappeared are dropped.
+
+Usage:
+    python scripts/annotation_catalog.py update --base-path robot_dataset
+    python scripts/annotation_catalog.py query --min-horizon 3 --text 'drawer NOT close' --limit 10
+    python scripts/annotation_catalog.py stats
+
+    catalog = AnnotationCatalog('robot_dataset/annotation_catalog.sqlite')
+    catalog.count(dataset=['calvin', 'libero_10'], min_horizon=3)
+    episodes = catalog.episodes(text='drawer', max_frames=300)
+    long_ids = catalog.episode_index('calvin', 'long')
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    from .utils import dataset_mapping
+    from .jsonl_io import load_annotations
+    from .orchestrate import select_datasets
+except ImportError:
+    from scripts.utils import dataset_mapping
+    from scripts.jsonl_io import load_annotations
+    from scripts.orchestrate import select_datasets
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CATALOG_FILENAME = 'annotation_catalog.sqlite'
+SCHEMA_VERSION = 1
+EPISODE_CLASSES = ('short', 'long')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY,
+    annotation_path TEXT NOT NULL,
+    annotation_size INTEGER NOT NULL,
+    annotation_mtime_ns INTEGER NOT NULL,
+    meta_path TEXT,
+    meta_size INTEGER,
+    meta_mtime_ns INTEGER,
+    episodes INTEGER NOT NULL,
+    total_episodes INTEGER,
+    filtered_episodes INTEGER,
+    useful_episodes INTEGER,
+    short_episodes INTEGER,
+    long_episodes INTEGER,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    view TEXT,
+    total_frames INTEGER,
+    horizon INTEGER,
+    episode_class TEXT,
+    step_instructions TEXT NOT NULL,
+    frame_segment TEXT NOT NULL,
+    temporal_segment TEXT NOT NULL,
+    UNIQUE (dataset, video_id)
+);
+CREATE INDEX IF NOT EXISTS episodes_position ON episodes (dataset, position);
+CREATE INDEX IF NOT EXISTS episodes_dataset_horizon ON episodes (dataset, horizon, total_frames);
+CREATE INDEX IF NOT EXISTS episodes_dataset_frames ON episodes (dataset, total_frames);
+CREATE INDEX IF NOT EXISTS episodes_horizon ON episodes (horizon, total_frames);
+CREATE INDEX IF NOT EXISTS episodes_frames ON episodes (total_frames);
+CREATE INDEX IF NOT EXISTS episodes_class ON episodes (dataset, episode_class);
+CREATE TABLE IF NOT EXISTS segments (
+    episode_id INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    instruction TEXT NOT NULL,
+    frame_start INTEGER,
+    frame_end INTEGER,
+    frames INTEGER,
+    time_start REAL,
+    time_end REAL,
+    PRIMARY KEY (episode_id, step)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS segments_instruction ON segments (instruction);
+CREATE INDEX IF NOT EXISTS segments_frames ON segments (frames);
+CREATE VIRTUAL TABLE IF NOT EXISTS episode_text USING fts5 (step_instructions, tokenize = 'porter unicode61');
+"""
+
+
+def default_catalog_path(base_path: str) -> str:
+    return os.path.join(base_path, CATALOG_FILENAME)
+
+
+def source_files(dataset_name: str, base_path: str) -> Tuple[Optional[str], str]:
+    """``(annotation file or None, meta_information.json path)`` of a dataset, the way qa_generation.py finds them."""
+    path_mapping, _ = dataset_mapping(base_path)
+    source_dir = 'task_planning' if dataset_name.endswith('_task') else 'video'
+    video_dir = os.path.join(path_mapping[dataset_name], source_dir)
+    annotation_path = None
+    for name in ('annotation.json', 'annotation.jsonl'):
+        if os.path.exists(os.path.join(video_dir, name)):
+            annotation_path = os.path.join(video_dir, name)
+            break
+    return annotation_path, os.path.join(video_dir, 'meta_information.json')
+
+
+def _signature(path: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    if path is None or not os.path.exists(path):
+        return None, None
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class AnnotationCatalog:
+    """
+    SQLite catalog of episode annotations across datasets.
+
+    Args:
+        path: Database file; created with the schema if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f"{path} has catalog schema {version}, expected {SCHEMA_VERSION}; delete it and run update")
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def update(self, base_path: str, datasets: Optional[List[str]] = None, force: bool = False) -> Dict[str, str]:
+        """
+        Bring the catalog up to date with the annotation files under ``base_path``.
+
+        Args:
+            base_path: Base directory of ``dataset_mapping``
+            datasets: Dataset names or glob patterns; all datasets of the mapping if None
+            force: Re-index datasets even if their files are unchanged
+
+        Returns:
+            ``{dataset: 'indexed' | 'unchanged' | 'removed' | 'missing'}``
+        """
+        path_mapping, _ = dataset_mapping(base_path)
+        names = [name for name in select_datasets(datasets or ['*'], base_path) if name in path_mapping]
+        indexed = {row['name']: row for row in self.conn.execute('SELECT * FROM datasets')}
+        status = {}
+        for name in names:
+            annotation_path, meta_path = source_files(name, base_path)
+            if annotation_path is None:
+                if name in indexed:
+                    with self.conn:
+                        self._delete_dataset(name)
+                    status[name] = 'removed'
+                else:
+                    status[name] = 'missing'
+                continue
+            current = _signature(annotation_path) + _signature(meta_path)
+            row = indexed.get(name)
+            if (not force and row is not None and row['annotation_path'] == annotation_path
+                    and (row['annotation_size'], row['annotation_mtime_ns'], row['meta_size'], row['meta_mtime_ns']) == current):
+                status[name] = 'unchanged'
+                continue
+            start = time.perf_counter()
+            count = self.index_dataset(name, annotation_path, meta_path)
+            logger.info(f"Indexed {count} episodes of {name} in {time.perf_counter() - start:.2f}s")
+            status[name] = 'indexed'
+        if 'indexed' in status.values() or 'removed' in status.values():
+            # refresh the planner statistics the indexes are chosen by
+            self.conn.execute('PRAGMA optimize')
+        return status
+
+    def index_dataset(self, name: str, annotation_path: str, meta_path: Optional[str] = None) -> int:
+        """Replace the rows of one dataset with the contents of its annotation and meta information files."""
+        annotation_signature = _signature(annotation_path)
+        meta_signature = _signature(meta_path)
+        annotations = load_annotations(annotation_path)
+        meta = {}
+        if meta_signature[0] is not None:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        episode_class = {}
+        for kind in EPISODE_CLASSES:
+            for video_id in meta.get(f'{kind}_episode_index', []):
+                episode_class[str(video_id)] = kind
+
+        with self.conn:
+            self._delete_dataset(name)
+            first_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM episodes').fetchone()[0]
+            episodes, segments, texts = [], [], []
+            for position, item in enumerate(annotations):
+                episode_id = first_id + position
+                steps = item.get('step_instructions') or []
+                frame_segment = item.get('frame_segment') or []
+                temporal_segment = item.get('temporal_segment') or []
+                video_id = str(item['id'])
+                episodes.append((episode_id, name, video_id, position, item.get('view'), item.get('total_frames'),
+                                 item.get('horizon'), episode_class.get(video_id), json.dumps(steps),
+                                 json.dumps(frame_segment), json.dumps(temporal_segment)))
+                for step, instruction in enumerate(steps):
+                    frame_start, frame_end = frame_segment[step] if step < len(frame_segment) else (None, None)
+                    time_start, time_end = temporal_segment[step] if step < len(temporal_segment) else (None, None)
+                    frames = frame_end - frame_start + 1 if frame_start is not None else None
+                    segments.append((episode_id, step, instruction, frame_start, frame_end, frames, time_start, time_end))
+                texts.append((episode_id, '\n'.join(steps)))
+            self.conn.executemany('INSERT INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', episodes)
+            self.conn.executemany('INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?)', segments)
+            self.conn.executemany('INSERT INTO episode_text (rowid, step_instructions) VALUES (?, ?)', texts)
+            self.conn.execute(
+                'INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, annotation_path, *annotation_signature, meta_path if meta else None, *meta_signature,
+                 len(annotations), meta.get('total_episodes'), meta.get('filtered_episodes'),
+                 meta.get('useful_episodes'), meta.get('short_episodes'), meta.get('long_episodes'), time.time()))
+        return len(annotations)
+
+    def _delete_dataset(self, name: str) -> None:
+        episode_ids = 'SELECT id FROM episodes WHERE dataset = ?'
+        self.conn.execute(f'DELETE FROM episode_text WHERE rowid IN ({episode_ids})', (name,))
+        self.conn.execute(f'DELETE FROM segments WHERE episode_id IN ({episode_ids})', (name,))
+        self.conn.execute('DELETE FROM episodes WHERE dataset = ?', (name,))
+        self.conn.execute('DELETE FROM datasets WHERE name = ?', (name,))
+
+    @staticmethod
+    def _where(dataset: Union[str, Sequence[str], None] = None, min_horizon: Optional[int] = None,
+               max_horizon: Optional[int] = None, min_frames: Optional[int] = None, max_frames: Optional[int] = None,
+               episode_class: Optional[str] = None, text: Optional[str] = None) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if dataset is not None:
+            names = [dataset] if isinstance(dataset, str) else list(dataset)
+            clauses.append(f"e.dataset IN ({', '.join('?' * len(names))})")
+            params.extend(names)
+        for clause, value in (('e.horizon >= ?', min_horizon), ('e.horizon <= ?', max_horizon),
+                              ('e.total_frames >= ?', min_frames), ('e.total_frames <= ?', max_frames),
+                              ('e.episode_class = ?', episode_class)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if text is not None:
+            clauses.append('e.id IN (SELECT rowid FROM episode_text WHERE episode_text MATCH ?)')
+            params.append(text)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def count(self, **filters) -> int:
+        """
+        Number of episodes matching all given filters.
+
+        Args:
+            dataset: Dataset name or list of names
+            min_horizon, max_horizon: Inclusive bounds on the number of steps
+            min_frames, max_frames: Inclusive bounds on total_frames
+            episode_class: 'short' or 'long' as recorded in meta_information.json
+            text: FTS5 query over the step instructions, e.g. ``'drawer NOT close'`` or ``'"pick up"'``
+        """
+        where, params = self._where(**filters)
+        return self.conn.execute(f'SELECT COUNT(*) FROM episodes e{where}', params).fetchone()[0]
+
+    def episodes(self, limit: Optional[int] = None, offset: int = 0, **filters) -> List[Dict[str, Any]]:
+        """Matching episodes as annotation dicts plus ``dataset`` and ``episode_class``, in annotation order; filters as in ``count``."""
+        where, params = self._where(**filters)
+        query = (f'SELECT e.* FROM episodes e{where} ORDER BY e.dataset, e.position'
+                 f'{" LIMIT ? OFFSET ?" if limit is not None else ""}')
+        rows = self.conn.execute(query, params + ([limit, offset] if limit is not None else []))
+        return [self._annotation(row) for row in rows]
+
+    def ids(self, **filters) -> List[Tuple[str, str]]:
+        """``(dataset, video id)`` of the matching episodes; filters as in ``count``."""
+        where, params = self._where(**filters)
+        query = f'SELECT e.dataset, e.video_id FROM episodes e{where} ORDER BY e.dataset, e.position'
+        return [tuple(row) for row in self.conn.execute(query, params)]
+
+    def histogram(self, column: str = 'horizon', **filters) -> Dict[Any, int]:
+        """Episode counts by ``horizon``, ``total_frames``, ``episode_class``, ``dataset`` or ``view``."""
+        if column not in ('horizon', 'total_frames', 'episode_class', 'dataset', 'view'):
+            raise ValueError(f"Cannot group by '{column}'")
+        where, params = self._where(**filters)
+        query = f'SELECT e.{column}, COUNT(*) FROM episodes e{where} GROUP BY e.{column} ORDER BY e.{column}'
+        return {row[0]: row[1] for row in self.conn.execute(query, params)}
+
+    def segments(self, instruction: Optional[str] = None, min_segment_frames: Optional[int] = None,
+                 max_segment_frames: Optional[int] = None, limit: Optional[int] = None, **filters) -> List[Dict[str, Any]]:
+        """
+        Steps of the episodes matching ``filters`` (as in ``count``).
+
+        Args:
+            instruction: Exact step instruction
+            min_segment_frames, max_segment_frames: Inclusive bounds on the frames of the step
+            limit: Maximum number of rows
+        """
+        where, params = self._where(**filters)
+        clauses = [where[len(' WHERE '):]] if where else []
+        for clause, value in (('s.instruction = ?', instruction), ('s.frames >= ?', min_segment_frames),
+                              ('s.frames <= ?', max_segment_frames)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        query = ('SELECT e.dataset, e.video_id, s.* FROM segments s JOIN episodes e ON e.id = s.episode_id'
+                 + (' WHERE ' + ' AND '.join(clauses) if clauses else '')
+                 + ' ORDER BY e.dataset, e.position, s.step' + (' LIMIT ?' if limit is not None else ''))
+        rows = self.conn.execute(query, params + ([limit] if limit is not None else []))
+        return [{'dataset': row['dataset'], 'id': row['video_id'], 'step': row['step'], 'instruction': row['instruction'],
+                 'frame_segment': [row['frame_start'], row['frame_end']], 'frames': row['frames'],
+                 'temporal_segment': [row['time_start'], row['time_end']]} for row in rows]
+
+    def episode_index(self, dataset: str, kind: str = 'long') -> List[str]:
+        """Video ids of ``short_episode_index`` or ``long_episode_index`` of a dataset's meta_information.json."""
+        if kind not in EPISODE_CLASSES:
+            raise ValueError(f"kind must be one of {EPISODE_CLASSES}")
+        rows = self.conn.execute('SELECT video_id FROM episodes WHERE dataset = ? AND episode_class = ? ORDER BY position',
+                                 (dataset, kind))
+        return [row[0] for row in rows]
+
+    def datasets(self) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self.conn.execute('SELECT * FROM datasets ORDER BY name')]
+
+    def sql(self, query: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        """Run any read query against the catalog tables."""
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    @staticmethod
+    def _annotation(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'dataset': row['dataset'],
+            'id': row['video_id'],
+            'view': row['view'],
+            'total_frames': row['total_frames'],
+            'horizon': row['horizon'],
+            'step_instructions': json.loads(row['step_instructions']),
+            'temporal_segment': json.loads(row['temporal_segment']),
+            'frame_segment': json.loads(row['frame_segment']),
+            'episode_class': row['episode_class'],
+        }
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="SQLite catalog of annotation.json/meta_information.json across datasets")
+    parser.add_argument('--base-path', type=str, default='robot_dataset', help='Base directory containing RLDS datasets')
+    parser.add_argument('--db', type=str, help=f'Catalog file (default: <base-path>/{CATALOG_FILENAME})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update = subparsers.add_parser('update', help='index new and changed datasets')
+    update.add_argument('--datasets', nargs='+', help='Dataset names or glob patterns (default: all)')
+    update.add_argument('--force', action='store_true', help='Re-index unchanged datasets too')
+    query = subparsers.add_parser('query', help='print matching episodes as JSON lines')
+    query.add_argument('--datasets', nargs='+', help='Dataset names')
+    query.add_argument('--min-horizon', type=int)
+    query.add_argument('--max-horizon', type=int)
+    query.add_argument('--min-frames', type=int)
+    query.add_argument('--max-frames', type=int)
+    query.add_argument('--episode-class', choices=EPISODE_CLASSES)
+    query.add_argument('--text', type=str, help="FTS5 query over step instructions, e.g. 'drawer NOT close'")
+    query.add_argument('--limit', type=int, help='Maximum number of episodes')
+    query.add_argument('--count', action='store_true', help='Only print the number of matching episodes')
+    subparsers.add_parser('stats', help='print the indexed datasets and their horizon histograms')
+    args = parser.parse_args()
+
+    with AnnotationCatalog(args.db or default_catalog_path(args.base_path)) as catalog:
+        if args.command == 'update':
+            status = catalog.update(args.base_path, args.datasets, force=args.force)
+            for state in ('indexed', 'unchanged', 'removed'):
+                names = [name for name, value in status.items() if value == state]
+                if names:
+                    logger.info(f"{state}: {', '.join(names)}")
+        elif args.command == 'query':
+            filters = dict(dataset=args.datasets, min_horizon=args.min_horizon, max_horizon=args.max_horizon,
+                           min_frames=args.min_frames, max_frames=args.max_frames,
+                           episode_class=args.episode_class, text=args.text)
+            if args.count:
+                print(catalog.count(**filters))
+            else:
+                for episode in catalog.episodes(limit=args.limit, **filters):
+                    print(json.dumps(episode, ensure_ascii=False))
+        else:
+            for dataset in catalog.datasets():
+                print(f"{dataset['name']}: {dataset['episodes']} episodes "
+                      f"(short {dataset['short_episodes']}, long {dataset['long_episodes']}), "
+                      f"horizon {catalog.histogram('horizon', dataset=dataset['name'])}")
+
+
+if __name__ == "__main__":
+    main()
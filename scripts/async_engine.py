@@ -0,0 +1,225 @@
+'''
+Asyncio QA generation engine
+
+Runs QAGenerator.generate_qa_instance for many annotations concurrently.
+Every API call goes through one AsyncOpenAI client, a requests/tokens per
+minute limiter and a retry loop that honours Retry-After on 429s. The
+per-instance prompt/parse logic is the unchanged synchronous QAGenerator code,
+run in worker threads whose llm calls are bridged onto the event loop, so the
+instances are exactly what generate_qa_instance produces.
+'''
+import os
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from openai import AsyncOpenAI
+
+from qa_generator import build_messages, request_params, current_cache_variant
+
+try:
+    from scripts.metrics import metrics
+    from scripts.token_usage import usage
+except ImportError:
+    from metrics import metrics
+    from token_usage import usage
+
+
+class RateLimiter:
+    '''
+    Token buckets for requests and tokens per minute, shared by every task of
+    one event loop. pause() stops all acquisitions, e.g. after a 429.
+    '''
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens=0):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm:
+                    tokens = min(tokens, self.tpm)
+                    if self._tokens < tokens:
+                        wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def retry_after_seconds(error):
+    '''Server-suggested delay from a 429/5xx response, if any.'''
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class AsyncQAEngine:
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+    def __init__(self, qa_generator, concurrency=16, rpm=None, tpm=None, model="gpt-4o",
+                 max_attempts=6, completion_tokens=256, client=None, cache=None):
+        self.qa_generator = qa_generator
+        self.concurrency = concurrency
+        self.model = model
+        self.max_attempts = max_attempts
+        self.completion_tokens = completion_tokens
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self._owns_client = client is None
+        self._client = client
+        self._semaphore = None
+        self.cache = cache
+        self.stats = {"calls": 0, "requests": 0, "retries": 0, "rate_limited": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_API_BASE"),
+                # Retries are handled here so 429s can pause the whole pool.
+                max_retries=0
+            )
+        return self._client
+
+    def estimate_tokens(self, prompt):
+        # ~4 characters per token plus the chat framing and an expected completion
+        return len(str(prompt)) // 4 + 16 + self.completion_tokens
+
+    async def chat(self, prompt, model=None, attempt=0, response_format=None, labels=None, variant=0):
+        '''labels: token usage labels of the calling worker thread, see token_usage; variant: its cache variant'''
+        model = model or self.model
+        messages = build_messages(prompt)
+        params = request_params(response_format)
+        self.stats["calls"] += 1
+        if self.cache is not None:
+            key = self.cache.key(model, messages, attempt=attempt, variant=variant, **params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.count('cache_hits')
+                usage.record_cache_hit(labels)
+                return cached
+        output = await self._request(model, messages, prompt, params, labels)
+        if self.cache is not None and output is not None:
+            self.cache.put(key, output, model=model)
+        return output
+
+    async def _request(self, model, messages, prompt, params=None, labels=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            for attempt in range(self.max_attempts):
+                with metrics.timer('rate_limit_wait'):
+                    await self.limiter.acquire(self.estimate_tokens(prompt))
+                try:
+                    self.stats["requests"] += 1
+                    metrics.count('api_requests')
+                    start = time.perf_counter()
+                    with metrics.timer('api_request'):
+                        response = await self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            **(params or {})
+                        )
+                    usage.record(model, response.usage, time.perf_counter() - start, labels=labels)
+                    return response.choices[0].message.content
+                except self.RETRYABLE_ERRORS as e:
+                    if attempt == self.max_attempts - 1:
+                        raise
+                    delay = retry_after_seconds(e)
+                    if delay is None:
+                        delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                    if isinstance(e, openai.RateLimitError):
+                        self.stats["rate_limited"] += 1
+                        metrics.count('rate_limited')
+                        # Back the whole pool off, not just this request.
+                        self.limiter.pause(delay)
+                    self.stats["retries"] += 1
+                    metrics.count('api_retries')
+                    await asyncio.sleep(delay)
+
+    async def agenerate(self, items, stage, task, on_result=None):
+        '''
+        items: list of (annotation, video_name) or (annotation, video_name, cache variant)
+        on_result: optional callback(position, result), called on the loop as each item finishes
+        returns one generate_qa_instance result per item, in input order
+        '''
+        loop = asyncio.get_running_loop()
+        qa_generator = self.qa_generator
+        # asyncio primitives and the HTTP pool are bound to the loop they were first used on.
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.limiter._lock = None
+        if self._owns_client:
+            self._client = None
+
+        def llm(prompt, model=None, attempt=0, response_format=None):
+            return asyncio.run_coroutine_threadsafe(
+                self.chat(prompt, model, attempt, response_format, labels=usage.current(),
+                          variant=current_cache_variant()), loop).result()
+
+        async def run(position, annotation, video_name, variant=0):
+            result = await loop.run_in_executor(executor, lambda: qa_generator.generate_qa_instance(
+                annotation=annotation, video_name=video_name, stage=stage, task=task, variant=variant))
+            if on_result is not None:
+                on_result(position, result)
+            return result
+
+        previous_llm = qa_generator.llm
+        qa_generator.llm = llm
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='qa')
+        try:
+            tasks = [run(position, *item) for position, item in enumerate(items)]
+            return await asyncio.gather(*tasks)
+        finally:
+            # Don't block the loop: threads still waiting on a chat() are released when it is cancelled.
+            executor.shutdown(wait=False, cancel_futures=True)
+            qa_generator.llm = previous_llm
+            if self._owns_client and self._client is not None:
+                await self._client.close()
+                self._client = None
+
+    def generate(self, items, stage, task, on_result=None):
+        return asyncio.run(self.agenerate(items, stage, task, on_result=on_result))
@@ -0,0 +1,226 @@
+'''
+Offline batch-job mode for QA generation
+
+Instead of calling the API once per question in real time, generation runs in
+rounds of batch files:
+
+1. prepare: every annotation is run through QAGenerator.generate_qa_instance
+   with a recording llm. Each chat request it would send is written to sharded
+   batch-request JSONL files (OpenAI Batch API format). The custom_id is the
+   ResponseCache key of the request, so identical prompts are sent once.
+2. ingest: result JSONL files are loaded into a ResponseCache and every
+   annotation is generated again with a cache-only llm. Requests that are not
+   answered yet (e.g. retries after an unparsable answer) go into the next
+   round's request files; once nothing is missing the instances are complete.
+
+Random choices (question templates, sampled steps) are seeded per annotation,
+so both phases walk through exactly the same prompts and the final instances
+have the same conversations and question_type tags as a live run.
+'''
+import os
+import json
+import glob
+import random
+
+from qa_generator import build_messages, request_params, get_client, placeholder_answer
+
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+
+
+class MissingResponse(Exception):
+    pass
+
+
+def instance_rng(task, stage, index):
+    '''the random choices of one annotation, identical in every phase and independent of the global random state'''
+    return random.Random(f"{task}/{stage}/{index}")
+
+
+class RequestRecorder:
+    '''llm stand-in that records every request (deduplicated by custom_id)'''
+    def __init__(self, cache, model="gpt-4o"):
+        self.cache = cache
+        self.model = model
+        self.requests = {}
+
+    def record(self, prompt, model=None, attempt=0, response_format=None):
+        model = model or self.model
+        messages = build_messages(prompt)
+        params = request_params(response_format)
+        custom_id = self.cache.key(model, messages, attempt=attempt, **params)
+        self.requests.setdefault(custom_id, {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": messages, **params},
+        })
+        return custom_id
+
+    def __call__(self, prompt, model=None, attempt=0, response_format=None):
+        custom_id = self.record(prompt, model, attempt, response_format)
+        cached = self.cache.get(custom_id)
+        # accepted by every parser, so prepare records exactly the first-attempt requests
+        return cached if cached is not None else placeholder_answer(prompt)
+
+
+class CacheOnlyLLM(RequestRecorder):
+    '''answers from the cache; unanswered requests are recorded and abort the instance'''
+    def __call__(self, prompt, model=None, attempt=0, response_format=None):
+        model = model or self.model
+        custom_id = self.cache.key(model, build_messages(prompt), attempt=attempt, **request_params(response_format))
+        cached = self.cache.get(custom_id)
+        if cached is None:
+            self.record(prompt, model, attempt, response_format)
+            raise MissingResponse(custom_id)
+        return cached
+
+
+def write_request_shards(requests, batch_dir, prefix,
+                         max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_BYTES_PER_FILE):
+    os.makedirs(batch_dir, exist_ok=True)
+    paths = []
+    shard, count, size, f = 0, 0, 0, None
+    for request in requests:
+        line = json.dumps(request, ensure_ascii=False) + '\n'
+        if f is None or count >= max_requests or size + len(line) > max_bytes:
+            if f is not None:
+                f.close()
+                shard += 1
+            path = os.path.join(batch_dir, f"{prefix}_{shard:04d}.jsonl")
+            paths.append(path)
+            f = open(path, 'w', encoding='utf-8')
+            count, size = 0, 0
+        f.write(line)
+        count += 1
+        size += len(line.encode('utf-8'))
+    if f is not None:
+        f.close()
+    return paths
+
+
+def next_round(batch_dir, task, stage):
+    rounds = [int(os.path.basename(p).split('_round')[1].split('_')[0])
+              for p in glob.glob(os.path.join(batch_dir, f"{task}_{stage}_round*_requests_*.jsonl"))]
+    return max(rounds) + 1 if rounds else 0
+
+
+def prepare_batch(source_annotation, qa_generator, task, stage, batch_dir, cache, model="gpt-4o"):
+    '''write round-0 request files for every request not already in the cache'''
+    recorder = RequestRecorder(cache, model=model)
+    previous_llm, previous_rng = qa_generator.llm, qa_generator.rng
+    qa_generator.llm = recorder
+    try:
+        for index, item in enumerate(source_annotation):
+            qa_generator.rng = instance_rng(task, stage, index)
+            qa_generator.generate_qa_instance(annotation=item, video_name=item['id'], stage=stage, task=task)
+    finally:
+        qa_generator.llm, qa_generator.rng = previous_llm, previous_rng
+    pending = [r for custom_id, r in recorder.requests.items() if cache.get(custom_id) is None]
+    round_index = next_round(batch_dir, task, stage)
+    return write_request_shards(pending, batch_dir, f"{task}_{stage}_round{round_index}_requests")
+
+
+def ingest_results(result_paths, cache):
+    '''load Batch API result lines into the cache; returns (stored, failed)'''
+    stored, failed = 0, 0
+    for path in result_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    failed += 1
+                    continue
+                body = response["body"]
+                content = body["choices"][0]["message"]["content"]
+                if content is None:
+                    failed += 1
+                    continue
+                cache.put(result["custom_id"], content, model=body.get("model"))
+                stored += 1
+    return stored, failed
+
+
+def build_instances(source_annotation, qa_generator, task, stage, batch_dir, cache, model="gpt-4o"):
+    '''
+    returns (annotation, request_paths); annotation is None while requests are
+    still pending, and request_paths are the next round's files to submit
+    '''
+    llm = CacheOnlyLLM(cache, model=model)
+    previous_llm, previous_rng = qa_generator.llm, qa_generator.rng
+    qa_generator.llm = llm
+    annotation, incomplete = [], 0
+    try:
+        for index, item in enumerate(source_annotation):
+            qa_generator.rng = instance_rng(task, stage, index)
+            try:
+                instance = qa_generator.generate_qa_instance(annotation=item, video_name=item['id'], stage=stage, task=task)
+            except MissingResponse:
+                incomplete += 1
+                continue
+            if isinstance(instance, list):
+                annotation.extend(instance)
+            else:
+                annotation.append(instance)
+    finally:
+        qa_generator.llm, qa_generator.rng = previous_llm, previous_rng
+    if not incomplete:
+        return annotation, []
+    print(f"{incomplete} videos still waiting on {len(llm.requests)} requests")
+    round_index = next_round(batch_dir, task, stage)
+    paths = write_request_shards(llm.requests.values(), batch_dir, f"{task}_{stage}_round{round_index}_requests")
+    return None, paths
+
+
+def run_local_batch(request_path, output_path, answer):
+    '''
+    local stand-in for the Batch API: answer(body) -> completion text is called
+    for every request line and results are written in the Batch output format
+    '''
+    with open(request_path, 'r', encoding='utf-8') as requests, open(output_path, 'w', encoding='utf-8') as results:
+        for line in requests:
+            request = json.loads(line)
+            try:
+                content = answer(request["body"])
+                result = {
+                    "id": f"batch_req_{request['custom_id'][:16]}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": {
+                        "model": request["body"]["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                    }},
+                    "error": None,
+                }
+            except Exception as e:
+                result = {"id": None, "custom_id": request["custom_id"], "response": None,
+                          "error": {"code": type(e).__name__, "message": str(e)}}
+            results.write(json.dumps(result, ensure_ascii=False) + '\n')
+    return output_path
+
+
+def submit_openai_batch(request_path, client=None):
+    '''upload one request file and start a 24h batch job; returns the batch id'''
+    if client is None:
+        client = get_client()
+    with open(request_path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    return batch.id
+
+
+def download_openai_batch(batch_id, output_path, client=None):
+    '''fetch the results of a finished batch job; returns output_path, or None if not finished'''
+    if client is None:
+        client = get_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"batch {batch_id} is {batch.status}")
+        return None
+    with open(output_path, 'wb') as f:
+        f.write(client.files.content(batch.output_file_id).read())
+    return output_path
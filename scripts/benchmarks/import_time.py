@@ -0,0 +1,119 @@
+"""
+Import-Time Budget Check
+
+Imports every entry point in a fresh interpreter and fails when one takes
+longer than ``--budget`` or loads a heavy backend that is meant to be
+imported on first use (TensorFlow/TFDS, decord, PIL, OpenAI, imageio, PyAV,
+pyarrow).
+Short CLI commands are timed end to end against ``--command-budget``. Run it
+after touching module-level imports:
+
+    python scripts/benchmarks/import_time.py
+    python scripts/benchmarks/import_time.py --budget 0.3 --repeat 5
+
+Exits with status 1 if any check fails.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+from typing import Any, Dict, List
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCHMARK_DIR)
+REPO_DIR = os.path.dirname(SCRIPTS_DIR)
+
+HEAVY_MODULES = ['tensorflow', 'tensorflow_datasets', 'decord', 'PIL', 'openai', 'imageio', 'av', 'pyarrow']
+# qa-side modules are imported with scripts/ on sys.path, the way qa_generation.py runs
+MODULES = ['scripts.utils', 'scripts.RLDS_reader', 'scripts.orchestrate', 'scripts.jsonl_io', 'scripts.qa_shards',
+           'scripts.annotation_catalog', 'qa_generator', 'qa_generation']
+COMMANDS = [
+    ['scripts/RLDS_reader.py', '--list-datasets'],
+    ['scripts/qa_generation.py', '--help'],
+    ['scripts/orchestrate.py', '--help'],
+]
+
+_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR, SCRIPTS_DIR] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def time_import(module: str, repeat: int = 3) -> Dict[str, Any]:
+    """Best-of-``repeat`` import time of ``module`` in a fresh interpreter and the heavy modules it loaded."""
+    best = None
+    for _ in range(max(1, repeat)):
+        process = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                 cwd=REPO_DIR, env=_env(), capture_output=True, text=True)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'import failed'
+            return {'seconds': float('nan'), 'heavy': [], 'error': error}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def time_command(command: List[str], repeat: int = 3) -> float:
+    """Best-of-``repeat`` wall time of a CLI command, interpreter start-up included; inf if it fails."""
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        if subprocess.run([sys.executable] + command, cwd=REPO_DIR, env=_env(), capture_output=True).returncode != 0:
+            return float('inf')
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="Check entry point import times against a budget")
+    parser.add_argument('--budget', type=float, default=0.5, help='Seconds allowed per module import')
+    parser.add_argument('--command-budget', type=float, default=1.5, help='Seconds allowed per CLI command')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per check; the fastest counts')
+    args = parser.parse_args()
+
+    failures = 0
+    for module in MODULES:
+        result = time_import(module, args.repeat)
+        problems = [result['error']] if 'error' in result else []
+        if result['seconds'] > args.budget:
+            problems.append(f"over the {args.budget:.2f}s budget")
+        if result['heavy']:
+            problems.append(f"loads {', '.join(result['heavy'])}")
+        failures += bool(problems)
+        status = 'FAIL ' + '; '.join(problems) if problems else 'ok'
+        print(f"import {module:<24} {result['seconds']:7.3f}s  {status}")
+    for command in COMMANDS:
+        seconds = time_command(command, args.repeat)
+        over = seconds > args.command_budget
+        failures += over
+        status = f"FAIL over the {args.command_budget:.2f}s budget" if over else 'ok'
+        print(f"run    {' '.join(command):<40} {seconds:7.3f}s  {status}")
+    if failures:
+        logger.error(f"{failures} import-time check(s) failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
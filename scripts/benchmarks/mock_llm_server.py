@@ -0,0 +1,224 @@
+"""
+Mock OpenAI-Compatible Chat Endpoint
+
+A local stand-in for ``/v1/chat/completions`` so QA generation can be
+benchmarked and exercised without API spend. Point the clients at it with
+``OPENAI_API_BASE=http://127.0.0.1:<port>/v1``.
+
+Responses follow the prompt: prompts asking for JSON get a
+``{"question": ..., "answer": ...}`` object (an array of them, one per
+question type, for combined prompts), others a caption sentence. The
+server can add latency, fail a fraction of requests with a 500, return
+malformed JSON for a fraction (every other one is a repairable python dict
+repr, the rest unparsable text, exercising QAGenerator's repair and retries;
+requests with a ``json_schema`` response_format always get valid JSON) and enforce
+a requests-per-minute limit with 429s carrying ``Retry-After``, like the real
+API. ``GET /stats`` returns the request counters.
+
+Usage:
+    python scripts/benchmarks/mock_llm_server.py --port 8765 --latency-ms 300 --jitter-ms 100 --error-rate 0.01 --rpm 3000
+"""
+
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CHAT_PATHS = ('/v1/chat/completions', '/chat/completions')
+JSON_ANSWER = {"question": "What is the robot doing in the video?",
+               "answer": "The robot picks up the red block and places it in the drawer."}
+TEXT_ANSWER = "The robot arm picks up the red block and places it in the drawer."
+# question types listed by QAGenerator.get_combined_prompt
+COMBINED_TYPES = re.compile(r'based on the video: (.*?)\. Then you need')
+
+
+class MockLLMServer:
+    """
+    Threaded mock chat completion server.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind; 0 picks a free one (see ``base_url``)
+        latency_ms: Mean added latency per request
+        jitter_ms: Uniform +/- jitter around ``latency_ms``
+        error_rate: Fraction of requests answered with a 500
+        bad_json_rate: Fraction of JSON prompts answered with unparsable text
+        rpm: Requests per minute before 429s are returned, unlimited when None
+        seed: Seed of the error/latency draws
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, bad_json_rate: float = 0.0, rpm: Optional[int] = None, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.bad_json_rate = bad_json_rate
+        self.rpm = rpm
+        self.stats = {"requests": 0, "completions": 0, "errors": 0, "rate_limited": 0, "bad_json": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []
+        self._thread = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip('/') != '/stats':
+                    return self._send(404, {"error": {"message": "not found"}})
+                with server._lock:
+                    self._send(200, dict(server.stats))
+
+            def do_POST(self):
+                if self.path not in CHAT_PATHS:
+                    return self._send(404, {"error": {"message": "not found"}})
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, payload, headers = server.handle(body)
+                self._send(status, payload, headers)
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _admit(self, now: float) -> Optional[float]:
+        """None if the request is within the rpm limit, else seconds until it would be."""
+        if self.rpm is None:
+            return None
+        self._window = [t for t in self._window if now - t < 60.0]
+        if len(self._window) >= self.rpm:
+            return 60.0 - (now - self._window[0])
+        self._window.append(now)
+        return None
+
+    def handle(self, body: Dict[str, Any]):
+        """Answer one chat completion request: ``(status, payload, headers)``."""
+        with self._lock:
+            self.stats["requests"] += 1
+            request_id = self.stats["requests"]
+            wait = self._admit(time.monotonic())
+            if wait is not None:
+                self.stats["rate_limited"] += 1
+                return 429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                       "code": "rate_limit_exceeded"}}, {"Retry-After": f"{wait:.3f}"}
+            fail = self._random.random() < self.error_rate
+            bad_json = self._random.random() < self.bad_json_rate
+            latency = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        time.sleep(latency)
+        if fail:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 500, {"error": {"message": "The server had an error", "type": "server_error"}}, {}
+
+        messages = body.get('messages') or [{"content": ""}]
+        prompt = str(messages[-1].get('content', ''))
+        structured = (body.get('response_format') or {}).get('type') == 'json_schema'
+        combined = COMBINED_TYPES.search(prompt) if 'JSON array' in prompt else None
+        if combined:
+            answer = [dict(JSON_ANSWER, question_type=q_type) for q_type in combined.group(1).split(', ')]
+            if structured:
+                answer = {"qa_pairs": answer}
+        elif 'JSON' in prompt:
+            answer = JSON_ANSWER
+        else:
+            answer = None
+        if answer is None:
+            content = TEXT_ANSWER
+            bad_json = False
+        else:
+            bad_json = bad_json and not structured
+            if not bad_json:
+                content = json.dumps(answer)
+            elif request_id % 2:
+                content = f"```python\n{answer!r}\n```"
+            else:
+                content = "Sorry, I can't answer that."
+        prompt_tokens = len(''.join(str(m.get('content', '')) for m in messages)) // 4 + 8
+        completion_tokens = len(content) // 4 + 1
+        with self._lock:
+            self.stats["completions"] += 1
+            self.stats["bad_json"] += int(bad_json)
+        return 200, {
+            "id": f"chatcmpl-mock-{request_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'mock'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, {}
+
+    def start(self) -> 'MockLLMServer':
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI-compatible chat completion endpoint")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform +/- jitter around the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failing with a 500')
+    parser.add_argument('--bad-json-rate', type=float, default=0.0,
+                        help='Fraction of JSON prompts answered with unparsable text')
+    parser.add_argument('--rpm', type=int, help='Requests per minute before 429s')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, bad_json_rate=args.bad_json_rate, rpm=args.rpm, seed=args.seed)
+    logger.info(f"Mock chat completions at {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logger.info(f"Served {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
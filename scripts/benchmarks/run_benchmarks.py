@@ -0,0 +1,491 @@
+"""
+Pipeline Benchmarks
+
+Measures the throughput of the pipeline stages on synthetic inputs, so
+changes can be compared without real Open X-Embodiment data or API spend:
+
+    get_unique_instruction  instruction segmentation              episodes/s, frames/s
+    save_video              episode encoding (--encoder)           episodes/s, frames/s
+    read_video_decord       video decoding                         episodes/s, frames/s
+    generate_qa_instance    QA generation against the mock server  videos/s, QA/s, requests/s
+    process_dataset         RLDS extraction of a synthetic dataset episodes/s, frames/s (needs tensorflow_datasets)
+
+Each benchmark runs in a fresh process so its peak RSS (``ru_maxrss``) is
+its own, and reports the best of ``--repeat`` runs. Every invocation appends
+one record to the ``--results`` JSONL history and each benchmark is compared
+with the latest earlier record of the same workload (restricted to the
+``--baseline`` label if given); throughput drops or RSS growth beyond
+``--threshold`` are flagged as regressions.
+
+Usage:
+    python scripts/benchmarks/run_benchmarks.py --label before
+    python scripts/benchmarks/run_benchmarks.py --benchmarks save_video read_video_decord --encoder pyav --baseline before
+    python scripts/benchmarks/run_benchmarks.py --benchmarks generate_qa_instance --qa-concurrency 32 --latency-ms 400
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import socket
+import logging
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from ..utils import dataset_mapping, save_video, read_video_decord, generate_meta_information
+    from ..utils import get_unique_instruction, get_unique_instruction_batch
+    from ..video_encoders import ENCODERS
+    from ..jsonl_io import JsonlWriter, iter_jsonl, load_annotations
+    from ..token_usage import usage
+    from .synthetic_rlds import INSTRUCTION_PATTERNS, episode_instructions, synthetic_frames, write_synthetic_dataset
+except ImportError:
+    from scripts.utils import dataset_mapping, save_video, read_video_decord, generate_meta_information
+    from scripts.utils import get_unique_instruction, get_unique_instruction_batch
+    from scripts.video_encoders import ENCODERS
+    from scripts.jsonl_io import JsonlWriter, iter_jsonl, load_annotations
+    from scripts.token_usage import usage
+    from scripts.benchmarks.synthetic_rlds import (INSTRUCTION_PATTERNS, episode_instructions, synthetic_frames,
+                                                   write_synthetic_dataset)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCHMARK_DIR)
+# distinct synthetic episodes held in memory and cycled through by the video benchmarks
+FRAME_POOL_SIZE = 4
+# arguments that don't describe a workload and are not stored with the results
+RUN_ARGS = {'benchmarks', 'repeat', 'work_dir', 'results', 'label', 'baseline', 'threshold', 'fail_on_regression'}
+_EPISODE_ARGS = ['min_length', 'max_length', 'pattern', 'segments', 'keep_repeated_steps', 'seed']
+# arguments a benchmark's result depends on; a baseline must match all of them
+WORKLOAD_ARGS = {
+    'get_unique_instruction': ['episodes', *_EPISODE_ARGS],
+    'save_video': ['episodes', *_EPISODE_ARGS, 'height', 'width', 'encoder'],
+    'read_video_decord': ['episodes', *_EPISODE_ARGS, 'height', 'width'],
+    'generate_qa_instance': [*_EPISODE_ARGS, 'qa_task', 'qa_stage', 'qa_videos', 'qa_concurrency', 'qa_combine',
+                             'qa_structured', 'qa_prompt_format', 'latency_ms',
+                             'jitter_ms', 'error_rate', 'bad_json_rate', 'mock_rpm'],
+    'process_dataset': ['episodes', *_EPISODE_ARGS, 'height', 'width', 'encoder', 'dataset', 'invalid_fraction',
+                        'workers', 'streaming', 'early_reject'],
+}
+
+
+def _episodes(config: Dict[str, Any]) -> List[List[str]]:
+    rng = np.random.default_rng(config['seed'])
+    lengths = rng.integers(config['min_length'], config['max_length'] + 1, size=config['episodes'])
+    return [episode_instructions(rng, int(length), config['pattern'], config['segments']) for length in lengths]
+
+
+def _frame_pool(config: Dict[str, Any]) -> List[np.ndarray]:
+    rng = np.random.default_rng(config['seed'])
+    lengths = rng.integers(config['min_length'], config['max_length'] + 1, size=min(FRAME_POOL_SIZE, config['episodes']))
+    return [synthetic_frames(rng, int(length), config['height'], config['width']) for length in lengths]
+
+
+def _best_of(repeat: int, run: Callable[[], Dict[str, int]], reset: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    Time ``run`` ``repeat`` times and turn the counts of the fastest run into rates.
+
+    Args:
+        repeat: Number of timed runs
+        run: Does the work once and returns counts such as ``{'episodes': n, 'frames': m}``
+        reset: Called untimed before every run, e.g. to clear the previous run's output
+
+    Returns:
+        ``seconds`` of the fastest run, the counts and ``<count>_per_s`` for each count
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        counts = run()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, counts)
+    seconds, counts = best
+    metrics = {'seconds': round(seconds, 4), **counts}
+    for unit, count in counts.items():
+        metrics[f'{unit}_per_s'] = round(count / seconds, 2) if seconds > 0 else None
+    return metrics
+
+
+def bench_get_unique_instruction(config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """Segment every synthetic episode one at a time; the batched variant is reported alongside."""
+    episodes = _episodes(config)
+    frames = sum(len(instructions) for instructions in episodes)
+    merge_repeats = not config['keep_repeated_steps']
+
+    def run():
+        for instructions in episodes:
+            get_unique_instruction(instructions, merge_repeats=merge_repeats)
+        return {'episodes': len(episodes), 'frames': frames}
+
+    def run_batch():
+        get_unique_instruction_batch(episodes, merge_repeats=merge_repeats)
+        return {'frames': frames}
+
+    metrics = _best_of(repeat, run)
+    metrics['batch_frames_per_s'] = _best_of(repeat, run_batch)['frames_per_s']
+    return metrics
+
+
+def _write_videos(config: Dict[str, Any], video_dir: str) -> Dict[str, int]:
+    pool = _frame_pool(config)
+    extension = ENCODERS[config['encoder']].extension
+    frames = 0
+    for index in range(config['episodes']):
+        frames += save_video(pool[index % len(pool)], os.path.join(video_dir, f'{index:06d}{extension}'),
+                             backend=config['encoder'])
+    return {'episodes': config['episodes'], 'frames': frames}
+
+
+def bench_save_video(config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """Encode ``--episodes`` episodes from a small pool of pre-rendered frame arrays."""
+    video_dir = os.path.join(work_dir, 'save_video')
+
+    def reset():
+        shutil.rmtree(video_dir, ignore_errors=True)
+        os.makedirs(video_dir)
+
+    metrics = _best_of(repeat, lambda: _write_videos(config, video_dir), reset)
+    metrics['mb_written'] = round(sum(entry.stat().st_size for entry in os.scandir(video_dir)) / 2**20, 2)
+    return metrics
+
+
+def bench_read_video_decord(config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """Decode every frame of ``--episodes`` imageio-encoded MP4s."""
+    video_dir = os.path.join(work_dir, 'read_video_decord')
+    shutil.rmtree(video_dir, ignore_errors=True)
+    os.makedirs(video_dir)
+    _write_videos(dict(config, encoder='imageio'), video_dir)
+    paths = sorted(entry.path for entry in os.scandir(video_dir))
+
+    def run():
+        frames = 0
+        for path in paths:
+            frames += len(read_video_decord(path))
+        return {'episodes': len(paths), 'frames': frames}
+
+    return _best_of(repeat, run)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _server_stats(base_url: str) -> Dict[str, int]:
+    with urllib.request.urlopen(base_url.rsplit('/v1', 1)[0] + '/stats', timeout=5) as response:
+        return json.load(response)
+
+
+def _start_mock_server(config: Dict[str, Any]) -> Tuple[subprocess.Popen, str]:
+    """Run the mock endpoint in its own process so it doesn't share the client's GIL."""
+    port = _free_port()
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, 'mock_llm_server.py'), '--port', str(port),
+               '--latency-ms', str(config['latency_ms']), '--jitter-ms', str(config['jitter_ms']),
+               '--error-rate', str(config['error_rate']), '--bad-json-rate', str(config['bad_json_rate']),
+               '--seed', str(config['seed'])]
+    if config['mock_rpm']:
+        command += ['--rpm', str(config['mock_rpm'])]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            _server_stats(base_url)
+            return server, base_url
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("mock LLM server did not start")
+            time.sleep(0.05)
+
+
+def bench_generate_qa_instance(config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """
+    Generate QA for ``--qa-videos`` synthetic annotations of ``--qa-task``
+    against the mock endpoint, sequentially or through the async engine
+    with ``--qa-concurrency`` > 1; ``--qa-combine`` asks for all GPT question
+    types of a video in one request and ``--qa-structured`` for
+    schema-constrained answers. Reports QAGenerator's JSON parse stats and
+    the prompt/completion tokens per video, e.g. to A/B ``--qa-prompt-format``.
+    """
+    server, base_url = _start_mock_server(config)
+    try:
+        # qa_generator builds its client from the environment on the first request
+        os.environ['OPENAI_API_BASE'] = base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'mock')
+        sys.path.insert(0, SCRIPTS_DIR)
+        from qa_generator import QAGenerator
+        from async_engine import AsyncQAEngine
+        # one INFO line per request otherwise
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+        _, task_mapping = dataset_mapping('')
+        task = config['qa_task']
+        if task not in task_mapping:
+            raise ValueError(f"No QA task list for '{task}'. Available: {list(task_mapping.keys())}")
+        qa_generator = QAGenerator(task_list=task_mapping[task], combine_questions=config['qa_combine'],
+                                   structured_output=config['qa_structured'],
+                                   prompt_format=config['qa_prompt_format'])
+        meta_information = {"long_episodes": 0, "short_episodes": 0, "long_episode_index": [], "short_episode_index": []}
+        items = []
+        for index, instructions in enumerate(_episodes(dict(config, episodes=config['qa_videos']))):
+            annotation = generate_meta_information(f'{index:06d}', 'synthetic', instructions, meta_information,
+                                                   merge_repeats=not config['keep_repeated_steps'])
+            items.append((annotation, f'{index:06d}.mp4'))
+
+        def run():
+            if config['qa_concurrency'] > 1:
+                engine = AsyncQAEngine(qa_generator, concurrency=config['qa_concurrency'])
+                results = engine.generate(items, config['qa_stage'], task)
+            else:
+                results = [qa_generator.generate_qa_instance(annotation=annotation, video_name=video_name,
+                                                             stage=config['qa_stage'], task=task)
+                           for annotation, video_name in items]
+            qa = sum(len(result) if isinstance(result, list) else 1 for result in results)
+            return {'videos': len(items), 'qa': qa}
+
+        usage.reset()
+        before = _server_stats(base_url)
+        metrics = _best_of(repeat, run)
+        after = _server_stats(base_url)
+        runs = max(1, repeat)
+        requests = (after['requests'] - before['requests']) / runs
+        metrics['requests_per_video'] = round(requests / max(1, len(items)), 2)
+        metrics['requests_per_s'] = round(requests / metrics['seconds'], 2) if metrics['seconds'] else None
+        metrics['server'] = {key: after[key] - before[key] for key in after}
+        metrics['parse_stats'] = qa_generator.parse_report()
+        total = usage.report()['total']
+        metrics['prompt_tokens_per_video'] = round(total['prompt_tokens'] / runs / max(1, len(items)), 1)
+        metrics['completion_tokens_per_video'] = round(total['completion_tokens'] / runs / max(1, len(items)), 1)
+        return metrics
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_process_dataset(config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """Extract a synthetic RLDS dataset of ``--dataset`` (generated once per workload and reused)."""
+    try:
+        from ..RLDS_reader import RLDSDatasetExtractor
+    except ImportError:
+        from scripts.RLDS_reader import RLDSDatasetExtractor
+
+    dataset = config['dataset']
+    workload = f"{dataset}-{config['episodes']}x{config['min_length']}-{config['max_length']}" \
+               f"-{config['height']}x{config['width']}-{config['pattern']}{config['segments']}-s{config['seed']}"
+    base_path = os.path.join(work_dir, 'rlds', workload)
+    if not os.path.isdir(dataset_mapping(base_path)[0][dataset]):
+        write_synthetic_dataset(dataset, base_path, episodes=config['episodes'], min_length=config['min_length'],
+                                max_length=config['max_length'], height=config['height'], width=config['width'],
+                                pattern=config['pattern'], segments=config['segments'],
+                                invalid_fraction=config['invalid_fraction'], seed=config['seed'])
+    extractor = RLDSDatasetExtractor(base_path, streaming=config['streaming'], early_reject=config['early_reject'],
+                                     encoder=config['encoder'],
+                                     merge_repeated_steps=not config['keep_repeated_steps'])
+    output_dir = os.path.join(work_dir, 'process_dataset')
+
+    def reset():
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    def run():
+        stats = extractor.process_dataset(dataset, output_dir=output_dir, workers=config['workers'], resume=False)
+        return {'episodes': stats['total_episodes'], 'useful_episodes': stats['useful_episodes']}
+
+    metrics = _best_of(repeat, run, reset)
+    frames = sum(annotation['total_frames'] for annotation in load_annotations(os.path.join(output_dir, 'annotation.json')))
+    metrics['frames'] = frames
+    metrics['frames_per_s'] = round(frames / metrics['seconds'], 2) if metrics['seconds'] else None
+    return metrics
+
+
+BENCHMARKS = {
+    'get_unique_instruction': bench_get_unique_instruction,
+    'save_video': bench_save_video,
+    'read_video_decord': bench_read_video_decord,
+    'generate_qa_instance': bench_generate_qa_instance,
+    'process_dataset': bench_process_dataset,
+}
+
+
+def _peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def _run_benchmark(name: str, config: Dict[str, Any], work_dir: str, repeat: int) -> Dict[str, Any]:
+    """Worker entry point: run one benchmark and add its peak RSS."""
+    metrics = BENCHMARKS[name](config, work_dir, repeat)
+    metrics['peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF)
+    children = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    if children:
+        # largest single child (extraction worker, ffmpeg, mock server), not their sum
+        metrics['children_peak_rss_mb'] = children
+    return metrics
+
+
+def run_benchmarks(names: List[str], config: Dict[str, Any], work_dir: str, repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Run each benchmark in its own spawned process; failures are recorded instead of aborting the suite."""
+    results = {}
+    context = mp.get_context('spawn')
+    for name in names:
+        logger.info(f"Running {name}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                results[name] = pool.submit(_run_benchmark, name, config, work_dir, repeat).result()
+            except Exception as e:
+                logger.error(f"{name} failed: {e!r}")
+                results[name] = {'error': repr(e)}
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_baseline(results_path: str, config: Dict[str, Any], name: str,
+                  label: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Latest earlier record of the same ``name`` workload with a successful result (and ``label``, if given)."""
+    if not os.path.exists(results_path):
+        return None
+    workload = {key: config.get(key) for key in WORKLOAD_ARGS[name]}
+    baseline = None
+    for record in iter_jsonl(results_path):
+        result = record.get('results', {}).get(name)
+        if result is None or 'error' in result:
+            continue
+        if {key: record.get('config', {}).get(key) for key in WORKLOAD_ARGS[name]} != workload:
+            continue
+        if label is None or record.get('label') == label:
+            baseline = record
+    return baseline
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Relative change of every rate and of peak RSS. Rates are better when
+    higher and RSS when lower; a change worse than ``threshold`` is a regression.
+    """
+    rows = []
+    for metric, value in current.items():
+        old = previous.get(metric)
+        higher_is_better = metric.endswith('_per_s')
+        if not (higher_is_better or metric.endswith('rss_mb')) or not value or not old:
+            continue
+        change = (value - old) / old
+        worse = -change if higher_is_better else change
+        rows.append({'metric': metric, 'previous': old, 'current': value, 'change': change,
+                     'regression': worse > threshold})
+    return rows
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data and a mock LLM endpoint")
+    parser.add_argument('--benchmarks', nargs='+', default=[name for name in BENCHMARKS if name != 'process_dataset'],
+                        choices=list(BENCHMARKS), help='Benchmarks to run (process_dataset needs tensorflow_datasets)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark; the fastest is reported')
+    parser.add_argument('--work-dir', type=str, help='Scratch directory, kept so synthetic datasets are reused '
+                                                     '(default: a temporary directory)')
+    parser.add_argument('--results', type=str, default='benchmark_results.jsonl', help='JSONL results history')
+    parser.add_argument('--label', type=str, help='Name stored with this run, e.g. a branch or change')
+    parser.add_argument('--baseline', type=str, help='Compare against the latest run with this label')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on a regression')
+    # workload
+    parser.add_argument('--episodes', type=int, default=50)
+    parser.add_argument('--min-length', type=int, default=30, help='Shortest episode, in steps')
+    parser.add_argument('--max-length', type=int, default=120, help='Longest episode, in steps')
+    parser.add_argument('--height', type=int, default=128)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--pattern', type=str, default='segments', choices=INSTRUCTION_PATTERNS)
+    parser.add_argument('--segments', type=int, default=4, help='Sub-tasks per episode (segments, revisit)')
+    parser.add_argument('--invalid-fraction', type=float, default=0.0, help='Episodes filtered by process_dataset')
+    parser.add_argument('--keep-repeated-steps', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encoder', type=str, default='imageio', choices=list(ENCODERS.keys()))
+    parser.add_argument('--dataset', type=str, default='bridge_data_v2', help='Layout used by process_dataset')
+    parser.add_argument('--workers', type=int, default=1, help='process_dataset worker processes')
+    parser.add_argument('--streaming', action='store_true', help='process_dataset with --streaming')
+    parser.add_argument('--early-reject', action='store_true', help='process_dataset with --early-reject')
+    parser.add_argument('--qa-task', type=str, default='calvin', help='Dataset whose QA task list is generated')
+    parser.add_argument('--qa-stage', type=str, default='Finetune', help='Pretrain or Finetune')
+    parser.add_argument('--qa-videos', type=int, default=20)
+    parser.add_argument('--qa-concurrency', type=int, default=1, help='>1 uses the async engine')
+    parser.add_argument('--qa-combine', action='store_true', help='One request for all GPT question types of a video')
+    parser.add_argument('--qa-structured', action='store_true', help='Request schema-constrained JSON answers')
+    parser.add_argument('--qa-prompt-format', type=str, default='repr', help='repr, json or compact video content in prompts')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mock server latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Mock server 500 rate')
+    parser.add_argument('--bad-json-rate', type=float, default=0.0, help='Mock server unparsable answer rate')
+    parser.add_argument('--mock-rpm', type=int, help='Mock server requests per minute before 429s')
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in RUN_ARGS}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='robox_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(args.benchmarks, config, work_dir, args.repeat)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = 0
+    for name, metrics in results.items():
+        print(f"\n{name}: " + ", ".join(f"{key}={value}" for key, value in metrics.items() if not isinstance(value, dict)))
+        if 'error' in metrics:
+            continue
+        baseline = find_baseline(args.results, config, name, args.baseline)
+        if baseline is None:
+            print("    no baseline for this workload")
+            continue
+        print(f"    vs {baseline.get('label') or ''} {baseline['commit'] or ''} ({baseline['timestamp']})")
+        for row in compare(metrics, baseline['results'][name], args.threshold):
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"    {row['metric']:<24} {row['previous']:>12} -> {row['current']:>12} {row['change']:+7.1%}{flag}")
+            regressions += row['regression']
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'label': args.label,
+        'commit': _git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': config,
+        'results': results,
+    }
+    with JsonlWriter(args.results) as writer:
+        writer.write(record)
+    logger.info(f"Results appended to {args.results}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
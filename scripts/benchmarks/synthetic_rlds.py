@@ -0,0 +1,270 @@
+"""
+Synthetic RLDS Dataset Generator
+
+Writes small TFDS/RLDS datasets with the same layout as the real Open
+X-Embodiment releases read by ``RLDS_reader.py``: the camera image is stored
+under the dataset's ``IMAGE_KEYS`` entry and the instruction either as a
+step-level ``language_instruction`` (``LANGUAGE_INSTRUCTION_DATASETS``) or as
+``observation/natural_language_instruction``. The dataset is placed at its
+``dataset_mapping`` path under ``--base-path``, so the extractor, the
+orchestrator and the benchmarks can run against it unchanged.
+
+Instruction patterns:
+
+    single    one instruction for the whole episode (most OXE datasets)
+    segments  ``--segments`` distinct sub-tasks in a row (long-horizon datasets such as calvin)
+    revisit   sub-tasks that come back later, A, B, A, ... (exercises --keep-repeated-steps)
+
+``--invalid-fraction`` of the episodes get an instruction that
+``is_episode_valid`` rejects, to exercise filtering and ``--early-reject``.
+
+Usage:
+    python scripts/benchmarks/synthetic_rlds.py --dataset calvin --base-path /tmp/synthetic --episodes 200 --pattern segments
+    python scripts/benchmarks/synthetic_rlds.py --dataset bridge_data_v2 --base-path /tmp/synthetic --height 256 --width 256
+"""
+
+import os
+import re
+import shutil
+import logging
+import argparse
+import tempfile
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+try:
+    from ..utils import dataset_mapping
+except ImportError:
+    from scripts.utils import dataset_mapping
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+INSTRUCTION_PATTERNS = ('single', 'segments', 'revisit')
+IMAGE_ENCODINGS = ('jpeg', 'png')
+DEFAULT_VERSION = '1.0.0'
+
+VERBS = ['pick up', 'put down', 'push', 'open', 'close', 'move', 'rotate', 'lift', 'slide', 'place']
+OBJECTS = ['the red block', 'the blue cup', 'the drawer', 'the green bowl', 'the sponge',
+           'the pot lid', 'the yellow banana', 'the light switch', 'the towel', 'the spoon']
+INVALID_INSTRUCTIONS = ['', 'pick up block 3', 'move_arm(x=0.2)']
+
+
+def episode_instructions(rng: np.random.Generator, length: int, pattern: str, segments: int) -> List[str]:
+    """Per-step instructions of one episode for an instruction pattern."""
+    if pattern not in INSTRUCTION_PATTERNS:
+        raise ValueError(f"Unknown instruction pattern '{pattern}'. Available: {INSTRUCTION_PATTERNS}")
+
+    def instruction() -> str:
+        return f"{VERBS[rng.integers(len(VERBS))]} {OBJECTS[rng.integers(len(OBJECTS))]}"
+
+    if pattern == 'single':
+        return [instruction()] * length
+    num_segments = max(1, min(segments, length))
+    if pattern == 'segments':
+        tasks = [instruction() for _ in range(num_segments)]
+    else:
+        distinct = [instruction() for _ in range(max(1, (num_segments + 1) // 2))]
+        tasks = [distinct[i % len(distinct)] for i in range(num_segments)]
+    # segment boundaries at sorted random cut points
+    cuts = np.sort(rng.choice(np.arange(1, length), size=num_segments - 1, replace=False)) if num_segments > 1 else []
+    bounds = [0, *[int(c) for c in cuts], length]
+    steps = []
+    for task, start, end in zip(tasks, bounds[:-1], bounds[1:]):
+        steps.extend([task] * (end - start))
+    return steps
+
+
+def synthetic_frames(rng: np.random.Generator, length: int, height: int, width: int) -> np.ndarray:
+    """
+    ``(length, height, width, 3)`` uint8 frames: a static gradient background
+    with a square moving across it plus a little sensor noise, so encoders see
+    roughly the temporal redundancy of a real tabletop camera.
+    """
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    colour = rng.integers(0, 256, size=3).astype(np.float32)
+    background = np.stack([(y + x) / 2, np.broadcast_to(y, (height, width)), np.broadcast_to(x, (height, width))], axis=-1)
+    background = 0.6 * background + 0.4 * colour
+    frames = np.broadcast_to(background.astype(np.uint8), (length, height, width, 3)).copy()
+    size = max(2, min(height, width) // 6)
+    start = rng.integers(0, [max(1, height - size), max(1, width - size)])
+    velocity = rng.integers(-3, 4, size=2)
+    for t in range(length):
+        top, left = (start + velocity * t) % [max(1, height - size), max(1, width - size)]
+        frames[t, top:top + size, left:left + size] = 255 - colour.astype(np.uint8)
+    noise = rng.integers(0, 8, size=frames.shape, dtype=np.uint8)
+    return frames + np.minimum(noise, 255 - frames)
+
+
+def _layout(dataset_name: str) -> Tuple[str, bool]:
+    """``(image key, instruction stored on the step)`` the extractor expects for ``dataset_name``."""
+    try:
+        from ..RLDS_reader import RLDSDatasetExtractor
+    except ImportError:
+        from scripts.RLDS_reader import RLDSDatasetExtractor
+    image_key = RLDSDatasetExtractor.IMAGE_KEYS.get(dataset_name, RLDSDatasetExtractor.IMAGE_KEYS['default'])
+    return image_key, dataset_name in RLDSDatasetExtractor.LANGUAGE_INSTRUCTION_DATASETS
+
+
+def _version(dataset_path: str) -> str:
+    """TFDS version taken from the mapping path (``.../droid/1.0.0``) when it ends in one."""
+    last = os.path.basename(os.path.normpath(dataset_path))
+    return last if re.fullmatch(r'\d+\.\d+\.\d+', last) else DEFAULT_VERSION
+
+
+def _features(dataset_name: str, height: int, width: int, image_encoding: str) -> Any:
+    import tensorflow_datasets as tfds
+
+    image_key, language_step = _layout(dataset_name)
+    observation = {
+        image_key: tfds.features.Image(shape=(height, width, 3), dtype=np.uint8, encoding_format=image_encoding),
+    }
+    step = {
+        'reward': tfds.features.Scalar(dtype=np.float32),
+        'is_first': tfds.features.Scalar(dtype=np.bool_),
+        'is_last': tfds.features.Scalar(dtype=np.bool_),
+        'is_terminal': tfds.features.Scalar(dtype=np.bool_),
+    }
+    if language_step:
+        step['language_instruction'] = tfds.features.Text()
+    else:
+        observation['natural_language_instruction'] = tfds.features.Text()
+    step['observation'] = tfds.features.FeaturesDict(observation)
+    return tfds.features.FeaturesDict({'steps': tfds.features.Dataset(step)})
+
+
+def generate_episodes(dataset_name: str, episodes: int, min_length: int, max_length: int,
+                      height: int, width: int, pattern: str = 'single', segments: int = 4,
+                      invalid_fraction: float = 0.0, seed: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(key, example)`` RLDS episodes in the layout of ``dataset_name``."""
+    rng = np.random.default_rng(seed)
+    image_key, language_step = _layout(dataset_name)
+    for index in range(episodes):
+        length = int(rng.integers(min_length, max_length + 1))
+        instructions = episode_instructions(rng, length, pattern, segments)
+        if rng.random() < invalid_fraction:
+            instructions[-1] = INVALID_INSTRUCTIONS[rng.integers(len(INVALID_INSTRUCTIONS))]
+        frames = synthetic_frames(rng, length, height, width)
+        success = bool(rng.random() < 0.8)
+        steps = []
+        for t in range(length):
+            observation = {image_key: frames[t]}
+            step = {
+                'reward': np.float32(1.0 if success and t == length - 1 else 0.0),
+                'is_first': t == 0,
+                'is_last': t == length - 1,
+                'is_terminal': t == length - 1,
+            }
+            if language_step:
+                step['language_instruction'] = instructions[t]
+            else:
+                observation['natural_language_instruction'] = instructions[t]
+            step['observation'] = observation
+            steps.append(step)
+        yield f"episode_{index:06d}", {'steps': steps}
+
+
+def write_synthetic_dataset(dataset_name: str, base_path: str, episodes: int = 100,
+                            min_length: int = 30, max_length: int = 120, height: int = 128, width: int = 128,
+                            pattern: str = 'single', segments: int = 4, invalid_fraction: float = 0.0,
+                            image_encoding: str = 'jpeg', seed: int = 0, overwrite: bool = False) -> str:
+    """
+    Write a synthetic RLDS dataset at the ``dataset_mapping`` path of ``dataset_name``.
+
+    Args:
+        dataset_name: A key of ``dataset_mapping``; decides the image key and instruction field
+        base_path: Base directory the dataset mapping is resolved against
+        episodes: Number of episodes
+        min_length: Shortest episode, in steps
+        max_length: Longest episode, in steps
+        height: Image height
+        width: Image width
+        pattern: One of ``INSTRUCTION_PATTERNS``
+        segments: Sub-tasks per episode for the ``segments`` and ``revisit`` patterns
+        invalid_fraction: Fraction of episodes with an instruction the extractor filters out
+        image_encoding: How TFDS stores the images, ``jpeg`` or ``png``
+        seed: Random seed; the same arguments always produce the same dataset
+        overwrite: Replace an existing dataset directory
+
+    Returns:
+        The dataset directory, loadable with ``tfds.builder_from_directory``
+    """
+    import tensorflow_datasets as tfds
+
+    path_mapping, _ = dataset_mapping(base_path)
+    if dataset_name not in path_mapping:
+        raise ValueError(f"Dataset '{dataset_name}' not found. Available: {list(path_mapping.keys())}")
+    if image_encoding not in IMAGE_ENCODINGS:
+        raise ValueError(f"image_encoding must be one of {IMAGE_ENCODINGS}, got '{image_encoding}'")
+    if not 1 <= min_length <= max_length:
+        raise ValueError(f"Episode lengths must satisfy 1 <= min_length <= max_length, got {min_length}, {max_length}")
+    dataset_dir = os.path.normpath(path_mapping[dataset_name])
+    if os.path.exists(dataset_dir):
+        if not overwrite:
+            raise FileExistsError(f"{dataset_dir} already exists (pass overwrite=True to replace it)")
+        shutil.rmtree(dataset_dir)
+
+    version = _version(dataset_dir)
+    features = _features(dataset_name, height, width, image_encoding)
+    config = dict(dataset_name=dataset_name, episodes=episodes, min_length=min_length, max_length=max_length,
+                  height=height, width=width, pattern=pattern, segments=segments,
+                  invalid_fraction=invalid_fraction, seed=seed)
+
+    class SyntheticRLDS(tfds.core.GeneratorBasedBuilder, skip_registration=True):
+        name = dataset_name
+        VERSION = tfds.core.Version(version)
+
+        def _info(self):
+            return tfds.core.DatasetInfo(builder=self, features=features,
+                                         description=f"Synthetic RLDS dataset: {config}")
+
+        def _split_generators(self, dl_manager):
+            return {'train': self._generate_examples()}
+
+        def _generate_examples(self):
+            yield from generate_episodes(**config)
+
+    os.makedirs(os.path.dirname(dataset_dir), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(dataset_dir)) as data_dir:
+        SyntheticRLDS(data_dir=data_dir).download_and_prepare()
+        shutil.move(os.path.join(data_dir, dataset_name, version), dataset_dir)
+    logger.info(f"Wrote {episodes} synthetic episodes of {dataset_name} to {dataset_dir}")
+    return dataset_dir
+
+
+def main():
+    """Main function for command-line usage."""
+    parser = argparse.ArgumentParser(description="Write a synthetic RLDS dataset for benchmarking")
+    parser.add_argument('--dataset', type=str, default='bridge_data_v2',
+                        help='Dataset whose layout and dataset_mapping path to use')
+    parser.add_argument('--base-path', type=str, required=True, help='Base directory to write the dataset under')
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--min-length', type=int, default=30, help='Shortest episode, in steps')
+    parser.add_argument('--max-length', type=int, default=120, help='Longest episode, in steps')
+    parser.add_argument('--height', type=int, default=128)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--pattern', type=str, default='single', choices=INSTRUCTION_PATTERNS,
+                        help='Instruction pattern of each episode')
+    parser.add_argument('--segments', type=int, default=4, help='Sub-tasks per episode (segments, revisit)')
+    parser.add_argument('--invalid-fraction', type=float, default=0.0,
+                        help='Fraction of episodes the extractor should filter out')
+    parser.add_argument('--image-encoding', type=str, default='jpeg', choices=IMAGE_ENCODINGS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--overwrite', action='store_true', help='Replace an existing dataset')
+    args = parser.parse_args()
+
+    write_synthetic_dataset(
+        args.dataset, args.base_path, episodes=args.episodes, min_length=args.min_length,
+        max_length=args.max_length, height=args.height, width=args.width, pattern=args.pattern,
+        segments=args.segments, invalid_fraction=args.invalid_fraction,
+        image_encoding=args.image_encoding, seed=args.seed, overwrite=args.overwrite
+    )
+
+
+if __name__ == "__main__":
+    main()
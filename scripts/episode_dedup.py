@@ -0,0 +1,145 @@
+'''
+Deduplicate identical episodes before QA generation
+
+Many RLDS datasets repeat the same instruction sequence thousands of times.
+Episodes are grouped by a canonical key and QA is generated only for a few
+representatives of each group; the other members reuse (or re-sample) the
+representatives' answers with their own video name.
+
+Key modes:
+    instructions  normalized step_instructions only
+    segments      step_instructions plus temporal segments bucketed to `bucket`
+
+Question types that are built from the annotation alone (no API call) are
+always regenerated from the member's own annotation, so their timestamps stay
+exact even when the rest of the answers are shared.
+'''
+import math
+import copy
+import random
+from collections import OrderedDict
+
+KEY_MODES = ['instructions', 'segments']
+FANOUT_MODES = ['reuse', 'resample']
+# answered from the annotation in QAGenerator.generate_gpt_qa, never by the llm
+LOCAL_Q_TYPES = ["Action Temporal Localization", "Action Segment Summarization", "Action Segmentation and Summarization"]
+
+
+def canonical_key(annotation, mode='instructions', bucket=0.1):
+    steps = tuple(' '.join(str(step).lower().rstrip('.,').split()) for step in annotation['step_instructions'])
+    if mode == 'instructions':
+        return steps
+    if mode == 'segments':
+        segments = tuple(tuple(int(round(t / bucket)) for t in segment) for segment in annotation['temporal_segment'])
+        return steps, segments
+    raise ValueError(f"Unknown dedup key mode '{mode}'. Available: {KEY_MODES}")
+
+
+def group_annotations(annotations, mode='instructions', bucket=0.1):
+    '''canonical key -> source indices, in order of first appearance'''
+    groups = OrderedDict()
+    for index, annotation in enumerate(annotations):
+        groups.setdefault(canonical_key(annotation, mode, bucket), []).append(index)
+    return list(groups.values())
+
+
+def pick_representatives(group, representatives=1, max_reuse=None):
+    '''
+    evenly spaced members of the group; max_reuse caps how many members share
+    one representative, adding representatives to large groups
+    '''
+    count = representatives
+    if max_reuse:
+        count = max(count, math.ceil(len(group) / (max_reuse + 1)))
+    count = min(count, len(group))
+    step = len(group) / count
+    return [group[int(i * step)] for i in range(count)]
+
+
+def plan_dedup(annotations, mode='instructions', bucket=0.1, representatives=1, max_reuse=None):
+    '''returns [(representative indices, member indices)] covering every annotation once'''
+    plan = []
+    for group in group_annotations(annotations, mode, bucket):
+        reps = pick_representatives(group, representatives, max_reuse)
+        rep_set = set(reps)
+        plan.append((reps, [index for index in group if index not in rep_set]))
+    return plan
+
+
+def cache_variants(plan):
+    '''
+    source index -> position among its group's representatives; identical
+    representatives build identical prompts, so this keys their cached
+    responses apart (QAGenerator.generate_qa_instance(variant=...))
+    '''
+    return {index: position for reps, _ in plan for position, index in enumerate(reps)}
+
+
+def _with_video(instance, video_name):
+    instance = copy.deepcopy(instance)
+    instance['video'] = video_name
+    return instance
+
+
+def fan_out(plan, annotations, results, qa_generator, mode='reuse', seed=0):
+    '''
+    results: source index -> generate_qa_instance result for every representative
+    returns source index -> result for every annotation
+
+    reuse: members take their representatives' instances round robin
+    resample: each question type is drawn independently from all representatives
+    '''
+    if mode not in FANOUT_MODES:
+        raise ValueError(f"Unknown fan-out mode '{mode}'. Available: {FANOUT_MODES}")
+    rng = random.Random(seed)
+    output = dict(results)
+    for reps, members in plan:
+        pools = OrderedDict()
+        for rep in reps:
+            for instance in results[rep] if isinstance(results[rep], list) else []:
+                pools.setdefault(instance['question_type'], []).append(instance)
+        for n, index in enumerate(members):
+            video_name = annotations[index]['id']
+            if mode == 'reuse':
+                source = results[reps[n % len(reps)]]
+            else:
+                source = results[rng.choice(reps)]
+            if not isinstance(source, list):
+                # pretrain stage: one caption instance per video
+                output[index] = _with_video(source, video_name)
+                continue
+            if mode == 'resample':
+                source = [rng.choice(pool) for pool in pools.values()]
+            instances = []
+            for instance in source:
+                if instance['question_type'] in LOCAL_Q_TYPES:
+                    q_type = instance['question_type']
+                    prompt = qa_generator.get_qa_prompt(Q_type=q_type, raw_data=annotations[index])
+                    qa_pair = qa_generator.generate_gpt_qa(prompt=prompt, Q_type=q_type)
+                    instance = dict(instance, conversations=[
+                        dict(instance['conversations'][0], value=qa_generator.format_question_with_video(question=qa_pair['question'])),
+                        dict(instance['conversations'][1], value=qa_pair['answer']),
+                    ])
+                instances.append(_with_video(instance, video_name))
+            output[index] = instances
+    return output
+
+
+def dedup_report(plan, api_calls, generated=None):
+    '''
+    api_calls: llm calls made for `generated` representatives (all of them
+    unless the run resumed), extrapolated to the members that reused answers
+    '''
+    representatives = sum(len(reps) for reps, _ in plan)
+    members = sum(len(members) for _, members in plan)
+    generated = representatives if generated is None else generated
+    per_video = api_calls / generated if generated else 0.0
+    return {
+        "episodes": representatives + members,
+        "groups": len(plan),
+        "representatives": representatives,
+        "fanned_out": members,
+        "largest_group": max((len(reps) + len(members) for reps, members in plan), default=0),
+        "api_calls": api_calls,
+        "api_calls_saved": round(per_video * members),
+    }
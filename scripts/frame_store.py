@@ -0,0 +1,257 @@
+"""
+Memory-mapped Frame Store
+
+An alternative to per-episode MP4 output for training loaders that would
+otherwise re-decode H.264 every epoch. Raw uint8 RGB frames of all episodes are
+appended back to back into large shard files, and an append-only index maps
+each episode id to ``(shard, offset, length, height, width)``.
+
+Layout::
+
+    frame_store/
+    ├── shard_00000.bin
+    ├── shard_00001.bin
+    └── index.jsonl
+
+Reading frame ``i`` of an episode is an O(1) slice of a ``np.memmap`` with no
+decode and no copy.
+"""
+
+import os
+import json
+import shutil
+from typing import Dict, List, Optional, Tuple, Any
+
+import numpy as np
+
+FRAME_STORE_DIRNAME = 'frame_store'
+INDEX_FILENAME = 'index.jsonl'
+DEFAULT_SHARD_BYTES = 4 * 1024 ** 3
+
+
+def _shard_name(shard: int) -> str:
+    return f"shard_{shard:05d}.bin"
+
+
+def find_frame_store(video_dir: str) -> Optional[str]:
+    """Root of the frame store written into an extraction's video dir, or None for per-file output."""
+    root = os.path.join(video_dir, FRAME_STORE_DIRNAME)
+    return root if os.path.isfile(os.path.join(root, INDEX_FILENAME)) else None
+
+
+def _load_index(root: str) -> Dict[str, Dict[str, Any]]:
+    """Read the index; later entries for the same id win, a torn last line is ignored."""
+    index = {}
+    path = os.path.join(root, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return index
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            index[entry['id']] = entry
+    return index
+
+
+class FrameStoreWriter:
+    """
+    Append episodes to a frame store.
+
+    Episodes are written either whole with ``add_episode`` or incrementally
+    through ``episode_writer``. A new shard is started once the current one
+    reaches ``shard_bytes``; an episode never spans two shards. Reopening an
+    existing store continues after its last indexed episode.
+    """
+
+    def __init__(self, root: str, shard_bytes: int = DEFAULT_SHARD_BYTES):
+        self.root = root
+        self.shard_bytes = shard_bytes
+        os.makedirs(root, exist_ok=True)
+        index = _load_index(root)
+        self._shard = max((entry['shard'] for entry in index.values()), default=0)
+        # Drop bytes written after the last indexed episode of the open shard.
+        self._offset = max((entry['offset'] + entry['nbytes'] for entry in index.values()
+                            if entry['shard'] == self._shard), default=0)
+        self._shard_file = open(os.path.join(root, _shard_name(self._shard)), 'ab')
+        self._shard_file.truncate(self._offset)
+        self._index_file = open(os.path.join(root, INDEX_FILENAME), 'a', encoding='utf-8')
+
+    def _maybe_roll_shard(self, nbytes: int = 0) -> None:
+        if self._offset and self._offset + nbytes > self.shard_bytes:
+            self._shard_file.close()
+            self._shard += 1
+            self._offset = 0
+            self._shard_file = open(os.path.join(self.root, _shard_name(self._shard)), 'wb')
+
+    def add_episode(self, video_id: str, frames: np.ndarray) -> int:
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        with self.episode_writer(video_id, nbytes_hint=frames.nbytes) as writer:
+            writer.append_batch(frames)
+        return len(frames)
+
+    def episode_writer(self, video_id: str, nbytes_hint: int = 0) -> 'EpisodeWriter':
+        self._maybe_roll_shard(nbytes_hint)
+        return EpisodeWriter(self, video_id)
+
+    def _commit(self, video_id: str, start: int, length: int, frame_shape: Tuple[int, int, int]) -> None:
+        height, width, _ = frame_shape
+        nbytes = self._offset - start
+        entry = {
+            'id': video_id, 'shard': self._shard, 'offset': start, 'nbytes': nbytes,
+            'length': length, 'height': height, 'width': width,
+        }
+        self._shard_file.flush()
+        self._index_file.write(json.dumps(entry) + '\n')
+        self._index_file.flush()
+
+    def _rollback(self, start: int) -> None:
+        self._shard_file.flush()
+        self._shard_file.truncate(start)
+        self._offset = start
+
+    def close(self) -> None:
+        for f in (self._shard_file, self._index_file):
+            if not f.closed:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class EpisodeWriter:
+    """
+    Incremental writer for one episode, with the same ``append``/``close``/
+    ``abort`` interface as ``utils.StreamingVideoWriter``. Nothing is indexed
+    until ``close``; ``abort`` truncates the shard back to the episode start.
+    """
+
+    def __init__(self, store: FrameStoreWriter, video_id: str):
+        self.store = store
+        self.video_id = video_id
+        self.num_frames = 0
+        self._start = store._offset
+        self._frame_shape: Optional[Tuple[int, int, int]] = None
+
+    def append(self, frame: np.ndarray) -> None:
+        self.append_batch(np.asarray(frame, dtype=np.uint8)[None])
+
+    def append_batch(self, frames: np.ndarray) -> None:
+        if frames.ndim != 4 or frames.shape[-1] != 3:
+            raise ValueError(f"Expected (T, H, W, 3) frames, got shape {frames.shape}")
+        if self._frame_shape is None:
+            self._frame_shape = frames.shape[1:]
+        elif frames.shape[1:] != self._frame_shape:
+            raise ValueError(f"Frame shape changed from {self._frame_shape} to {frames.shape[1:]}")
+        data = np.ascontiguousarray(frames, dtype=np.uint8)
+        self.store._shard_file.write(data.tobytes())
+        self.store._offset += data.nbytes
+        self.num_frames += len(frames)
+
+    def close(self) -> None:
+        if self._frame_shape is None:
+            raise ValueError(f"Episode {self.video_id} has no frames")
+        self.store._commit(self.video_id, self._start, self.num_frames, self._frame_shape)
+
+    def abort(self) -> None:
+        self.store._rollback(self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class FrameStore:
+    """
+    Read-only view of a frame store.
+
+    Shards are memory-mapped on first use; every accessor returns a numpy view
+    into the mapping, so nothing is copied until the caller does so.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index = _load_index(root)
+        self._shards: Dict[int, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self.index
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self.index.keys())
+
+    def files(self, video_ids: Optional[List[str]] = None) -> List[str]:
+        """Shard files holding ``video_ids`` (all episodes by default) plus the index, relative to ``root``."""
+        if video_ids is None:
+            video_ids = self.ids
+        missing = [video_id for video_id in video_ids if video_id not in self.index]
+        if missing:
+            raise KeyError(f"{len(missing)} episodes not in frame store {self.root}, e.g. {missing[0]}")
+        shards = sorted({self.index[video_id]['shard'] for video_id in video_ids})
+        return [_shard_name(shard) for shard in shards] + [INDEX_FILENAME]
+
+    def _shard(self, shard: int) -> np.memmap:
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(os.path.join(self.root, _shard_name(shard)), dtype=np.uint8, mode='r')
+        return self._shards[shard]
+
+    def shape(self, video_id: str) -> Tuple[int, int, int, int]:
+        entry = self.index[video_id]
+        return entry['length'], entry['height'], entry['width'], 3
+
+    def episode(self, video_id: str) -> np.ndarray:
+        """All frames of an episode as a ``(T, H, W, 3)`` view."""
+        entry = self.index[video_id]
+        data = self._shard(entry['shard'])[entry['offset']:entry['offset'] + entry['nbytes']]
+        return data.reshape(self.shape(video_id))
+
+    def frames(self, video_id: str, start: int = 0, stop: Optional[int] = None, step: int = 1) -> np.ndarray:
+        return self.episode(video_id)[start:stop:step]
+
+    def frame(self, video_id: str, i: int) -> np.ndarray:
+        return self.episode(video_id)[i]
+
+
+def merge_frame_stores(sources: List[Tuple[str, Dict[str, str]]], dest_root: str) -> None:
+    """
+    Move the shards of several stores into ``dest_root`` and write one index.
+
+    Args:
+        sources: ``(store_root, {old_id: new_id})`` pairs in merge order;
+            episodes missing from the mapping are dropped from the index
+    """
+    os.makedirs(dest_root, exist_ok=True)
+    next_shard = 0
+    with open(os.path.join(dest_root, INDEX_FILENAME), 'w', encoding='utf-8') as index_file:
+        for root, id_map in sources:
+            index = _load_index(root)
+            shard_map = {}
+            for shard in sorted({entry['shard'] for entry in index.values()}):
+                shard_map[shard] = next_shard
+                source = os.path.join(root, _shard_name(shard))
+                # Shards already moved by an interrupted merge keep their destination name.
+                if os.path.exists(source):
+                    shutil.move(source, os.path.join(dest_root, _shard_name(next_shard)))
+                next_shard += 1
+            for old_id, entry in index.items():
+                if old_id not in id_map:
+                    continue
+                entry = dict(entry, id=id_map[old_id], shard=shard_map[entry['shard']])
+                index_file.write(json.dumps(entry) + '\n')
@@ -0,0 +1,220 @@
+"""
+Streaming JSONL Output
+
+Annotations and QA instances are appended one record per line as they are
+produced, instead of being collected into one list and written with a single
+``json.dump(..., indent=4)`` at the end. Output can be a single ``.jsonl``
+file or size-capped shards (``name-00000.jsonl``, ``name-00001.jsonl``, ...).
+orjson is used for serialisation when installed.
+
+Readers iterate records lazily across shards, and ``write_legacy_json``
+streams any record iterable into the historical indented JSON array, e.g. the
+``{task}_{N}K.json`` QA files, without holding the records in memory.
+
+Usage::
+
+    python scripts/jsonl_io.py qa out/Finetune/calvin.jsonl out/Finetune --task calvin
+    python scripts/jsonl_io.py json dataset/video/annotation.jsonl dataset/video/annotation.json
+"""
+
+import os
+import re
+import glob
+import json
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_line(record: Any) -> bytes:
+    """One JSONL line (with trailing newline) as UTF-8 bytes."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _loads(line: bytes) -> Any:
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def _shard_path(path: str, shard: int) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}-{shard:05d}{ext or '.jsonl'}"
+
+
+def jsonl_paths(path: str) -> List[str]:
+    """The file itself, or its shards in order if it was written sharded."""
+    if os.path.exists(path):
+        return [path]
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r'-\d{5}' + re.escape(ext or '.jsonl') + '$')
+    shards = [p for p in glob.glob(f"{glob.escape(stem)}-*") if pattern.match(os.path.basename(p))]
+    return sorted(shards)
+
+
+class JsonlWriter:
+    """
+    Append-only JSONL writer.
+
+    With ``max_records`` set, ``path`` names a sharded output and a new shard
+    is started every ``max_records`` records. Reopening an existing output
+    appends after its last record; ``position()`` and ``truncate()`` let a
+    caller checkpoint the output and roll it back to a checkpoint on resume.
+    """
+
+    def __init__(self, path: str, max_records: Optional[int] = None, sync_every: int = 0):
+        self.path = path
+        self.max_records = max_records
+        self.sync_every = sync_every
+        self.records_written = 0
+        self._pending = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        existing = jsonl_paths(path) if max_records else []
+        self._shard = len(existing) - 1 if existing else 0
+        self._file = open(self._current_path(), 'ab')
+        self._shard_records = _count_lines(self._current_path()) if max_records else 0
+
+    def _current_path(self) -> str:
+        return _shard_path(self.path, self._shard) if self.max_records else self.path
+
+    def write(self, record: Any) -> None:
+        if self.max_records and self._shard_records >= self.max_records:
+            self._file.close()
+            self._shard += 1
+            self._shard_records = 0
+            self._file = open(self._current_path(), 'ab')
+        self._file.write(dumps_line(record))
+        self._shard_records += 1
+        self.records_written += 1
+        self._pending += 1
+        if self.sync_every and self._pending >= self.sync_every:
+            self.sync()
+
+    def append(self, record: Any) -> None:
+        """Alias of ``write``, so a writer can take the place of a list of records."""
+        self.write(record)
+
+    def write_many(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.write(record)
+
+    def position(self) -> Tuple[int, int]:
+        """``(shard, byte offset)`` after the last written record."""
+        self._file.flush()
+        return self._shard, self._file.tell()
+
+    def truncate(self, position: Tuple[int, int]) -> None:
+        """Drop everything written after ``position``, including later shards."""
+        shard, offset = position
+        self._file.close()
+        if self.max_records:
+            for path in jsonl_paths(self.path):
+                if int(path[-len('00000.jsonl'):-len('.jsonl')]) > shard:
+                    os.remove(path)
+        self._shard = shard
+        with open(self._current_path(), 'ab') as f:
+            f.truncate(offset)
+        self._file = open(self._current_path(), 'ab')
+        self._shard_records = _count_lines(self._current_path()) if self.max_records else 0
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def iter_jsonl(path: str) -> Iterator[Any]:
+    """Yield records of a JSONL file or sharded output; a torn last line is skipped."""
+    for shard in jsonl_paths(path):
+        with open(shard, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                yield _loads(line)
+
+
+def read_jsonl(path: str) -> List[Any]:
+    return list(iter_jsonl(path))
+
+
+def count_jsonl(path: str) -> int:
+    return sum(_count_lines(shard) for shard in jsonl_paths(path))
+
+
+def load_annotations(path: str) -> List[Dict[str, Any]]:
+    """Read ``annotation.json``, falling back to ``annotation.jsonl`` next to it."""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return read_jsonl(os.path.splitext(path)[0] + '.jsonl')
+
+
+def write_legacy_json(records: Iterable[Any], dest_path: str, ensure_ascii: bool = True) -> int:
+    """
+    Stream records into an indented JSON array, byte for byte what
+    ``json.dump(list(records), f, indent=4)`` would write. Returns the record count.
+    """
+    tmp_path = dest_path + '.tmp'
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for record in records:
+            text = json.dumps(record, indent=4, ensure_ascii=ensure_ascii)
+            f.write((',\n    ' if count else '\n    ') + text.replace('\n', '\n    '))
+            count += 1
+        f.write('\n]' if count else ']')
+    os.replace(tmp_path, dest_path)
+    return count
+
+
+def convert_to_legacy_qa_json(src: str, dest_dir: str, task: str) -> str:
+    """Write QA instances from ``src`` to ``dest_dir/{task}_{N}K.json``."""
+    instance_number = count_jsonl(src) // 1000 # K
+    dest_path = os.path.join(dest_dir, f'{task}_{instance_number}K.json')
+    write_legacy_json(iter_jsonl(src), dest_path)
+    return dest_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSONL output to the legacy JSON layout")
+    parser.add_argument('layout', choices=['qa', 'json'],
+                        help="qa: {task}_{N}K.json QA file; json: plain indented array such as annotation.json")
+    parser.add_argument('src', help="JSONL file or sharded output name")
+    parser.add_argument('dest', help="destination directory (qa) or file (json)")
+    parser.add_argument('--task', help="dataset name used in the QA file name")
+    args = parser.parse_args()
+    if args.layout == 'qa':
+        if not args.task:
+            parser.error("--task is required for the qa layout")
+        print(convert_to_legacy_qa_json(args.src, args.dest, args.task))
+    else:
+        print(write_legacy_json(iter_jsonl(args.src), args.dest, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Append-only JSONL progress ledger
+
+Long-running extraction and generation jobs record one JSON line per
+finished unit of work. A restarted job replays the ledger to rebuild its
+in-memory state and continues from the first unfinished unit. Jobs that finish
+units out of order key their records and compact the ledger into key order.
+"""
+
+import os
+import json
+import logging
+from typing import List, Dict, Any, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressLedger:
+    """
+    Durable append-only record log.
+
+    Every record is written as a single line and flushed immediately; the file
+    is fsync'ed every ``sync_every`` records and on close. A torn last line left
+    by a crash is dropped (and truncated away) on load.
+    """
+
+    def __init__(self, path: str, sync_every: int = 32):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self._file = None
+        self._pending = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _scan(self) -> Iterator[Tuple[int, bytes, Dict[str, Any]]]:
+        """Yield ``(offset, line, record)`` for every complete record, truncating a torn tail if present."""
+        if not self.exists():
+            return
+        valid_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                yield valid_bytes, line, record
+                valid_bytes += len(line)
+        if valid_bytes != os.path.getsize(self.path):
+            logger.warning(f"Dropping torn tail of ledger {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Stream complete records without holding the ledger in memory."""
+        for _, _, record in self._scan():
+            yield record
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Read all complete records, truncating a torn tail if present."""
+        return list(self.iter_records())
+
+    def append(self, record: Dict[str, Any]) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.sync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def compact(self, key: str) -> int:
+        """
+        Atomically rewrite the ledger keeping only the last record per
+        ``record[key]``, ordered by key. Only byte offsets are held in memory.
+
+        Returns:
+            Number of records kept
+        """
+        self.close()
+        latest = {}
+        for offset, line, record in self._scan():
+            latest[record[key]] = (offset, len(line))
+        if not latest:
+            return 0
+        tmp_path = self.path + '.tmp'
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for record_key in sorted(latest):
+                offset, size = latest[record_key]
+                src.seek(offset)
+                dst.write(src.read(size))
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        return len(latest)
+
+    def remove(self) -> None:
+        self.close()
+        if self.exists():
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,283 @@
+"""
+Pipeline Instrumentation
+
+Process-wide stage timers, counters and latency histograms for extraction
+and QA generation. Instrumented code does::
+
+    from scripts.metrics import metrics
+
+    with metrics.timer('save_video'):
+        ...
+    metrics.count('filtered_episodes')
+
+Every timer feeds a latency histogram of its stage, so the export shows both
+where the wall time goes (``sum``) and how it is distributed (buckets).
+Instrumentation is disabled by default: ``timer`` then returns a shared no-op
+context manager, ``count`` and ``observe`` return immediately and
+``timed_iter`` returns the iterable itself, so the instrumented hot loops pay
+one attribute check per call.
+
+``setup_metrics`` enables the registry and starts a ``MetricsReporter`` that
+periodically writes a JSON summary and/or a Prometheus textfile (for the
+node_exporter textfile collector), each replaced atomically.
+"""
+
+import os
+import re
+import json
+import time
+import bisect
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# seconds; covers a cached lookup up to a slow API call or a long-horizon encode
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PROMETHEUS_PREFIX = 'robox'
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry: 'Metrics', name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``counts[i]`` holds observations ``<= buckets[i]``, the last one the overflow."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(self.buckets), 'counts': list(self.counts)}
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        if tuple(data['buckets']) != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.count += data['count']
+        self.sum += data['sum']
+
+
+class Metrics:
+    """Thread-safe registry of counters and per-stage latency histograms."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = tuple(buckets)
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def timer(self, name: str) -> Any:
+        """Context manager adding the elapsed time of its block to stage ``name``."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def timed_iter(self, iterable: Iterable[Any], name: str) -> Iterable[Any]:
+        """Time every ``next()`` of ``iterable``, e.g. the reads of a tf.data pipeline, as stage ``name``."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(iter(iterable), name)
+
+    def _timed_iter(self, iterator: Iterator[Any], name: str) -> Iterator[Any]:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'uptime_seconds': time.time() - self.started,
+                'counters': dict(self.counters),
+                'stages': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add a snapshot taken in another process, e.g. an extraction worker."""
+        if not self.enabled or not snapshot:
+            return
+        with self._lock:
+            for name, value in snapshot.get('counters', {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, data in snapshot.get('stages', {}).items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram(data['buckets'])
+                self.histograms[name].merge(data)
+
+    def summary(self, top: int = 10) -> str:
+        """Stages by total time plus the counters, for a log line."""
+        snapshot = self.snapshot()
+        stages = sorted(snapshot['stages'].items(), key=lambda item: item[1]['sum'], reverse=True)[:top]
+        parts = [f"{name} {data['sum']:.1f}s/{data['count']}" for name, data in stages]
+        parts += [f"{name}={value:g}" for name, value in sorted(snapshot['counters'].items())]
+        return ', '.join(parts)
+
+    def write_json(self, path: str) -> None:
+        _atomic_write(path, json.dumps(self.snapshot(), indent=4))
+
+    def write_prometheus(self, path: str, prefix: str = PROMETHEUS_PREFIX) -> None:
+        _atomic_write(path, to_prometheus(self.snapshot(), prefix))
+
+
+def _metric_name(prefix: str, name: str, suffix: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{name}_{suffix}")
+
+
+def to_prometheus(snapshot: Dict[str, Any], prefix: str = PROMETHEUS_PREFIX) -> str:
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        metric = _metric_name(prefix, name, 'total')
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, data in sorted(snapshot['stages'].items()):
+        metric = _metric_name(prefix, name, 'seconds')
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(data['buckets'], data['counts']):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {data["count"]}')
+        lines += [f"{metric}_sum {data['sum']}", f"{metric}_count {data['count']}"]
+    return '\n'.join(lines) + '\n'
+
+
+def _atomic_write(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# The process-wide registry used by the instrumented modules.
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """
+    Write a registry to ``json_path`` and/or ``prom_path`` every ``interval``
+    seconds from a daemon thread, and once more on ``stop``.
+    """
+
+    def __init__(self, registry: Metrics, json_path: Optional[str] = None, prom_path: Optional[str] = None,
+                 interval: float = 30.0):
+        self.registry = registry
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self) -> None:
+        try:
+            if self.json_path:
+                self.registry.write_json(self.json_path)
+            if self.prom_path:
+                self.registry.write_prometheus(self.prom_path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> 'MetricsReporter':
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='metrics-reporter', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def setup_metrics(json_path: Optional[str] = None, prom_path: Optional[str] = None,
+                  interval: float = 30.0) -> Optional[MetricsReporter]:
+    """
+    Enable the process-wide registry and start reporting it.
+
+    Returns:
+        The started reporter (stop it to write the final export), or None when
+        neither output is requested and instrumentation stays disabled
+    """
+    if not json_path and not prom_path:
+        return None
+    metrics.enable()
+    return MetricsReporter(metrics, json_path, prom_path, interval).start()
@@ -0,0 +1,382 @@
+"""
+Multi-Dataset Orchestrator
+
+Runs RLDS extraction and QA generation for many datasets of
+``dataset_mapping`` under one CPU and API budget instead of one hand-scheduled
+invocation per dataset.
+
+Each dataset's cost is estimated from its TFDS metadata (episode count and
+shard bytes from ``dataset_info.json``) and jobs are started largest first.
+Extraction jobs get a share of ``--cpu-budget`` worker processes proportional
+to their size; QA jobs get a share of ``--api-budget`` concurrent requests
+(and of ``--rpm``/``--tpm``) proportional to their expected API calls and
+start once their dataset is extracted. Every job is a regular
+``RLDS_reader.py``/``qa_generation.py`` subprocess, so interrupted jobs
+resume from their own progress ledgers when the orchestrator is re-run.
+Jobs whose outputs already exist are reported as ``done`` and not run again
+unless ``--force`` is given.
+
+Usage:
+    python scripts/orchestrate.py --datasets 'libero_*' calvin --base-path robot_dataset --dest-dir qa_out --cpu-budget 32 --api-budget 128
+    python scripts/orchestrate.py --datasets '*' --dry-run
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import glob
+import time
+import shlex
+import fnmatch
+import logging
+import argparse
+import subprocess
+from typing import Any, Dict, List, Optional
+
+try:
+    from .utils import dataset_mapping
+    from .episode_dedup import LOCAL_Q_TYPES
+except ImportError:
+    from scripts.utils import dataset_mapping
+    from scripts.episode_dedup import LOCAL_Q_TYPES
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def select_datasets(patterns: List[str], base_path: str) -> List[str]:
+    """Dataset names of either mapping matching any of the names or glob patterns, in mapping order."""
+    path_mapping, task_mapping = dataset_mapping(base_path)
+    names = list(dict.fromkeys(list(path_mapping) + list(task_mapping)))
+    selected = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+    unknown = [p for p in patterns if not any(fnmatch.fnmatchcase(name, p) for name in names)]
+    if unknown:
+        raise ValueError(f"No dataset matches {unknown}. Available: {names}")
+    return selected
+
+
+def _count_annotations(video_dir: str) -> Optional[int]:
+    jsonl_path = os.path.join(video_dir, 'annotation.jsonl')
+    json_path = os.path.join(video_dir, 'annotation.json')
+    if os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return len(json.load(f))
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, 'rb') as f:
+            return sum(1 for _ in f)
+    return None
+
+
+def estimate_cost(dataset_name: str, base_path: str, qa_stage: str = 'Finetune') -> Dict[str, Any]:
+    """
+    Estimate the work for one dataset without loading TensorFlow.
+
+    Returns:
+        Dictionary with episodes, shards and bytes from the TFDS metadata,
+        the number of videos QA will run on (the annotation count once
+        extracted, else the episode count) and the expected API calls
+    """
+    path_mapping, task_mapping = dataset_mapping(base_path)
+    base_dir = path_mapping.get(dataset_name) or path_mapping.get(dataset_name[:-len('_task')], '')
+    episodes, shards, num_bytes = 0, 0, 0
+    info_path = os.path.join(base_dir, 'dataset_info.json')
+    if os.path.exists(info_path):
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        for split in info.get('splits', []):
+            lengths = [int(n) for n in split.get('shardLengths', [])]
+            episodes += sum(lengths)
+            shards += len(lengths)
+            num_bytes += int(split.get('numBytes', 0))
+    if not num_bytes:
+        num_bytes = sum(os.path.getsize(p) for p in glob.glob(os.path.join(base_dir, '*.tfrecord*')))
+
+    source_dir = 'task_planning' if dataset_name.endswith('_task') else 'video'
+    videos = _count_annotations(os.path.join(base_dir, source_dir))
+    if videos is None:
+        videos = episodes
+    tasks = task_mapping.get(dataset_name, [])
+    if qa_stage.lower() == 'pretrain':
+        calls_per_video = 1
+    else:
+        calls_per_video = sum(2 if task == "Task Planning" else 1 for task in tasks if task not in LOCAL_Q_TYPES)
+    return {
+        'exists': os.path.isdir(base_dir),
+        'episodes': episodes,
+        'shards': shards,
+        'bytes': num_bytes,
+        'videos': videos,
+        'api_calls': videos * calls_per_video,
+    }
+
+
+class Job:
+    """One subprocess (extraction or QA for a dataset) and its resource claim."""
+
+    def __init__(self, dataset: str, kind: str, cost: float, cpu: int = 1, api: int = 0,
+                 after: Optional['Job'] = None):
+        self.dataset = dataset
+        self.kind = kind
+        self.cost = cost
+        self.cpu = cpu
+        self.api = api
+        self.after = after
+        self.command: List[str] = []
+        self.progress_fn = None
+        self.total = 0
+        self.state = 'pending'
+        self.process: Optional[subprocess.Popen] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.returncode: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.dataset}:{self.kind}"
+
+    def ready(self) -> bool:
+        return self.state == 'pending' and (self.after is None or self.after.state == 'done')
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = ((self.end_time or time.time()) - self.start_time) if self.start_time else 0.0
+        done = self.progress_fn() if self.progress_fn and self.start_time else 0
+        return {
+            'job': self.name,
+            'state': self.state,
+            'cpu': self.cpu,
+            'api': self.api,
+            'done': done,
+            'total': self.total,
+            'elapsed_seconds': round(elapsed, 1),
+            'per_second': round(done / elapsed, 2) if elapsed else 0.0,
+            'returncode': self.returncode,
+        }
+
+
+def _count_lines(path: str) -> int:
+    try:
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+
+def extraction_progress(video_dir: str) -> int:
+    """Episodes finished so far by a serial or parallel RLDS_reader run."""
+    done = _count_lines(os.path.join(video_dir, 'progress.jsonl'))
+    plan_path = os.path.join(video_dir, '.parts', 'plan.json')
+    if os.path.exists(plan_path):
+        with open(plan_path, 'r', encoding='utf-8') as f:
+            ranges = json.load(f)['ranges']
+        for i, (start, end) in enumerate(ranges):
+            part_dir = os.path.join(video_dir, '.parts', f"{i:05d}")
+            if os.path.exists(os.path.join(part_dir, 'part.json')):
+                done += end - start
+            else:
+                done += _count_lines(os.path.join(part_dir, 'progress.jsonl'))
+    return done
+
+
+def extraction_done(video_dir: str) -> bool:
+    """True once RLDS_reader has written the annotations and meta information of ``video_dir``."""
+    has_annotations = any(os.path.exists(os.path.join(video_dir, name))
+                          for name in ('annotation.json', 'annotation.jsonl'))
+    return has_annotations and os.path.exists(os.path.join(video_dir, 'meta_information.json'))
+
+
+def qa_done(qa_dir: str, task: str) -> bool:
+    """True once qa_generation has written a finished QA output of ``task`` to ``qa_dir``."""
+    # the progress log is only removed after the output is complete
+    if not os.path.isdir(qa_dir) or os.path.exists(os.path.join(qa_dir, f'{task}_progress.jsonl')):
+        return False
+    pattern = re.compile(re.escape(task) + r'(_\d+K\.json|\.jsonl|-\d{5}\.jsonl|_shards\.json)')
+    return any(pattern.fullmatch(name) for name in os.listdir(qa_dir))
+
+
+def _share(cost: float, total_cost: float, budget: int) -> int:
+    if budget <= 0:
+        return 0
+    return max(1, min(budget, math.ceil(budget * cost / total_cost))) if total_cost else 1
+
+
+def plan_jobs(datasets: List[str], args: argparse.Namespace) -> List[Job]:
+    """Estimate every dataset and build its extraction and QA jobs, largest first."""
+    path_mapping, task_mapping = dataset_mapping(args.base_path)
+    costs = {name: estimate_cost(name, args.base_path, args.qa_stage) for name in datasets}
+    for name in [n for n in datasets if not costs[n]['exists']]:
+        logger.warning(f"Skipping {name}: no dataset directory under {args.base_path}")
+    datasets = [n for n in datasets if costs[n]['exists']]
+    extract = [n for n in datasets if 'extract' in args.steps and n in path_mapping and not n.endswith('_task')]
+    qa = [n for n in datasets if 'qa' in args.steps and n in task_mapping]
+    total_bytes = sum(costs[n]['bytes'] for n in extract)
+    total_calls = sum(costs[n]['api_calls'] for n in qa)
+
+    jobs, extraction_jobs = [], {}
+    for name in extract:
+        job = Job(name, 'extract', costs[name]['bytes'], cpu=_share(costs[name]['bytes'], total_bytes, args.cpu_budget))
+        video_dir = os.path.join(path_mapping[name], 'video')
+        job.command = [sys.executable, os.path.join(SCRIPTS_DIR, 'RLDS_reader.py'), '--dataset', name,
+                       '--base-path', args.base_path, '--workers', str(job.cpu)] + shlex.split(args.extract_args)
+        job.progress_fn = lambda video_dir=video_dir: extraction_progress(video_dir)
+        job.total = costs[name]['episodes']
+        if not args.force and extraction_done(video_dir):
+            job.state = 'done'
+        extraction_jobs[name] = job
+        jobs.append(job)
+    for name in qa:
+        api = _share(costs[name]['api_calls'], total_calls, args.api_budget)
+        # QA waits on the API rather than the CPU; *_task datasets read task_planning/, which extraction does not produce
+        job = Job(name, 'qa', costs[name]['api_calls'], cpu=0, api=api, after=extraction_jobs.get(name))
+        job.command = [sys.executable, os.path.join(SCRIPTS_DIR, 'qa_generation.py'), '--base_dir', args.base_path,
+                       '--dest_dir', args.dest_dir, '--dataset_name', name, '--stage', args.qa_stage,
+                       '--concurrency', str(api)]
+        if args.rpm:
+            job.command += ['--rpm', str(max(1, args.rpm * api // args.api_budget))]
+        if args.tpm:
+            job.command += ['--tpm', str(max(1, args.tpm * api // args.api_budget))]
+        job.command += shlex.split(args.qa_args)
+        qa_dir = os.path.join(args.dest_dir, args.qa_stage)
+        progress_path = os.path.join(qa_dir, f'{name}_progress.jsonl')
+        job.progress_fn = lambda progress_path=progress_path: _count_lines(progress_path)
+        job.total = costs[name]['videos']
+        if not args.force and qa_done(qa_dir, name):
+            job.state = 'done'
+        jobs.append(job)
+    jobs.sort(key=lambda job: job.cost, reverse=True)
+    for name in datasets:
+        cost = costs[name]
+        logger.info(f"{name}: {cost['episodes']} episodes in {cost['shards']} shards, "
+                    f"{cost['bytes'] / 1024 ** 3:.1f} GiB, ~{cost['api_calls']} API calls")
+    for job in jobs:
+        if job.state == 'done':
+            logger.info(f"{job.name} done: output already exists (use --force to redo)")
+    return jobs
+
+
+class Orchestrator:
+    """
+    Start ready jobs, largest first, whenever their CPU and API claims fit in
+    the free budget (smaller jobs backfill around a large one that does not
+    fit yet), and report per-job status and throughput.
+    """
+
+    def __init__(self, jobs: List[Job], cpu_budget: int, api_budget: int, log_dir: str, poll_seconds: float = 30.0):
+        self.jobs = jobs
+        self.cpu_budget = cpu_budget
+        self.api_budget = api_budget
+        self.log_dir = log_dir
+        self.poll_seconds = poll_seconds
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _free(self) -> Dict[str, int]:
+        running = [job for job in self.jobs if job.state == 'running']
+        return {
+            'cpu': self.cpu_budget - sum(job.cpu for job in running),
+            'api': self.api_budget - sum(job.api for job in running),
+        }
+
+    def _start(self, job: Job) -> None:
+        log_path = os.path.join(self.log_dir, f"{job.dataset}_{job.kind}.log")
+        logger.info(f"Starting {job.name} (cpu={job.cpu}, api={job.api}): {' '.join(job.command)}")
+        with open(log_path, 'ab') as log_file:
+            job.process = subprocess.Popen(job.command, stdout=log_file, stderr=subprocess.STDOUT)
+        job.state = 'running'
+        job.start_time = time.time()
+
+    def _reap(self) -> None:
+        for job in self.jobs:
+            if job.state == 'running' and job.process.poll() is not None:
+                job.returncode = job.process.returncode
+                job.end_time = time.time()
+                job.state = 'done' if job.returncode == 0 else 'failed'
+                log = logger.info if job.state == 'done' else logger.error
+                log(f"{job.name} {job.state} after {job.end_time - job.start_time:.0f}s (exit {job.returncode})")
+        for job in self.jobs:
+            if job.state == 'pending' and job.after is not None and job.after.state in ('failed', 'skipped'):
+                job.state = 'skipped'
+                logger.warning(f"Skipping {job.name}: {job.after.name} {job.after.state}")
+
+    def report(self) -> List[Dict[str, Any]]:
+        status = [job.status() for job in self.jobs]
+        with open(os.path.join(self.log_dir, 'status.json'), 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=4)
+        for entry in status:
+            if entry['state'] == 'running':
+                logger.info(f"{entry['job']}: {entry['done']}/{entry['total']} "
+                            f"({entry['per_second']}/s, {entry['elapsed_seconds']:.0f}s)")
+        return status
+
+    def run(self) -> bool:
+        """Run every job; returns True if all of them succeeded."""
+        last_report = 0.0
+        try:
+            while any(job.state in ('pending', 'running') for job in self.jobs):
+                self._reap()
+                free = self._free()
+                for job in self.jobs:
+                    if job.ready() and job.cpu <= free['cpu'] and job.api <= free['api']:
+                        self._start(job)
+                        free['cpu'] -= job.cpu
+                        free['api'] -= job.api
+                if time.time() - last_report >= self.poll_seconds:
+                    self.report()
+                    last_report = time.time()
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, stopping running jobs (re-run to resume)")
+            for job in self.jobs:
+                if job.state == 'running':
+                    job.process.terminate()
+            for job in self.jobs:
+                if job.state == 'running':
+                    job.process.wait()
+            raise
+        finally:
+            self.report()
+        return all(job.state == 'done' for job in self.jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract and generate QA for many datasets under a shared CPU/API budget"
+    )
+    parser.add_argument('--datasets', nargs='+', required=True,
+                        help='Dataset names or glob patterns from dataset_mapping')
+    parser.add_argument('--base-path', type=str, default='robot_dataset', help='Base directory containing RLDS datasets')
+    parser.add_argument('--dest-dir', type=str, default='', help='QA output directory (qa_generation.py --dest_dir)')
+    parser.add_argument('--steps', nargs='+', default=['extract', 'qa'], choices=['extract', 'qa'])
+    parser.add_argument('--qa-stage', type=str, default='Finetune', help='Pretrain or Finetune')
+    parser.add_argument('--cpu-budget', type=int, default=os.cpu_count() or 1,
+                        help='Extraction worker processes shared by all datasets')
+    parser.add_argument('--api-budget', type=int, default=64, help='Concurrent API requests shared by all QA jobs')
+    parser.add_argument('--rpm', type=int, help='Account requests per minute, split across QA jobs')
+    parser.add_argument('--tpm', type=int, help='Account tokens per minute, split across QA jobs')
+    parser.add_argument('--extract-args', type=str, default='', help='Extra RLDS_reader.py arguments')
+    parser.add_argument('--qa-args', type=str, default='', help='Extra qa_generation.py arguments')
+    parser.add_argument('--log-dir', type=str, default='orchestrator_logs', help='Job logs and status.json')
+    parser.add_argument('--poll-seconds', type=float, default=30.0, help='Status report interval')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-run extraction and QA jobs whose outputs already exist')
+    parser.add_argument('--dry-run', action='store_true', help='Print the plan and exit')
+    args = parser.parse_args()
+
+    jobs = plan_jobs(select_datasets(args.datasets, args.base_path), args)
+    if args.dry_run:
+        for job in jobs:
+            after = f" after {job.after.name}" if job.after else ""
+            state = " (done)" if job.state == 'done' else ""
+            print(f"{job.name:<70} cpu={job.cpu:<3} api={job.api:<4}{after}{state}\n    {' '.join(job.command)}")
+        return
+    ok = Orchestrator(jobs, args.cpu_budget, args.api_budget, args.log_dir, args.poll_seconds).run()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,72 +1,253 @@
 import os
 import json
 import argparse
-import shutil
+import glob
 
 from tqdm import tqdm
 
 try:
     from .utils import dataset_mapping
+    from .metrics import metrics, setup_metrics
+    from .token_usage import usage, estimate_dataset, calibration
 except ImportError:
     from scripts.utils import dataset_mapping
+    from scripts.metrics import metrics, setup_metrics
+    from scripts.token_usage import usage, estimate_dataset, calibration
 
-from qa_generator import QAGenerator
+from qa_generator import QAGenerator, set_response_cache, PROMPT_FORMATS
+import episode_dedup
+from ledger import ProgressLedger
+from video_staging import stage_videos, LINK_MODES, VERIFY_MODES
+from jsonl_io import JsonlWriter, jsonl_paths, load_annotations, convert_to_legacy_qa_json
+from qa_shards import SHARD_FORMATS, write_qa_shards
 
 
-def copy_videos_and_save_json(source_video_dir, source_json_dir, dest_dir, task, stage, QA_Generator):
+def copy_videos(source_annotation, source_video_dir, dest_video_dir, task, link_mode='copy', workers=8, verify='size'):
+    '''stage the videos of source_annotation into dest_video_dir, see video_staging.py'''
+    print(f"{link_mode} video------{task} dataset")
+    stats = stage_videos([item['id'] for item in source_annotation], source_video_dir, dest_video_dir,
+                         link_mode=link_mode, workers=workers, verify=verify)
+    print(f"staged {stats['staged']} videos ({stats['fallback_copies']} copied instead of {link_mode}), "
+          f"{stats['skipped']} already staged")
+
+def save_qa_json(annotation, dest_dir, task):
+    instance_number = len(annotation) // 1000 # K
+    dest_json_dir = os.path.join(dest_dir, f'{task}_{instance_number}K.json')
+
+    with open(dest_json_dir, 'w') as json_file:
+        json.dump(annotation, json_file, indent=4)
+    return dest_json_dir
+
+def flatten_instances(results):
+    annotation = []
+    for instance in results:
+        if isinstance(instance, list):
+            annotation.extend(instance)
+        else:
+            annotation.append(instance)
+    return annotation
+
+def save_qa_output(results, dest_dir, task, output_format='json', shard_records=None, legacy_json=False,
+                   source_annotation=None):
+    '''
+    write generate_qa_instance results (or single instances) in output_format,
+    see copy_videos_and_save_json; results may be a generator and are consumed once
+    '''
+    jsonl_path = os.path.join(dest_dir, f'{task}.jsonl')
+    with metrics.timer('write_qa'):
+        if output_format == 'jsonl':
+            for path in jsonl_paths(jsonl_path):
+                os.remove(path)
+            with JsonlWriter(jsonl_path, max_records=shard_records) as writer:
+                for result in results:
+                    writer.write_many(flatten_instances([result]))
+            if legacy_json:
+                print(f"saved {convert_to_legacy_qa_json(jsonl_path, dest_dir, task)}")
+        elif output_format in SHARD_FORMATS:
+            instances = (instance for result in results for instance in flatten_instances([result]))
+            print(f"saved {write_qa_shards(instances, dest_dir, task, output_format, shard_records, source_annotation)}")
+        else:
+            # Save to JSON
+            print(f"saved {save_qa_json(flatten_instances(results), dest_dir, task)}")
+
+def copy_videos_and_save_json(source_video_dir, source_json_dir, dest_dir, task, stage, QA_Generator, engine=None, dedup=None,
+                              output_format='json', shard_records=None, legacy_json=False, staging=None):
     '''
     dest_dir/task
     dest_dir/task_instance_numberK.json
+    engine: optional AsyncQAEngine; videos are then generated concurrently, chunk_size at a time
+    dedup: optional dict of episode_dedup options (mode, bucket, representatives, max_reuse, fanout);
+           only representatives of identical episodes are sent to the API
+    output_format: 'jsonl' streams instances to dest_dir/task.jsonl (sharded every shard_records lines)
+                   instead of building the whole list in memory; legacy_json also writes
+                   task_instance_numberK.json from it at the end; 'parquet'/'arrow' write
+                   dest_dir/task-NNNNN.parquet|arrow shards (shard_records rows each) with
+                   horizon/total_frames columns and a dest_dir/task_shards.json row index
+    staging: optional copy_videos options (link_mode, workers, verify)
+
+    Every finished video is appended to dest_dir/task_progress.jsonl keyed by its source index,
+    so an interrupted run resumes with the videos that are not in the log yet.
     '''
     os.makedirs(dest_dir, exist_ok=True)
     dest_video_dir = os.path.join(dest_dir, task)
-    temp_json_path = os.path.join(dest_dir, f'{task}_temp.json')
-
-    with open(source_json_dir, 'r') as file:
-        source_annotation = json.load(file)
-
-    if not os.path.exists(dest_video_dir):
-        os.makedirs(dest_video_dir)
-        print(f"copy video------{task} dataset")
-        for i in tqdm(range(len(source_annotation))):
-            video_name = source_annotation[i]['id']
-            video_path = os.path.join(source_video_dir, video_name)
-            new_video_path = os.path.join(dest_video_dir, video_name)
-            shutil.copy(video_path, new_video_path)
-    
-    # Check for existing temporary results
-    if os.path.exists(temp_json_path):
-        with open(temp_json_path, 'r') as temp_file:
-            annotation = json.load(temp_file)
-        start_index = len(annotation)
-        print(f"Resuming from index {start_index}")
+
+    source_annotation = load_annotations(source_json_dir)
+
+    with metrics.timer('stage_videos'):
+        copy_videos(source_annotation, source_video_dir, dest_video_dir, task, **(staging or {}))
+
+    if dedup is not None:
+        plan = episode_dedup.plan_dedup(source_annotation, mode=dedup['mode'], bucket=dedup['bucket'],
+                                        representatives=dedup['representatives'], max_reuse=dedup['max_reuse'])
+        work = sorted(index for reps, _ in plan for index in reps)
+        variants = episode_dedup.cache_variants(plan)
+        print(f"dedup: {len(source_annotation)} episodes in {len(plan)} groups, generating {len(work)} representatives")
     else:
-        annotation = []
-        start_index = 0
+        work = list(range(len(source_annotation)))
+        variants = {}
+
+    if os.path.exists(os.path.join(dest_dir, f'{task}_temp.json')):
+        print(f"Ignoring {task}_temp.json from an older version; progress is now kept in {task}_progress.jsonl")
+    progress_log = ProgressLedger(os.path.join(dest_dir, f'{task}_progress.jsonl'), sync_every=64)
+    done = {record['index'] for record in progress_log.iter_records()}
+    pending = [i for i in work if i not in done]
+    if done:
+        print(f"Resuming with {len(done)} videos done, {len(pending)} to go")
+
+    def record(index, result):
+        progress_log.append({'index': index, 'result': result})
+        metrics.count('videos_done')
 
     print(f'generate qa pairs----{task} dataset')
-    for i in tqdm(range(start_index, len(source_annotation))):
-        video_name = source_annotation[i]['id']
-        instance = QA_Generator.generate_qa_instance(annotation=source_annotation[i], video_name=video_name, stage=stage, task=task)
-        if isinstance(instance, list):
-            annotation.extend(instance)
+    llm_calls = 0
+    with progress_log:
+        if engine is not None:
+            chunk_size = 500
+            progress = tqdm(total=len(pending))
+            for chunk_start in range(0, len(pending), chunk_size):
+                chunk = pending[chunk_start:chunk_start + chunk_size]
+                engine.generate([(source_annotation[i], source_annotation[i]['id'], variants.get(i, 0)) for i in chunk],
+                                stage=stage, task=task,
+                                on_result=lambda position, result, chunk=chunk: record(chunk[position], result))
+                progress.update(len(chunk))
+            progress.close()
+            llm_calls = engine.stats['calls']
+            print(f"API requests: {engine.stats['requests']}, retries: {engine.stats['retries']}, rate limited: {engine.stats['rate_limited']}")
         else:
-            annotation.append(instance)
-        
-        if (i + 1) % 500 == 0:
-            with open(temp_json_path, 'w') as temp_file:
-                json.dump(annotation, temp_file)
-   
-    # Remove temporary file
-    if os.path.exists(temp_json_path):
-        os.remove(temp_json_path)
-    
-    # Save to JSON
-    instance_number = len(annotation) // 1000 # K
-    dest_json_dir = os.path.join(dest_dir, f'{task}_{instance_number}K.json')
+            llm = QA_Generator.llm
+            def counted_llm(*args, **kwargs):
+                nonlocal llm_calls
+                llm_calls += 1
+                return llm(*args, **kwargs)
+            QA_Generator.llm = counted_llm
+            try:
+                for i in tqdm(pending):
+                    item = source_annotation[i]
+                    record(i, QA_Generator.generate_qa_instance(annotation=item, video_name=item['id'], stage=stage, task=task,
+                                                                variant=variants.get(i, 0)))
+            finally:
+                QA_Generator.llm = llm
 
-    with open(dest_json_dir, 'w') as json_file:
-        json.dump(annotation, json_file, indent=4)
+    parse_report = QA_Generator.parse_report()
+    if parse_report:
+        with open(os.path.join(dest_dir, f'{task}_parse_stats.json'), 'w') as report_file:
+            json.dump(parse_report, report_file, indent=4)
+        for q_type, stats in parse_report.items():
+            print(f"{q_type}: {stats['requests']} JSON requests, retry rate {stats['retry_rate']:.2%}, "
+                  f"{stats['repaired']} repaired locally, {stats['failed']} failed")
+
+    usage_report = usage.report()
+    if usage_report['total']['calls'] or usage_report['total']['cache_hits']:
+        usage.write(os.path.join(dest_dir, f'{task}_usage.json'))
+        total = usage_report['total']
+        print(f"tokens: {total['prompt_tokens']} prompt ({total['cached_prompt_tokens']} cached), "
+              f"{total['completion_tokens']} completion, ${total['cost_usd']:.2f} over {total['calls']} requests")
+
+    # engine results land in completion order; put the log in source order before reading it back
+    progress_log.compact('index')
+    results = (record['result'] for record in progress_log.iter_records())
+
+    if dedup is not None:
+        generated = {record['index']: record['result'] for record in progress_log.iter_records()}
+        by_index = episode_dedup.fan_out(plan, source_annotation, generated, QA_Generator, mode=dedup['fanout'])
+        results = (by_index[i] for i in range(len(source_annotation)))
+        report = episode_dedup.dedup_report(plan, llm_calls, generated=len(pending))
+        with open(os.path.join(dest_dir, f'{task}_dedup_report.json'), 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+        print(f"dedup report: {report}")
+
+    save_qa_output(results, dest_dir, task, output_format, shard_records, legacy_json, source_annotation)
+
+    progress_log.remove()
+
+def estimate_qa(source_json_dir, dest_dir, task, stage, QA_Generator, dedup=None, sample=200, latency=None,
+                concurrency=1, rpm=None, tpm=None):
+    '''
+    pre-flight estimate of requests, tokens, cost and wall-clock time, written to
+    dest_dir/task_estimate.json; nothing is sent. Completion lengths and latency
+    are calibrated from dest_dir/task_usage.json of an earlier run when present.
+    '''
+    source_annotation = load_annotations(source_json_dir)
+    if dedup is not None:
+        plan = episode_dedup.plan_dedup(source_annotation, mode=dedup['mode'], bucket=dedup['bucket'],
+                                        representatives=dedup['representatives'], max_reuse=dedup['max_reuse'])
+        source_annotation = [source_annotation[index] for reps, _ in plan for index in reps]
+    completion_tokens, observed_latency = {}, None
+    usage_path = os.path.join(dest_dir, f'{task}_usage.json')
+    if os.path.exists(usage_path):
+        with open(usage_path, 'r') as f:
+            completion_tokens, observed_latency = calibration(json.load(f), task, stage)
+        print(f"calibrated with {usage_path}")
+    estimate = estimate_dataset(source_annotation, QA_Generator, task, stage, sample=sample,
+                                completion_tokens=completion_tokens, latency=latency or observed_latency,
+                                concurrency=concurrency, rpm=rpm, tpm=tpm)
+    os.makedirs(dest_dir, exist_ok=True)
+    with open(os.path.join(dest_dir, f'{task}_estimate.json'), 'w') as f:
+        json.dump(estimate, f, indent=4)
+    for q_type, entry in estimate['per_q_type'].items():
+        print(f"{q_type}: {entry['requests']} requests, {entry['prompt_tokens']} prompt + {entry['completion_tokens']} completion tokens")
+    print(f"{task}: {estimate['videos']} videos, {estimate['requests']} requests, "
+          f"{estimate['prompt_tokens'] + estimate['completion_tokens']} tokens, ~${estimate['cost_usd']}, "
+          f"~{estimate['seconds'] / 3600:.2f}h ({estimate['bound_by']} bound)")
+    return estimate
+
+def run_batch_phase(phase, batch_dir, source_video_dir, source_json_dir, dest_dir, task, stage, QA_Generator, cache, staging=None,
+                    output_format='json', shard_records=None, legacy_json=False):
+    '''
+    offline batch mode, see batch_generation.py
+    prepare: write round-0 request files
+    local: answer pending request files through the configured endpoint (for testing against a stand-in)
+    ingest: load result files, then either write the next round's requests or the final QA output
+            (output_format, shard_records and legacy_json as in copy_videos_and_save_json)
+    '''
+    import batch_generation
+
+    source_annotation = load_annotations(source_json_dir)
+    prefix = os.path.join(batch_dir, f"{task}_{stage}_round")
+
+    if phase == 'prepare':
+        paths = batch_generation.prepare_batch(source_annotation, QA_Generator, task, stage, batch_dir, cache)
+        print(f"wrote {len(paths)} request files to {batch_dir}")
+
+    elif phase == 'local':
+        from qa_generator import GPT_API
+        for request_path in sorted(glob.glob(f"{prefix}*_requests_*.jsonl")):
+            result_path = request_path.replace('_requests_', '_results_')
+            if not os.path.exists(result_path):
+                batch_generation.run_local_batch(request_path, result_path, answer=lambda body: GPT_API(
+                    body["messages"][-1]["content"], model=body["model"], response_format=body.get("response_format")))
+                print(f"answered {request_path}")
+
+    elif phase == 'ingest':
+        stored, failed = batch_generation.ingest_results(sorted(glob.glob(f"{prefix}*_results_*.jsonl")), cache)
+        print(f"ingested {stored} responses ({failed} failed)")
+        annotation, paths = batch_generation.build_instances(source_annotation, QA_Generator, task, stage, batch_dir, cache)
+        if annotation is None:
+            print(f"submit {len(paths)} request files for the next round, then ingest again: {paths}")
+            return
+        os.makedirs(dest_dir, exist_ok=True)
+        copy_videos(source_annotation, source_video_dir, os.path.join(dest_dir, task), task, **(staging or {}))
+        save_qa_output(annotation, dest_dir, task, output_format, shard_records, legacy_json, source_annotation)
 
 def args_parse():
     parser = argparse.ArgumentParser(description="qa generation")
@@ -74,6 +255,44 @@ def args_parse():
     parser.add_argument('--dest_dir', type=str, default='')
     parser.add_argument('--dataset_name', type=str, default='')
     parser.add_argument('--stage', type=str, default='Pretrain', help="Pretrain, Finetune")
+    parser.add_argument('--cache', type=str, default=None, help="SQLite response cache shared across runs and workers")
+    parser.add_argument('--cache_max_mb', type=int, default=1024, help="evict least recently used responses beyond this size")
+    parser.add_argument('--batch_phase', type=str, default=None, choices=['prepare', 'local', 'ingest'],
+                        help="offline batch mode instead of live generation")
+    parser.add_argument('--batch_dir', type=str, default=None, help="batch request/result files, default dest_dir/stage/dataset_batch")
+    parser.add_argument('--dedup', type=str, default=None, choices=episode_dedup.KEY_MODES,
+                        help="generate QA once per group of identical episodes, keyed by instructions (or instructions and segments)")
+    parser.add_argument('--dedup_representatives', type=int, default=1, help="episodes per group sent to the API")
+    parser.add_argument('--dedup_max_reuse', type=int, default=None, help="at most this many episodes share one representative's answers")
+    parser.add_argument('--dedup_bucket', type=float, default=0.1, help="temporal segment bucket width for --dedup segments")
+    parser.add_argument('--dedup_fanout', type=str, default='reuse', choices=episode_dedup.FANOUT_MODES,
+                        help="reuse whole representative instances, or re-sample each question type across representatives")
+    parser.add_argument('--link_mode', type=str, default='copy', choices=LINK_MODES,
+                        help="how videos are staged into dest_dir; hardlink/reflink fall back to copy across filesystems")
+    parser.add_argument('--stage_workers', type=int, default=8, help="threads staging videos")
+    parser.add_argument('--verify', type=str, default='size', choices=VERIFY_MODES,
+                        help="how already staged videos are checked against the manifest")
+    parser.add_argument('--output_format', type=str, default='json', choices=['json', 'jsonl'] + list(SHARD_FORMATS),
+                        help="jsonl streams instances to dest_dir/stage/dataset.jsonl as they are generated; "
+                             "parquet/arrow write columnar shards with a row index (needs pyarrow)")
+    parser.add_argument('--shard_records', type=int, default=None, help="start a new jsonl/parquet/arrow shard every N instances")
+    parser.add_argument('--legacy_json', action='store_true', help="also convert jsonl output to dataset_NK.json")
+    parser.add_argument('--combine_questions', action='store_true', help="finetune stage: ask for all GPT question types of a video in one request")
+    parser.add_argument('--structured_output', action='store_true', help="request schema-constrained JSON answers (response_format json_schema)")
+    parser.add_argument('--prompt_format', type=str, default='repr', choices=PROMPT_FORMATS,
+                        help="how video content is written into prompts; json and compact are shorter than the dict repr")
+    parser.add_argument('--estimate', action='store_true', help="only project requests, tokens, cost and time of the run")
+    parser.add_argument('--estimate_sample', type=int, default=200, help="videos whose prompts are built for --estimate")
+    parser.add_argument('--latency', type=float, default=None, help="seconds per request assumed by --estimate")
+    parser.add_argument('--price_input', type=float, default=None, help="USD per 1M prompt tokens, overrides the built-in price")
+    parser.add_argument('--price_cached_input', type=float, default=None, help="USD per 1M cached prompt tokens, overrides the built-in price")
+    parser.add_argument('--price_output', type=float, default=None, help="USD per 1M completion tokens, overrides the built-in price")
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent API requests; >1 uses the asyncio engine")
+    parser.add_argument('--rpm', type=int, default=None, help="requests per minute limit for the asyncio engine")
+    parser.add_argument('--tpm', type=int, default=None, help="tokens per minute limit for the asyncio engine")
+    parser.add_argument('--metrics_json', type=str, default=None, help="periodically write stage timings and counters to this JSON file")
+    parser.add_argument('--metrics_prom', type=str, default=None, help="periodically write the same metrics as a Prometheus textfile")
+    parser.add_argument('--metrics_interval', type=float, default=30.0, help="seconds between metrics exports")
     args = parser.parse_args()
     return args
 
@@ -81,7 +300,24 @@ def main():
     args = args_parse()
     Dataset_Path_Mapping, Dataset_Task_Mapping = dataset_mapping(args.base_dir)
     task_list = Dataset_Task_Mapping[args.dataset_name]
-    QA_Generator = QAGenerator(task_list=task_list)
+    QA_Generator = QAGenerator(task_list=task_list, combine_questions=args.combine_questions,
+                               structured_output=args.structured_output, prompt_format=args.prompt_format)
+    if args.price_input is not None or args.price_output is not None or args.price_cached_input is not None:
+        usage.set_price("gpt-4o", args.price_input, args.price_output, args.price_cached_input)
+    cache = None
+    if args.cache:
+        from response_cache import ResponseCache
+        cache = ResponseCache(args.cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+        set_response_cache(cache)
+    engine = None
+    if args.concurrency > 1:
+        from async_engine import AsyncQAEngine
+        engine = AsyncQAEngine(QA_Generator, concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm, cache=cache)
+    staging = {"link_mode": args.link_mode, "workers": args.stage_workers, "verify": args.verify}
+    dedup = None
+    if args.dedup:
+        dedup = {"mode": args.dedup, "bucket": args.dedup_bucket, "representatives": args.dedup_representatives,
+                 "max_reuse": args.dedup_max_reuse, "fanout": args.dedup_fanout}
     base_dir = Dataset_Path_Mapping[args.dataset_name]
     dest_dir = os.path.join(args.dest_dir, args.stage)
     if args.dataset_name.endswith('_task'):
@@ -93,7 +329,31 @@ def main():
 
     print(f"{args.stage} Dataset Processing .......")
     print(f"Dataset {args.dataset_name} Processing .......")
-    copy_videos_and_save_json(source_video_dir=source_video_dir, source_json_dir=source_json_dir, dest_dir=dest_dir, task=args.dataset_name, stage=args.stage, QA_Generator=QA_Generator)
+    if args.estimate:
+        estimate_qa(source_json_dir, dest_dir, args.dataset_name, args.stage, QA_Generator, dedup=dedup,
+                    sample=args.estimate_sample, latency=args.latency, concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+        return
+    reporter = setup_metrics(args.metrics_json, args.metrics_prom, args.metrics_interval)
+    try:
+        if args.batch_phase:
+            batch_dir = args.batch_dir or os.path.join(dest_dir, f'{args.dataset_name}_batch')
+            if cache is None:
+                # batch answers are paid for; keep them without an eviction cap
+                from response_cache import ResponseCache
+                cache = ResponseCache(os.path.join(batch_dir, 'responses.sqlite'))
+            run_batch_phase(args.batch_phase, batch_dir, source_video_dir, source_json_dir, dest_dir,
+                            args.dataset_name, args.stage, QA_Generator, cache, staging=staging,
+                            output_format=args.output_format, shard_records=args.shard_records, legacy_json=args.legacy_json)
+            return
+        copy_videos_and_save_json(source_video_dir=source_video_dir, source_json_dir=source_json_dir, dest_dir=dest_dir, task=args.dataset_name, stage=args.stage, QA_Generator=QA_Generator, engine=engine, dedup=dedup,
+                                  output_format=args.output_format, shard_records=args.shard_records, legacy_json=args.legacy_json,
+                                  staging=staging)
+        if cache is not None:
+            print(f"Response cache: {cache.stats()}")
+    finally:
+        if reporter is not None:
+            reporter.stop()
+            print(f"Stage timings: {metrics.summary()}")
 
 
 if __name__ == '__main__':
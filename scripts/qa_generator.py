@@ -1,42 +1,269 @@
 import re
+import ast
 import random
 import json
 import os
+import time
+import threading
+import contextlib
 
-from openai import OpenAI
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_API_BASE")
-)
-
-def GPT_API(prompt, model="gpt-4o"):
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    )
+try:
+    from scripts.metrics import metrics
+    from scripts.token_usage import usage
+except ImportError:
+    from metrics import metrics
+    from token_usage import usage
+
+# built on the first GPT_API call, so importing this module (e.g. in a spawned worker) stays cheap
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''the process-wide OpenAI client, created once from OPENAI_API_KEY / OPENAI_API_BASE'''
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_API_BASE")
+                )
+    return client
+
+def build_messages(prompt):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+# optional ResponseCache shared by every GPT_API call of this process
+response_cache = None
+
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+_cache_context = threading.local()
+
+def current_cache_variant():
+    return getattr(_cache_context, 'variant', 0)
+
+@contextlib.contextmanager
+def cache_variant(variant):
+    '''key the cached requests of the calling thread under variant, see ResponseCache.key'''
+    previous = current_cache_variant()
+    _cache_context.variant = variant
+    try:
+        yield
+    finally:
+        _cache_context.variant = previous
+
+def request_params(response_format=None):
+    '''extra chat completion parameters; only set ones, so plain requests keep their cache keys'''
+    return {"response_format": response_format} if response_format is not None else {}
+
+def GPT_API(prompt, model="gpt-4o", attempt=0, response_format=None):
+    '''attempt numbers retries of the same prompt so each gets its own cache entry'''
+    messages = build_messages(prompt)
+    params = request_params(response_format)
+    if response_cache is not None:
+        key = response_cache.key(model, messages, attempt=attempt, variant=current_cache_variant(), **params)
+        cached = response_cache.get(key)
+        if cached is not None:
+            metrics.count('cache_hits')
+            usage.record_cache_hit()
+            return cached
+    start = time.perf_counter()
+    with metrics.timer('api_request'):
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            **params
+        )
+    metrics.count('api_requests')
+    usage.record(model, response.usage, time.perf_counter() - start)
     output = response.choices[0].message.content
+    if response_cache is not None and output is not None:
+        response_cache.put(key, output, model=model)
     return output
 
 QUESTION_TOKEN = "<question>"
 
+# asks for every GPT-answered Q_type of an episode in one request, see QAGenerator.generate_combined_gpt_qa
+COMBINED_QA_KEYS = "with the keys question_type, question and answer"
+
+class CombinedPrompt(str):
+    '''prompt text of a combined request, carrying the Q_types it asks for so llm stand-ins need not parse them back out'''
+    def __new__(cls, text, q_types):
+        prompt = super().__new__(cls, text)
+        prompt.q_types = list(q_types)
+        return prompt
+
+def is_combined_prompt(prompt):
+    return isinstance(prompt, CombinedPrompt)
+
+def combined_prompt_types(prompt):
+    '''the Q_types a combined prompt asks for'''
+    return list(prompt.q_types) if is_combined_prompt(prompt) else []
+
+PLACEHOLDER_RESPONSE = '{"question": "", "answer": ""}'
+
+def placeholder_answer(prompt):
+    '''an answer every parser accepts, for stand-in llms that only record or count requests'''
+    if is_combined_prompt(prompt):
+        return json.dumps([{"question_type": q_type, "question": "-", "answer": "-"} for q_type in combined_prompt_types(prompt)])
+    return PLACEHOLDER_RESPONSE
+
+# how the video content (step_instructions, frame_segment, ...) is written into a prompt;
+# 'repr' is the original python dict repr, the others are shorter
+PROMPT_FORMATS = ['repr', 'json', 'compact']
+
+def serialize_raw_information(raw_information, prompt_format='repr'):
+    if prompt_format == 'repr':
+        return str(raw_information)
+    if prompt_format == 'json':
+        return json.dumps(raw_information, separators=(',', ':'), ensure_ascii=False)
+    if prompt_format == 'compact':
+        # "steps by frame: 1-40 pick up the block; 41-80 open the drawer; total_frames: 80"
+        steps = [f"{segment[0]}-{segment[1]} {instruction}"
+                 for instruction, segment in zip(raw_information['step_instructions'], raw_information['frame_segment'])]
+        other = [f"{key}: {value}" for key, value in raw_information.items() if key not in ('step_instructions', 'frame_segment')]
+        return "steps by frame: " + '; '.join(steps + other)
+    raise ValueError(f"Unknown prompt format '{prompt_format}'. Available: {PROMPT_FORMATS}")
+
+# structured outputs: the answer is constrained to this schema instead of only being asked for it
+QA_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "qa_pair",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"question": {"type": "string"}, "answer": {"type": "string"}},
+            "required": ["question", "answer"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def combined_response_format(Q_types):
+    '''schema of a combined answer; the top level of a strict schema must be an object, so the array is under qa_pairs'''
+    item = {
+        "type": "object",
+        "properties": {"question_type": {"type": "string", "enum": list(Q_types)},
+                       "question": {"type": "string"}, "answer": {"type": "string"}},
+        "required": ["question_type", "question", "answer"],
+        "additionalProperties": False
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "qa_pairs",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"qa_pairs": {"type": "array", "items": item}},
+                "required": ["qa_pairs"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+def _strip_trailing_commas(text):
+    return re.sub(r',\s*([}\]])', r'\1', text)
+
+def parse_json_answer(output, opening='{'):
+    '''
+    parse the JSON value spanning the first `opening` to the last matching bracket
+    of a model answer. Common slips (code fences, \x08, trailing commas, python
+    dict reprs, unquoted keys) are repaired locally instead of asking again.
+    returns (value, repaired); value is None if nothing parseable was found
+    '''
+    closing = '}' if opening == '{' else ']'
+    start, end = (output or '').find(opening), (output or '').rfind(closing)
+    if start < 0 or end < start:
+        return None, False
+    candidate = output[start:end + 1].replace('\x08', '')
+    try:
+        return json.loads(candidate), False
+    except json.decoder.JSONDecodeError:
+        pass
+    repairs = [
+        lambda text: json.loads(_strip_trailing_commas(text), strict=False),
+        ast.literal_eval,
+        lambda text: json.loads(_strip_trailing_commas(re.sub(r'([{,]\s*)([A-Za-z_][\w ]*?)\s*:', r'\1"\2":', text)), strict=False),
+    ]
+    for repair in repairs:
+        try:
+            return repair(candidate), True
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+    return None, False
+
+# per-Q_type counters kept by QAGenerator.parse_stats; combined requests are counted under COMBINED_STATS_KEY
+PARSE_STAT_KEYS = ("requests", "repaired", "parse_failures", "wrong_keys", "combined_missing", "retries", "failed")
+COMBINED_STATS_KEY = "(combined)"
+
+def convert_keys(d):
+    '''lower + strip the keys of a parsed JSON answer'''
+    if isinstance(d, dict):
+        return {k.strip().lower(): convert_keys(v) for k, v in d.items()}
+    elif isinstance(d, list):
+        return [convert_keys(i) for i in d]
+    else:
+        return d
+
 class QAGenerator:
-    def __init__(self, task_list, q2_task_list=None, max_retries=2):
+    def __init__(self, task_list, q2_task_list=None, max_retries=2, llm=None, combine_questions=False,
+                 structured_output=False, prompt_format='repr'):
         self.task_list = task_list
         self.q2_task_list = q2_task_list if q2_task_list is not None else ["Video Caption", "Task Planning", "Action Temporal Localization", "Action Segment Summarization", "Action Segmentation and Summarization"]
         self.pretrain_stage_name = ['Pretrain', 'pretrain']
         self.finetune_stage_name = ['Finetune', 'finetune']
         self.max_retries = max_retries
         self.video_token = "<image>"
+        # prompt -> completion text; swapped out by the async engine
+        self.llm = llm if llm is not None else GPT_API
+        # source of question templates and sampled steps; batch mode swaps in a seeded random.Random per instance
+        self.rng = random
+        # finetune stage: one request for all GPT-answered Q_types instead of one per type
+        self.combine_questions = combine_questions
+        # request schema-constrained JSON (response_format) for the question/answer prompts
+        self.structured_output = structured_output
+        self.prompt_format = prompt_format
+        self.parse_stats = {}
+        self._stats_lock = threading.Lock()
+
+    def record_parse(self, Q_type, **counts):
+        with self._stats_lock:
+            stats = self.parse_stats.setdefault(Q_type, dict.fromkeys(PARSE_STAT_KEYS, 0))
+            for name, value in counts.items():
+                stats[name] += value
+        for name, value in counts.items():
+            metrics.count(f'json_{name}', value)
+
+    def parse_report(self):
+        '''parse_stats plus retry and failure rates per request, by Q_type'''
+        with self._stats_lock:
+            report = {Q_type: dict(stats) for Q_type, stats in self.parse_stats.items()}
+        for stats in report.values():
+            stats['retry_rate'] = round(stats['retries'] / stats['requests'], 4) if stats['requests'] else 0.0
+            stats['failure_rate'] = round((stats['parse_failures'] + stats['wrong_keys']) / stats['requests'], 4) if stats['requests'] else 0.0
+        return report
+
+    def ask_json(self, prompt, response_format, attempt=0):
+        '''llm call for a JSON answer; response_format is only sent in structured_output mode'''
+        if self.structured_output:
+            return self.llm(prompt, attempt=attempt, response_format=response_format)
+        return self.llm(prompt, attempt=attempt)
 
     def generate_better_caption(self, caption, task):
         '''pretrain stage'''
         if task not in ['fractal20220817_data', 'libero_spatial_no_noops', 'libero_goal_no_noops', 'libero_10_no_noops', 'droid', 'bc_z', 'robo_set', 'utokyo_xarm_bimanual_converted_externally_to_rlds', 'utokyo_xarm_pick_and_place_converted_externally_to_rlds',
                         'calvin', 'franka_kitchen', 'bridge_data_v2_combine', 'bridge_data_v2_combine_rss']:
           prompt = f"Complete the phrase {caption} into a full sentence within the context of a robot performing a tabletop manipulation task. Only add the subject, verb, and object; no extra details are needed. If a coherent sentence cannot be generated, return -1."
-          output = GPT_API(prompt=prompt)
+          output = self.llm(prompt)
         else:
           output = f"The robot {caption}"
         return output
@@ -55,14 +282,14 @@ class QAGenerator:
             else:
                 raw_type_list = ["step_instructions", "frame_segment", "total_frames", "current_frame"]
             raw_information = {raw_type: raw_data[raw_type] for raw_type in raw_type_list}
-            prompt = template.format(Q_type=Q_type, input=raw_information)
+            prompt = template.format(Q_type=Q_type, input=serialize_raw_information(raw_information, self.prompt_format))
 
         elif Q_type == "Video Caption":
             template = "Complete the phrase {input} into a full sentence within the context of a robot performing a tabletop manipulation task. Only add the subject, verb, and object; no extra details are needed. If a coherent sentence cannot be generated, return -1."
             prompt = template.format(input=raw_data["step_instructions"])
 
         elif Q_type == "Action Temporal Localization":
-            step_idx = random.randint(0, len(raw_data["frame_segment"])-1)
+            step_idx = self.rng.randint(0, len(raw_data["frame_segment"])-1)
             action_segment = raw_data["temporal_segment"][step_idx]
             rounded_segment = [round(t, 2) for t in action_segment]
             # segment format: frame {start_frame_index} to {end_frame_index}.
@@ -70,7 +297,7 @@ class QAGenerator:
             prompt = [action_description, f't={rounded_segment[0]} to t={rounded_segment[1]}.']
         
         elif Q_type == "Action Segment Summarization":
-            step_idx = random.randint(0, len(raw_data["frame_segment"])-1)
+            step_idx = self.rng.randint(0, len(raw_data["frame_segment"])-1)
             action_segment = raw_data["temporal_segment"][step_idx]
             rounded_segment = [round(t, 2) for t in action_segment]
             action_description = raw_data["step_instructions"][step_idx]
@@ -93,10 +320,24 @@ class QAGenerator:
             template = "You are directing a robot to perform a tabletop manipulation task.\n What's the next step action decision you need to make based on the video?\n You need to give the answer directly.\n Video Content: {input}\n # The video depicts a robot performing tasks on a tabletop.\n # Only describe what you are certain about, and avoid providing descriptions that may be ambiguous or inaccurate.\n"
             raw_type_list = ["step_instructions", "frame_segment", "total_frames", "current_frame"]
             raw_information = {raw_type: raw_data[raw_type] for raw_type in raw_type_list}
-            prompt = [task_prompt, template.format(input=raw_information)]
-        
+            prompt = [task_prompt, template.format(input=serialize_raw_information(raw_information, self.prompt_format))]
+
         return prompt
-        
+
+    def combined_q_types(self):
+        '''finetune Q_types answered with a JSON question/answer by GPT, i.e. the ones a combined request covers'''
+        return [q_type for q_type in self.task_list if q_type not in self.q2_task_list]
+
+    def get_combined_prompt(self, Q_types, raw_data):
+        '''finetune stage: one prompt asking for a question and answer per Q_type in Q_types, sharing the video content'''
+        template = "Please ask one question for each of the following types in the field of video understanding based on the video: {Q_types}. Then you need to give the answers.\n Video Content: {input}\n # The video depicts a robot performing tasks on a tabletop.\n # Only describe what you are certain about, and avoid providing descriptions that may be ambiguous or inaccurate.\n # Your response must be a JSON array with one object per type, " + COMBINED_QA_KEYS + ", like this:\n [{{question_type: one of the types above, question: your question here, answer: your answer here}}]."
+        raw_type_list = ["step_instructions", "frame_segment", "total_frames"]
+        if "Task Success Detection" in Q_types:
+            raw_type_list.append("current_frame")
+        raw_information = {raw_type: raw_data[raw_type] for raw_type in raw_type_list}
+        text = template.format(Q_types=', '.join(Q_types), input=serialize_raw_information(raw_information, self.prompt_format))
+        return CombinedPrompt(text, Q_types)
+
     
     def get_question(self, Q_type):
         if Q_type == "Video Caption":
@@ -238,40 +479,18 @@ class QAGenerator:
             "Summarize the primary robotic actions observed in the video, indicating their time ranges and key characteristics.\n# Your answer must be in this format: t=t_start to t=t_end: Brief description of action. Note: t_start and t_end are normalized time coordinates between 0 and 1."
         ]
 
-        question = random.choice(question_template)
+        question = self.rng.choice(question_template)
         return question
 
     def generate_gpt_qa(self, prompt, Q_type):
-        def get_json_qa(prompt):
-            output = GPT_API(prompt)
-            try:
-                match = re.search(r'{.*}', output, re.DOTALL)
-                if not match:
-                    raise ValueError("No match found")
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                output = GPT_API(prompt)
-                match = re.search(r'{.*}', output, re.DOTALL)
-
-            output = match.group()
-            cleaned_output = output.replace('\x08', '')
-            return cleaned_output
-        def convert_keys(d):
-            if isinstance(d, dict):
-                return {k.strip().lower(): convert_keys(v) for k, v in d.items()}
-            elif isinstance(d, list):
-                return [convert_keys(i) for i in d]
-            else:
-                return d
-            
         if Q_type in self.q2_task_list:
             question = self.get_question(Q_type=Q_type)
 
             if Q_type == "Task Planning":
-                task_instruction = GPT_API(prompt[0])
+                task_instruction = self.llm(prompt[0])
                 question = question.format(task_instruction=task_instruction)
-                answer = GPT_API(prompt[1])
-            if Q_type == "Action Temporal Localization":
+                answer = self.llm(prompt[1])
+            elif Q_type == "Action Temporal Localization":
                 action_description = prompt[0]
                 question = question.format(action_description=action_description)
                 answer = prompt[1]
@@ -282,30 +501,64 @@ class QAGenerator:
             elif Q_type == "Action Segmentation and Summarization":
                 answer = prompt
             else:
-                answer = GPT_API(prompt)
+                answer = self.llm(prompt)
             qa_pair = {"question": question, "answer": answer}
         else:
-            retries = 0
-            while retries < self.max_retries:
-                cleaned_output = get_json_qa(prompt)
-                try:
-                    raw_answer = json.loads(cleaned_output)
-                    output = convert_keys(raw_answer) # lower + strip
-                    output_keys = output.keys()
-                    if 'question' in output_keys and 'answer'in output_keys:
-                        qa_pair = output
-                        break
-                    else:
-                        print('wrong keys', output_keys)
-                        retries += 1
-                except json.decoder.JSONDecodeError as e:
-                    print(cleaned_output)
-                    retries += 1
-            if retries >= self.max_retries:
-                qa_pair = -1
+            # every attempt is one request; unparsable answers are repaired locally before asking again
+            qa_pair = -1
+            for attempt in range(self.max_retries):
+                if attempt:
+                    self.record_parse(Q_type, retries=1)
+                self.record_parse(Q_type, requests=1)
+                raw_answer, repaired = parse_json_answer(self.ask_json(prompt, QA_RESPONSE_FORMAT, attempt=attempt))
+                if raw_answer is None:
+                    self.record_parse(Q_type, parse_failures=1)
+                    continue
+                if repaired:
+                    self.record_parse(Q_type, repaired=1)
+                output = convert_keys(raw_answer) # lower + strip
+                if isinstance(output, dict) and 'question' in output and 'answer' in output:
+                    qa_pair = output
+                    break
+                print('wrong keys', list(output.keys()) if isinstance(output, dict) else type(output).__name__)
+                self.record_parse(Q_type, wrong_keys=1)
+            if qa_pair == -1:
+                self.record_parse(Q_type, failed=1)
 
         return qa_pair
 
+    def generate_combined_gpt_qa(self, Q_types, raw_data):
+        '''
+        one request for all Q_types; returns {Q_type: qa_pair} for the types the
+        answer covers with a valid question and answer. Types missing from it are
+        left to the caller, which retries them one by one with generate_gpt_qa.
+        '''
+        output = self.ask_json(self.get_combined_prompt(Q_types, raw_data), combined_response_format(Q_types))
+        self.record_parse(COMBINED_STATS_KEY, requests=1)
+        # a plain combined answer is an array, a schema-constrained one an object with the array under qa_pairs
+        items, repaired = parse_json_answer(output, '{' if self.structured_output else '[')
+        if isinstance(items, dict):
+            items = items.get('qa_pairs')
+        if not isinstance(items, list):
+            items, repaired = parse_json_answer(output, '[')
+        if not isinstance(items, list):
+            self.record_parse(COMBINED_STATS_KEY, parse_failures=1)
+            items = []
+        elif repaired:
+            self.record_parse(COMBINED_STATS_KEY, repaired=1)
+        by_name = {q_type.lower(): q_type for q_type in Q_types}
+        qa_pairs = {}
+        for item in convert_keys(items):
+            if not isinstance(item, dict):
+                continue
+            q_type = by_name.get(str(item.get('question_type', '')).strip().lower())
+            if q_type is not None and q_type not in qa_pairs and item.get('question') and item.get('answer'):
+                qa_pairs[q_type] = {"question": item['question'], "answer": item['answer']}
+        for q_type in Q_types:
+            if q_type not in qa_pairs:
+                self.record_parse(q_type, combined_missing=1, retries=1)
+        return qa_pairs
+
     def get_instance_template(self):
         instance = {
             "video": "video_name.mp4", 
@@ -326,7 +579,12 @@ class QAGenerator:
         formatted_question = f"{video_token}\n{question}" if question is not None else f"{video_token}\n"
         return formatted_question
     
-    def generate_qa_instance(self, annotation, video_name, stage, task):
+    def generate_qa_instance(self, annotation, video_name, stage, task, variant=0):
+        '''variant: cache variant of the requests, so repeats of identical content (dedup representatives) get their own answers'''
+        with metrics.timer('qa_instance'), usage.label(dataset=task, stage=stage), cache_variant(variant):
+            return self._generate_qa_instance(annotation, video_name, stage, task)
+
+    def _generate_qa_instance(self, annotation, video_name, stage, task):
         if stage in self.pretrain_stage_name:
             qa_instance = self.get_instance_template()
             question = self.get_question(Q_type="Video Caption")
@@ -336,16 +594,26 @@ class QAGenerator:
             if len(step_instructions) > 1:
               parts = instructions.rsplit(', ', 1)
               instructions = ' and '.join(parts)
-            caption = self.generate_better_caption(caption=instructions, task=task)
+            with usage.label(q_type="Video Caption"):
+                caption = self.generate_better_caption(caption=instructions, task=task)
             qa_instance['video'] = video_name
             qa_instance['conversations'][0]['value'] = self.format_question_with_video(question=question)
             qa_instance['conversations'][1]['value'] = caption
+            metrics.count('qa_generated')
 
         elif stage in self.finetune_stage_name:
             qa_instance = []
+            combined = {}
+            if self.combine_questions and len(self.combined_q_types()) > 1:
+                with usage.label(q_type=COMBINED_STATS_KEY):
+                    combined = self.generate_combined_gpt_qa(self.combined_q_types(), annotation)
             for q_type in self.task_list:
-                prompt = self.get_qa_prompt(Q_type=q_type, raw_data=annotation)
-                qa_pair = self.generate_gpt_qa(prompt=prompt, Q_type=q_type)
+                if q_type in combined:
+                    qa_pair = combined[q_type]
+                else:
+                    with usage.label(q_type=q_type):
+                        prompt = self.get_qa_prompt(Q_type=q_type, raw_data=annotation)
+                        qa_pair = self.generate_gpt_qa(prompt=prompt, Q_type=q_type)
                 if qa_pair != -1:
                     instance = self.get_instance_template()
                     instance['video'] = video_name
@@ -353,5 +621,6 @@ class QAGenerator:
                     instance['conversations'][1]['value'] = qa_pair['answer']
                     instance['question_type'] = q_type
                     qa_instance.append(instance)
+            metrics.count('qa_generated', len(qa_instance))
 
         return qa_instance
\ No newline at end of file
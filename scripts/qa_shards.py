@@ -0,0 +1,344 @@
+"""
+Sharded Columnar QA Output
+
+QA instances are written as Parquet or Arrow IPC shards instead of one
+``{task}_{N}K.json``, so training loaders can start on the first shard, read
+shards in parallel and load only the columns they need. Every row is one
+instance:
+
+    video          string
+    conversations  list<struct<from: string, value: string>>
+    question_type  string (null for Pretrain captions)
+    horizon        int32  (steps of the source episode, null if unknown)
+    total_frames   int32  (frames of the source episode, null if unknown)
+
+Conversation values that are not strings (e.g. a JSON answer the model
+returned as a list) are stored JSON-encoded.
+
+``{task}_shards.json`` next to the shards is the row index: for every shard
+its file, first global row, row count, size and counts by ``question_type``
+and ``horizon``, plus the totals. ``QAShards`` maps a global row to its shard
+from the index alone. Arrow IPC shards are written uncompressed and read
+through a memory map, so opening one is zero-copy; Parquet shards are
+smaller and read by row group.
+
+pyarrow is only needed by this module and is imported on first use.
+
+Usage::
+
+    python scripts/qa_shards.py convert out/Finetune/calvin.jsonl out/Finetune --task calvin --annotation robot_dataset/calvin/1.0.0/video/annotation.json
+    python scripts/qa_shards.py stats out/Finetune/calvin_shards.json
+"""
+
+import os
+import json
+import bisect
+import argparse
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .jsonl_io import iter_jsonl, load_annotations
+except ImportError:
+    from jsonl_io import iter_jsonl, load_annotations
+
+SHARD_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+DEFAULT_ROWS_PER_SHARD = 100000
+# rows buffered before a record batch (and Parquet row group) is written
+BATCH_ROWS = 8192
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Parquet/Arrow QA output needs pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def qa_schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ('video', pa.string()),
+        ('conversations', pa.list_(pa.struct([('from', pa.string()), ('value', pa.string())]))),
+        ('question_type', pa.string()),
+        ('horizon', pa.int32()),
+        ('total_frames', pa.int32()),
+    ])
+
+
+def index_path(dest_dir: str, task: str) -> str:
+    return os.path.join(dest_dir, f'{task}_shards.json')
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+class QAShardWriter:
+    """
+    Writes QA instances to ``dest_dir/{task}-00000.parquet`` (or ``.arrow``),
+    starting a new shard every ``rows_per_shard`` rows, and the row index on
+    ``close``. Shards are written under a temporary name and only renamed into
+    place by ``close``, right before the new index; the shards of a previous
+    output are removed after that, so an interrupted write leaves the last
+    complete output as it was and removes its own temporary files.
+
+    Args:
+        dest_dir: Output directory
+        task: Dataset name used in the file names
+        shard_format: 'parquet' or 'arrow'
+        rows_per_shard: Rows per shard
+        compression: Parquet codec; Arrow shards stay uncompressed so they can be memory-mapped
+    """
+
+    def __init__(self, dest_dir: str, task: str, shard_format: str = 'parquet',
+                 rows_per_shard: Optional[int] = None, compression: str = 'zstd'):
+        if shard_format not in SHARD_FORMATS:
+            raise ValueError(f"Unknown shard format '{shard_format}'. Available: {list(SHARD_FORMATS)}")
+        self.pa = _pyarrow()
+        self.dest_dir = dest_dir
+        self.task = task
+        self.shard_format = shard_format
+        self.rows_per_shard = rows_per_shard or DEFAULT_ROWS_PER_SHARD
+        self.compression = compression
+        self.schema = qa_schema()
+        self.shards: List[Dict[str, Any]] = []
+        self.rows_written = 0
+        self._columns = {name: [] for name in self.schema.names}
+        self._writer = None
+        self._shard = None
+        os.makedirs(dest_dir, exist_ok=True)
+
+    def _previous_shards(self) -> List[str]:
+        """Shard files listed by the index of the previous output, if any."""
+        path = index_path(self.dest_dir, self.task)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return [shard['path'] for shard in json.load(f)['shards']]
+
+    def _tmp_path(self, shard: Dict[str, Any]) -> str:
+        return os.path.join(self.dest_dir, shard['path'] + '.tmp')
+
+    def _open_shard(self) -> None:
+        name = f"{self.task}-{len(self.shards):05d}{SHARD_FORMATS[self.shard_format]}"
+        self._shard = {'path': name, 'first_row': self.rows_written, 'rows': 0,
+                       'question_type': Counter(), 'horizon': Counter()}
+        tmp_path = self._tmp_path(self._shard)
+        if self.shard_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(tmp_path, self.schema, compression=self.compression)
+        else:
+            self._writer = self.pa.ipc.new_file(tmp_path, self.schema)
+
+    def _close_shard(self) -> None:
+        self._flush()
+        self._writer.close()
+        self._shard['bytes'] = os.path.getsize(self._tmp_path(self._shard))
+        self.shards.append(self._shard)
+        self._writer = None
+        self._shard = None
+
+    def _flush(self) -> None:
+        if not self._columns['video']:
+            return
+        batch = self.pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        if self.shard_format == 'parquet':
+            self._writer.write_batch(batch, row_group_size=BATCH_ROWS)
+        else:
+            self._writer.write_batch(batch)
+        self._columns = {name: [] for name in self.schema.names}
+
+    def write(self, instance: Dict[str, Any], annotation: Optional[Dict[str, Any]] = None) -> None:
+        """Add one QA instance; ``annotation`` is its source episode, for the horizon and frame count."""
+        if self._writer is None:
+            self._open_shard()
+        horizon = annotation.get('horizon') if annotation else None
+        question_type = instance.get('question_type')
+        self._columns['video'].append(instance['video'])
+        self._columns['conversations'].append([{'from': turn['from'], 'value': _text(turn['value'])}
+                                               for turn in instance['conversations']])
+        self._columns['question_type'].append(question_type)
+        self._columns['horizon'].append(horizon)
+        self._columns['total_frames'].append(annotation.get('total_frames') if annotation else None)
+        self._shard['rows'] += 1
+        self._shard['question_type'][str(question_type)] += 1
+        self._shard['horizon'][str(horizon)] += 1
+        self.rows_written += 1
+        if len(self._columns['video']) >= BATCH_ROWS:
+            self._flush()
+        if self._shard['rows'] >= self.rows_per_shard:
+            self._close_shard()
+
+    def write_many(self, instances: Iterable[Dict[str, Any]], annotation: Optional[Dict[str, Any]] = None) -> None:
+        for instance in instances:
+            self.write(instance, annotation)
+
+    def close(self) -> str:
+        """Finish the last shard, move the shards and row index into place; returns the index path."""
+        if self._writer is not None:
+            self._close_shard()
+        previous = self._previous_shards()
+        for shard in self.shards:
+            os.replace(self._tmp_path(shard), os.path.join(self.dest_dir, shard['path']))
+        totals = {'question_type': Counter(), 'horizon': Counter()}
+        for shard in self.shards:
+            for key in totals:
+                totals[key].update(shard[key])
+        index = {
+            'task': self.task,
+            'format': self.shard_format,
+            'rows': self.rows_written,
+            'schema': self.schema.names,
+            'question_type': dict(totals['question_type']),
+            'horizon': dict(sorted(totals['horizon'].items(), key=lambda item: (item[0] == 'None', len(item[0]), item[0]))),
+            'shards': [dict(shard, question_type=dict(shard['question_type']), horizon=dict(shard['horizon']))
+                       for shard in self.shards],
+        }
+        path = index_path(self.dest_dir, self.task)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=4)
+        os.replace(path + '.tmp', path)
+        current = {shard['path'] for shard in self.shards}
+        for name in previous:
+            shard_path = os.path.join(self.dest_dir, name)
+            if name not in current and os.path.exists(shard_path):
+                os.remove(shard_path)
+        return path
+
+    def abort(self) -> None:
+        """Drop everything written so far, leaving any previous output untouched."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._shard is not None:
+            self.shards.append(self._shard)
+            self._shard = None
+        for shard in self.shards:
+            if os.path.exists(self._tmp_path(shard)):
+                os.remove(self._tmp_path(shard))
+        self.shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class QAShards:
+    """
+    Reader over the shards listed in a ``{task}_shards.json`` index.
+
+    Usage::
+
+        shards = QAShards('out/Finetune/calvin_shards.json')
+        len(shards)                                   # from the index, no shard is opened
+        shards.row(123456)                            # one instance as a dict
+        table = shards.read_shard(0, columns=['video', 'question_type'])
+        planning = shards.filter(question_type='Action Ordering', min_horizon=4)
+    """
+
+    def __init__(self, path: str):
+        self.index_path = path
+        self.dest_dir = os.path.dirname(os.path.abspath(path))
+        with open(path, 'r') as f:
+            self.index = json.load(f)
+        self.shards = self.index['shards']
+        self._starts = [shard['first_row'] for shard in self.shards]
+
+    def __len__(self) -> int:
+        return self.index['rows']
+
+    @property
+    def paths(self) -> List[str]:
+        return [os.path.join(self.dest_dir, shard['path']) for shard in self.shards]
+
+    def read_shard(self, shard: int, columns: Optional[List[str]] = None):
+        """One shard as a ``pyarrow.Table``; Arrow IPC shards are memory-mapped, not copied."""
+        pa = _pyarrow()
+        path = self.paths[shard]
+        if self.index['format'] == 'arrow':
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            return table.select(columns) if columns else table
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    def locate(self, row: int) -> Tuple[int, int]:
+        """``(shard, row within the shard)`` of a global row."""
+        if not 0 <= row < len(self):
+            raise IndexError(f"Row {row} out of range for {len(self)} rows")
+        shard = bisect.bisect_right(self._starts, row) - 1
+        return shard, row - self._starts[shard]
+
+    def row(self, row: int) -> Dict[str, Any]:
+        shard, offset = self.locate(row)
+        return self.read_shard(shard).slice(offset, 1).to_pylist()[0]
+
+    def dataset(self):
+        """A ``pyarrow.dataset.Dataset`` over all shards, for parallel scans with filters and projections."""
+        import pyarrow.dataset as ds
+        return ds.dataset(self.paths, format='ipc' if self.index['format'] == 'arrow' else 'parquet')
+
+    def filter(self, question_type: Optional[str] = None, min_horizon: Optional[int] = None,
+               max_horizon: Optional[int] = None, columns: Optional[List[str]] = None):
+        """Rows matching all given conditions as one ``pyarrow.Table``."""
+        import pyarrow.dataset as ds
+        condition = None
+        for expression in [ds.field('question_type') == question_type if question_type is not None else None,
+                           ds.field('horizon') >= min_horizon if min_horizon is not None else None,
+                           ds.field('horizon') <= max_horizon if max_horizon is not None else None]:
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        return self.dataset().to_table(columns=columns, filter=condition)
+
+    def iter_instances(self, columns: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        for shard in range(len(self.shards)):
+            yield from self.read_shard(shard, columns).to_pylist()
+
+
+def write_qa_shards(instances: Iterable[Dict[str, Any]], dest_dir: str, task: str, shard_format: str = 'parquet',
+                    rows_per_shard: Optional[int] = None, annotations: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Write QA instances to shards; ``annotations`` (matched by video id) fill horizon and total_frames."""
+    by_video = {item['id']: item for item in annotations} if annotations else {}
+    with QAShardWriter(dest_dir, task, shard_format, rows_per_shard) as writer:
+        for instance in instances:
+            writer.write(instance, by_video.get(instance['video']))
+    return index_path(dest_dir, task)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded Parquet/Arrow QA output")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert = subparsers.add_parser('convert', help="convert {task}_{N}K.json or JSONL QA output to shards")
+    convert.add_argument('src', help="QA JSON file, JSONL file or sharded JSONL output name")
+    convert.add_argument('dest', help="destination directory")
+    convert.add_argument('--task', required=True, help="dataset name used in the shard file names")
+    convert.add_argument('--format', choices=list(SHARD_FORMATS), default='parquet')
+    convert.add_argument('--rows-per-shard', type=int, default=DEFAULT_ROWS_PER_SHARD)
+    convert.add_argument('--annotation', help="annotation.json of the dataset, for horizon and total_frames")
+    stats = subparsers.add_parser('stats', help="print the counts of a shard index")
+    stats.add_argument('index', help="{task}_shards.json")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        if args.src.endswith('.json'):
+            with open(args.src, 'r', encoding='utf-8') as f:
+                instances = json.load(f)
+        else:
+            instances = iter_jsonl(args.src)
+        annotations = load_annotations(args.annotation) if args.annotation else None
+        print(write_qa_shards(instances, args.dest, args.task, args.format, args.rows_per_shard, annotations))
+    else:
+        shards = QAShards(args.index)
+        print(f"{len(shards)} rows in {len(shards.shards)} {shards.index['format']} shards")
+        print(f"question_type: {shards.index['question_type']}")
+        print(f"horizon: {shards.index['horizon']}")
+
+
+if __name__ == '__main__':
+    main()
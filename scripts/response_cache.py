@@ -0,0 +1,130 @@
+'''
+Content-addressed on-disk cache for chat completions
+
+Responses are stored in SQLite keyed by a SHA-256 of (model, messages,
+sampling params). The database runs in WAL mode with a busy timeout, so any
+number of worker threads and processes can share one cache file. Entries carry
+a last-access time and the least recently used ones are evicted once the cache
+grows past its size cap.
+'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class ResponseCache:
+    EVICT_CHECK_EVERY = 256
+
+    def __init__(self, path, max_bytes=None, max_entries=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model, messages, attempt=0, variant=0, **params):
+        '''
+        attempt > 0 keys retries of the same prompt separately, so a bad answer is not replayed;
+        variant > 0 does the same for deliberate repeats, e.g. later dedup representatives of a group
+        '''
+        payload = {"model": model, "messages": messages, "params": params}
+        if attempt:
+            payload["attempt"] = attempt
+        if variant:
+            payload["variant"] = variant
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        with self._counter_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, response, model=None):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, response, len(response.encode('utf-8')), now, now)
+        )
+        with self._counter_lock:
+            self._puts += 1
+            check = self._puts % self.EVICT_CHECK_EVERY == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        '''Drop least recently used entries until the cache is back under 90% of its caps.'''
+        if not self.max_bytes and not self.max_entries:
+            return 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            excess_entries = count - int(self.max_entries * 0.9) if self.max_entries and count > self.max_entries else 0
+            excess_bytes = total - int(self.max_bytes * 0.9) if self.max_bytes and total > self.max_bytes else 0
+            removed = 0
+            if excess_entries > 0 or excess_bytes > 0:
+                freed = 0
+                victims = []
+                for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    if len(victims) >= excess_entries and freed >= excess_bytes:
+                        break
+                    victims.append((key,))
+                    freed += size
+                conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                removed = len(victims)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def stats(self):
+        conn = self._connect()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,239 @@
+'''
+Token and cost accounting for QA generation
+
+Every chat completion reports its usage (prompt, cached prompt and completion
+tokens, latency) to the process-wide `usage` tracker, labelled with the
+dataset, stage and question type being generated: QAGenerator sets the labels
+with `usage.label(...)` around each Q_type and the llm backends read them.
+Response cache hits are counted but cost nothing.
+
+estimate_dataset() runs the prompt-building code over a sample of annotations
+with a counting llm, so no request is sent, and projects the requests, tokens,
+cost and wall-clock time of a whole dataset.
+'''
+import json
+import random
+import threading
+import contextlib
+
+try:
+    from scripts.metrics import metrics
+except ImportError:
+    from metrics import metrics
+
+# USD per 1M tokens: (input, cached input, output). List prices when this was
+# written; check the provider's pricing page and override with --price_input/--price_cached_input/--price_output.
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+}
+# estimate defaults when no previous usage report is given
+CHARS_PER_TOKEN = 4
+CHAT_OVERHEAD_TOKENS = 16
+COMPLETION_TOKENS = {"json": 60, "text": 30}
+DEFAULT_LATENCY = 3.0
+COUNTERS = ("calls", "cache_hits", "prompt_tokens", "cached_prompt_tokens", "completion_tokens", "cost_usd", "seconds")
+
+
+def count_tokens(text):
+    '''rough token count of a prompt: ~4 characters per token plus the chat framing'''
+    return len(str(text)) // CHARS_PER_TOKEN + CHAT_OVERHEAD_TOKENS
+
+
+class UsageTracker:
+    def __init__(self, prices=None):
+        self.prices = dict(PRICES if prices is None else prices)
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def current(self):
+        '''labels of the calling thread, e.g. {"dataset": ..., "stage": ..., "q_type": ...}'''
+        return getattr(self._local, 'labels', {})
+
+    @contextlib.contextmanager
+    def label(self, **labels):
+        previous = self.current()
+        self._local.labels = dict(previous, **labels)
+        try:
+            yield
+        finally:
+            self._local.labels = previous
+
+    def set_price(self, model, input_price=None, output_price=None, cached_input_price=None):
+        '''override the per-1M-token prices of model; without an explicit cached price, a new input
+        price keeps the model's cached/input ratio (half for unknown models) and otherwise it is unchanged'''
+        current = self.price(model) or (0.0, 0.0, 0.0)
+        if cached_input_price is None:
+            if input_price is None:
+                cached_input_price = current[1]
+            else:
+                ratio = current[1] / current[0] if current[0] else 0.5
+                cached_input_price = input_price * ratio
+        input_price = current[0] if input_price is None else input_price
+        output_price = current[2] if output_price is None else output_price
+        self.prices[model] = (input_price, cached_input_price, output_price)
+
+    def price(self, model):
+        # dated snapshots (gpt-4o-2024-08-06) are priced like their base model; longest name first
+        for name in sorted(self.prices, key=len, reverse=True):
+            if model == name or model.startswith(name + '-'):
+                return self.prices[name]
+        return None
+
+    def cost(self, model, prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+        price = self.price(model)
+        if price is None:
+            return 0.0
+        input_price, cached_price, output_price = price
+        return ((prompt_tokens - cached_prompt_tokens) * input_price + cached_prompt_tokens * cached_price
+                + completion_tokens * output_price) / 1e6
+
+    def _entry(self, labels):
+        labels = self.current() if labels is None else labels
+        key = (labels.get('dataset'), labels.get('stage'), labels.get('q_type'))
+        if key not in self.totals:
+            self.totals[key] = dict.fromkeys(COUNTERS, 0)
+        return self.totals[key]
+
+    def record(self, model, response_usage, seconds=0.0, labels=None):
+        '''add the usage object of one chat completion response'''
+        prompt_tokens = getattr(response_usage, 'prompt_tokens', None) or 0
+        completion_tokens = getattr(response_usage, 'completion_tokens', None) or 0
+        details = getattr(response_usage, 'prompt_tokens_details', None)
+        cached_prompt_tokens = getattr(details, 'cached_tokens', None) or 0
+        with self._lock:
+            entry = self._entry(labels)
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["cached_prompt_tokens"] += cached_prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += self.cost(model, prompt_tokens, completion_tokens, cached_prompt_tokens)
+            entry["seconds"] += seconds
+        metrics.count('prompt_tokens', prompt_tokens)
+        metrics.count('completion_tokens', completion_tokens)
+
+    def record_cache_hit(self, labels=None):
+        with self._lock:
+            self._entry(labels)["cache_hits"] += 1
+
+    def reset(self):
+        with self._lock:
+            self.totals = {}
+
+    def report(self):
+        '''{dataset: {stage: {q_type: counters and per-call means}}} plus a "total" entry'''
+        with self._lock:
+            totals = {key: dict(entry) for key, entry in self.totals.items()}
+        report, total = {}, dict.fromkeys(COUNTERS, 0)
+        for (dataset, stage, q_type), entry in sorted(totals.items(), key=lambda item: tuple(str(k) for k in item[0])):
+            for name in COUNTERS:
+                total[name] += entry[name]
+            report.setdefault(str(dataset), {}).setdefault(str(stage), {})[str(q_type)] = _with_means(entry)
+        report["total"] = _with_means(total)
+        return report
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+
+def _with_means(entry):
+    entry = dict(entry, cost_usd=round(entry["cost_usd"], 6), seconds=round(entry["seconds"], 3))
+    calls = entry["calls"]
+    entry["mean_prompt_tokens"] = round(entry["prompt_tokens"] / calls, 1) if calls else 0.0
+    entry["mean_completion_tokens"] = round(entry["completion_tokens"] / calls, 1) if calls else 0.0
+    entry["mean_seconds"] = round(entry["seconds"] / calls, 3) if calls else 0.0
+    return entry
+
+
+# The process-wide tracker the llm backends report to.
+usage = UsageTracker()
+
+
+def calibration(report, dataset, stage):
+    '''(mean completion tokens by q_type, mean latency) observed in an earlier usage report'''
+    by_type = report.get(dataset, {}).get(stage, {})
+    completion = {q_type: entry["mean_completion_tokens"] for q_type, entry in by_type.items() if entry["calls"]}
+    latency = report.get("total", {}).get("mean_seconds") or None
+    return completion, latency
+
+
+def estimate_dataset(annotations, qa_generator, task, stage, model="gpt-4o", sample=200, seed=0,
+                     completion_tokens=None, latency=None, concurrency=1, rpm=None, tpm=None, tracker=None):
+    '''
+    project the requests, tokens, cost and wall-clock time of generating QA for
+    `annotations` by running qa_generator over a random sample of them with a
+    counting llm (placeholder answers, nothing is sent) and scaling up.
+
+    completion_tokens: {q_type: mean completion tokens}, e.g. from calibration();
+                       types without an entry use COMPLETION_TOKENS
+    latency: seconds per request, DEFAULT_LATENCY if None
+    concurrency, rpm, tpm: the run's limits; the tightest one sets the wall-clock time
+    tracker: prices the projection, `usage` if None; requests are attributed to
+             Q_types by the labels QAGenerator sets on `usage`, whatever the tracker
+    '''
+    from qa_generator import placeholder_answer, is_combined_prompt, combined_prompt_types
+
+    tracker = tracker or usage
+    completion_tokens = completion_tokens or {}
+    latency = latency or DEFAULT_LATENCY
+    indices = sorted(random.Random(seed).sample(range(len(annotations)), min(sample, len(annotations))))
+    per_type = {}
+
+    def counting_llm(prompt, model=None, attempt=0, response_format=None):
+        q_type = usage.current().get('q_type')
+        if q_type in completion_tokens:
+            completion = completion_tokens[q_type]
+        elif is_combined_prompt(prompt):
+            completion = COMPLETION_TOKENS["json"] * len(combined_prompt_types(prompt))
+        else:
+            completion = COMPLETION_TOKENS["json" if "JSON" in str(prompt) else "text"]
+        entry = per_type.setdefault(str(q_type), {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        entry["requests"] += 1
+        entry["prompt_tokens"] += count_tokens(prompt)
+        entry["completion_tokens"] += completion
+        return placeholder_answer(prompt)
+
+    previous_llm, previous_stats = qa_generator.llm, qa_generator.parse_stats
+    qa_generator.llm = counting_llm
+    qa_generator.parse_stats = {}
+    try:
+        for index in indices:
+            item = annotations[index]
+            qa_generator.generate_qa_instance(annotation=item, video_name=item['id'], stage=stage, task=task)
+    finally:
+        qa_generator.llm, qa_generator.parse_stats = previous_llm, previous_stats
+
+    scale = len(annotations) / len(indices) if indices else 0.0
+    for entry in per_type.values():
+        for name in entry:
+            entry[name] = round(entry[name] * scale)
+    requests = sum(entry["requests"] for entry in per_type.values())
+    prompt_tokens = sum(entry["prompt_tokens"] for entry in per_type.values())
+    completion = sum(entry["completion_tokens"] for entry in per_type.values())
+
+    # requests per second allowed by each limit
+    limits = {"concurrency": concurrency / latency}
+    if rpm:
+        limits["rpm"] = rpm / 60
+    if tpm and requests:
+        limits["tpm"] = tpm / 60 / ((prompt_tokens + completion) / requests)
+    bound = min(limits, key=limits.get)
+    return {
+        "dataset": task,
+        "stage": stage,
+        "model": model,
+        "videos": len(annotations),
+        "sampled_videos": len(indices),
+        "requests": requests,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion,
+        "cost_usd": round(tracker.cost(model, prompt_tokens, completion), 2),
+        "seconds": round(requests / limits[bound], 1) if requests else 0.0,
+        "bound_by": bound,
+        "latency": latency,
+        "per_q_type": per_type,
+    }
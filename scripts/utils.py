@@ -1,9 +1,15 @@
+import os
 import numpy as np
-import decord
-from decord import VideoReader
-from PIL import Image
-import imageio
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional, Union
+
+try:
+    from .video_encoders import get_encoder
+    from .metrics import metrics
+    from .frame_store import FrameStore, find_frame_store
+except ImportError:
+    from scripts.video_encoders import get_encoder
+    from scripts.metrics import metrics
+    from scripts.frame_store import FrameStore, find_frame_store
 
 # QA Generation Utilities
 def dataset_mapping(base_dir):
@@ -93,21 +99,190 @@ def dataset_mapping(base_dir):
 
 # Read&Write Video/Image Utilities
 def read_video_decord(video_path: str) -> List[np.ndarray]:
-    vr = VideoReader(video_path)
-    frames = [frame.asnumpy() for frame in vr]
+    from decord import VideoReader
+    with metrics.timer('read_video'):
+        vr = VideoReader(video_path)
+        frames = [frame.asnumpy() for frame in vr]
+    metrics.count('frames_decoded', len(frames))
     return frames  # RGB格式
 
-def save_video(frames: List[np.ndarray], output_path: str, fps: int = 30) -> None:
-    try:
-        writer = imageio.get_writer(output_path, fps=fps)
-        for frame in frames:
-            writer.append_data(frame)
-        writer.close()
-        print(f"Video saved: {output_path}")
-    except Exception as e:
-        print(f"Error saving video: {e}")
+SAMPLING_POLICIES = ('uniform', 'fps', 'indices', 'segment')
+
+def sample_frame_indices(
+    num_frames: int,
+    policy: str = 'uniform',
+    num_samples: int = 8,
+    indices: Optional[List[int]] = None,
+    video_fps: Optional[float] = None,
+    target_fps: Optional[float] = None,
+    frame_segment: Optional[List[List[int]]] = None,
+    frames_per_segment: int = 2,
+) -> np.ndarray:
+    """
+    Pick frame indices for a sampling policy.
+
+    uniform: ``num_samples`` frames at the centres of equal-length chunks
+    fps: every frame that falls on a ``target_fps`` grid given ``video_fps``
+    indices: explicit indices, negative values count from the end
+    segment: ``frames_per_segment`` evenly spaced keyframes per annotation
+        ``frame_segment`` (1-based, inclusive), including both boundaries
+    """
+    if num_frames <= 0:
+        return np.empty(0, dtype=np.int64)
+    if policy == 'uniform':
+        num_samples = min(num_samples, num_frames)
+        picked = ((np.arange(num_samples) + 0.5) * num_frames / num_samples).astype(np.int64)
+    elif policy == 'fps':
+        if not video_fps or not target_fps:
+            raise ValueError("fps policy needs video_fps and target_fps")
+        step = video_fps / target_fps
+        picked = np.round(np.arange(0, num_frames, step)).astype(np.int64)
+    elif policy == 'indices':
+        if indices is None:
+            raise ValueError("indices policy needs explicit indices")
+        picked = np.asarray(indices, dtype=np.int64)
+        picked = np.where(picked < 0, picked + num_frames, picked)
+    elif policy == 'segment':
+        if not frame_segment:
+            raise ValueError("segment policy needs a frame_segment")
+        picked = np.concatenate([
+            np.linspace(start - 1, end - 1, num=max(1, frames_per_segment)).round().astype(np.int64)
+            for start, end in frame_segment
+        ])
+        # Adjacent segments share boundaries; keep the first occurrence of each frame.
+        _, first = np.unique(picked, return_index=True)
+        picked = picked[np.sort(first)]
+    else:
+        raise ValueError(f"Unknown sampling policy '{policy}'. Available: {list(SAMPLING_POLICIES)}")
+    return np.clip(picked, 0, num_frames - 1)
+
+def read_video_frames(
+    video_path: str,
+    policy: str = 'uniform',
+    num_samples: int = 8,
+    indices: Optional[List[int]] = None,
+    target_fps: Optional[float] = None,
+    frame_segment: Optional[List[List[int]]] = None,
+    frames_per_segment: int = 2,
+    size: Optional[Tuple[int, int]] = None,
+) -> np.ndarray:
+    """
+    Decode only the frames selected by a sampling policy (see
+    ``sample_frame_indices``) with a single ``get_batch`` call.
+
+    For a frame-store dataset ``video_path`` is ``video_dir/<id>`` with no file
+    behind it; the frames are then read from ``video_dir/frame_store``. The
+    store keeps no frame rate, so the fps policy is unavailable there.
+
+    Args:
+        size: optional ``(height, width)`` to resize to while decoding
+
+    Returns:
+        RGB frames stacked as a ``(N, H, W, 3)`` uint8 array
+    """
+    store_root = None if os.path.exists(video_path) else find_frame_store(os.path.dirname(video_path))
+    if store_root is not None:
+        return _read_frame_store_frames(store_root, os.path.basename(video_path), policy, num_samples, indices,
+                                        target_fps, frame_segment, frames_per_segment, size)
+    from decord import VideoReader
+    if size is not None:
+        vr = VideoReader(video_path, height=size[0], width=size[1])
+    else:
+        vr = VideoReader(video_path)
+    frame_indices = sample_frame_indices(
+        len(vr), policy=policy, num_samples=num_samples, indices=indices,
+        video_fps=vr.get_avg_fps(), target_fps=target_fps,
+        frame_segment=frame_segment, frames_per_segment=frames_per_segment,
+    )
+    return vr.get_batch(frame_indices.tolist()).asnumpy()
+
+def _read_frame_store_frames(store_root, video_id, policy, num_samples, indices, target_fps,
+                             frame_segment, frames_per_segment, size) -> np.ndarray:
+    episode = FrameStore(store_root).episode(video_id)
+    frame_indices = sample_frame_indices(
+        len(episode), policy=policy, num_samples=num_samples, indices=indices,
+        target_fps=target_fps, frame_segment=frame_segment, frames_per_segment=frames_per_segment,
+    )
+    frames = episode[frame_indices]
+    if size is not None and frames.shape[1:3] != tuple(size):
+        from PIL import Image
+        frames = np.stack([np.asarray(Image.fromarray(frame).resize((size[1], size[0]), Image.BILINEAR))
+                           for frame in frames])
+    return frames
+
+def save_video(frames: Union[List[np.ndarray], np.ndarray], output_path: str, fps: int = 30,
+               backend: str = 'imageio', **encoder_options: Any) -> int:
+    """Encode a whole episode in one ``(T, H, W, 3)`` submission; raises on failure and returns the frame count."""
+    if isinstance(frames, list):
+        frames = np.stack(frames) if frames else np.empty((0, 0, 0, 3), dtype=np.uint8)
+    with metrics.timer('save_video'):
+        with get_encoder(backend, output_path, fps=fps, **encoder_options) as encoder:
+            encoder.write(frames)
+    _count_written(output_path, encoder.num_frames)
+    return encoder.num_frames
+
+def _count_written(output_path: str, num_frames: int) -> None:
+    if metrics.enabled:
+        metrics.count('frames_encoded', num_frames)
+        if os.path.isfile(output_path):
+            metrics.count('video_bytes_written', os.path.getsize(output_path))
+
+class StreamingVideoWriter:
+    """
+    Incremental video writer: frames are gathered into a small contiguous
+    ``(batch_size, H, W, 3)`` buffer and submitted to the encoder backend a
+    batch at a time, so memory stays bounded by the batch instead of the
+    episode. ``abort`` closes the writer and deletes the partial file. Used as
+    a context manager, an exception aborts the video.
+    """
+
+    def __init__(self, output_path: str, fps: int = 30, backend: str = 'imageio',
+                 batch_size: int = 16, **encoder_options: Any):
+        self.output_path = output_path
+        self.batch_size = batch_size
+        self.num_frames = 0
+        self._encoder = get_encoder(backend, output_path, fps=fps, **encoder_options)
+        self._buffer: Optional[np.ndarray] = None
+        self._buffered = 0
+
+    def append(self, frame: np.ndarray) -> None:
+        if self._buffer is None:
+            self._buffer = np.empty((self.batch_size,) + frame.shape, dtype=np.uint8)
+        self._buffer[self._buffered] = frame
+        self._buffered += 1
+        self.num_frames += 1
+        if self._buffered == self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffered:
+            with metrics.timer('stream_encode'):
+                self._encoder.write(self._buffer[:self._buffered])
+            self._buffered = 0
+
+    def close(self) -> None:
+        try:
+            self._flush()
+        finally:
+            with metrics.timer('stream_encode'):
+                self._encoder.close()
+        _count_written(self.output_path, self.num_frames)
+
+    def abort(self) -> None:
+        self._buffered = 0
+        self._encoder.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
 
 def save_image(image: np.ndarray, output_path: str) -> None:
+    from PIL import Image
     img = Image.fromarray(image)
     img.save(output_path)
 
@@ -115,7 +290,8 @@ def generate_meta_information(
     id: str,
     view: str,
     instructions: Any,
-    meta_information: Dict[str, Any]
+    meta_information: Dict[str, Any],
+    merge_repeats: bool = True
 ) -> Dict[str, Any]:
     if isinstance(instructions, np.ndarray):
         instructions_list = instructions.reshape(-1).tolist()
@@ -124,7 +300,7 @@ def generate_meta_information(
     else:
         instructions_list = [instructions]
     total_frames = len(instructions_list)
-    step_instructions, frame_segment, temporal_segment = get_unique_instruction(instructions_list)
+    step_instructions, frame_segment, temporal_segment = get_unique_instruction(instructions_list, merge_repeats=merge_repeats)
     horizon = len(step_instructions)
     if horizon > 1:
         meta_information["long_episode_index"].append(id)
@@ -142,31 +318,77 @@ def generate_meta_information(
         "frame_segment": frame_segment,
     }
 
+def encode_instructions(instructions_list: List[str], table: Optional[Dict[str, int]] = None) -> np.ndarray:
+    """Integer id per frame, numbered in order of first appearance; ``table`` is extended in place."""
+    table = {} if table is None else table
+    return np.fromiter((table.setdefault(instruction, len(table)) for instruction in instructions_list),
+                       dtype=np.int64, count=len(instructions_list))
+
+def _step_starts(ids: np.ndarray, episode_starts: np.ndarray, merge_repeats: bool) -> np.ndarray:
+    """
+    0-based frame index where each step begins, over frames of one or more concatenated episodes.
+
+    merge_repeats: a step begins at the first occurrence of an instruction in its episode
+    (later repeats extend nothing); otherwise at every change of instruction (run-length)
+    """
+    if merge_repeats:
+        episode = np.repeat(np.arange(len(episode_starts)), np.diff(np.append(episode_starts, len(ids))))
+        keys = episode * (int(ids.max()) + 1) + ids
+        _, first = np.unique(keys, return_index=True)
+        return np.sort(first)
+    change = np.ones(len(ids), dtype=bool)
+    change[1:] = ids[1:] != ids[:-1]
+    change[episode_starts] = True
+    return np.flatnonzero(change)
+
+def _segments(starts: np.ndarray, total_length: int) -> Tuple[List[List[int]], List[List[float]]]:
+    step_counter = np.append(starts + 1, total_length)
+    frame_segment = np.stack([step_counter[:-1], step_counter[1:] - 1], axis=1)
+    frame_segment[-1, 1] = total_length
+    frame_ratio = step_counter / total_length
+    temporal_segment = np.stack([frame_ratio[:-1], frame_ratio[1:]], axis=1)
+    temporal_segment[0, 0] = 0.0
+    return frame_segment.tolist(), temporal_segment.tolist()
+
 def get_unique_instruction(
-    instructions_list: List[str]
+    instructions_list: List[str],
+    merge_repeats: bool = True
 ) -> Tuple[List[str], List[List[int]], List[List[float]]]:
-    total_length = len(instructions_list)
-    unique_instruction = []
-    step_counter_list = []
-    for i, instruction in enumerate(instructions_list):
-        if instruction not in unique_instruction:
-            unique_instruction.append(instruction)
-            step_counter_list.append(i + 1)
-
-    # Action Localization
-    step_counter_list.append(total_length)
-    frame_segment = [
-        [step_counter_list[i], step_counter_list[i + 1] - 1]
-        for i in range(len(step_counter_list) - 1)
-    ]
-    frame_segment[-1][1] = step_counter_list[-1]
-
-    frame_ratio_list = [step_counter / total_length for step_counter in step_counter_list]
-    frame_ratio_segment = [
-        [frame_ratio_list[i], frame_ratio_list[i + 1]]
-        for i in range(len(frame_ratio_list) - 1)
-    ]
-    frame_ratio_segment[-1][1] = frame_ratio_list[-1]
-    frame_ratio_segment[0][0] = 0.0
-
-    return unique_instruction, frame_segment, frame_ratio_segment
\ No newline at end of file
+    """
+    Split an episode's per-frame instructions into steps.
+
+    Returns step_instructions, 1-based inclusive frame_segment and temporal_segment as
+    fractions of the episode. merge_repeats=True keeps the historical behaviour of one step
+    per distinct instruction (a repeated instruction does not start a new step);
+    merge_repeats=False starts a new step at every change, so A, B, A gives three steps.
+    """
+    table = {}
+    ids = encode_instructions(instructions_list, table)
+    starts = _step_starts(ids, np.zeros(1, dtype=np.int64), merge_repeats)
+    frame_segment, temporal_segment = _segments(starts, len(ids))
+    if merge_repeats:
+        step_instructions = list(table)
+    else:
+        step_instructions = [instructions_list[i] for i in starts.tolist()]
+    return step_instructions, frame_segment, temporal_segment
+
+def get_unique_instruction_batch(
+    episodes: List[List[str]],
+    merge_repeats: bool = True
+) -> List[Tuple[List[str], List[List[int]], List[List[float]]]]:
+    """``get_unique_instruction`` for many episodes with one encoding and one run-length pass."""
+    lengths = np.fromiter((len(episode) for episode in episodes), dtype=np.int64, count=len(episodes))
+    if (lengths == 0).any():
+        raise ValueError("Every episode needs at least one instruction")
+    table = {}
+    ids = encode_instructions([instruction for episode in episodes for instruction in episode], table)
+    names = list(table)
+    episode_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    starts = _step_starts(ids, episode_starts, merge_repeats)
+    bounds = np.searchsorted(starts, np.append(episode_starts, len(ids)))
+    results = []
+    for e, offset in enumerate(episode_starts.tolist()):
+        local = starts[bounds[e]:bounds[e + 1]]
+        frame_segment, temporal_segment = _segments(local - offset, int(lengths[e]))
+        results.append(([names[i] for i in ids[local].tolist()], frame_segment, temporal_segment))
+    return results
@@ -0,0 +1,185 @@
+"""
+Video Encoder Backends
+
+Pluggable sinks for extracted frame sequences. Every backend takes frames as
+contiguous ``(T, H, W, 3)`` uint8 arrays (a single ``(H, W, 3)`` frame is also
+accepted) and raises on failure; callers decide whether to abort or count.
+
+Backends:
+    imageio  imageio-ffmpeg writer (the historical default)
+    pyav     PyAV/libav with tunable codec, preset, CRF and thread count
+    npy      raw uint8 frames in a memory-mappable ``.npy`` file, for debugging
+"""
+
+import os
+import struct
+from typing import Dict, Any, Type
+
+import numpy as np
+
+
+class VideoEncoder:
+    """Base class for frame sinks; subclasses implement ``_open``, ``_write`` and ``_close``."""
+
+    extension = '.mp4'
+
+    def __init__(self, output_path: str, fps: int = 30, **options: Any):
+        self.output_path = output_path
+        self.fps = fps
+        self.options = options
+        self.num_frames = 0
+        self._opened = False
+
+    def write(self, frames: np.ndarray) -> None:
+        frames = np.asarray(frames, dtype=np.uint8)
+        if frames.ndim == 3:
+            frames = frames[None]
+        if frames.ndim != 4 or frames.shape[-1] != 3:
+            raise ValueError(f"Expected (T, H, W, 3) frames, got shape {frames.shape}")
+        if not len(frames):
+            return
+        if not self._opened:
+            self._open(frames.shape[1], frames.shape[2])
+            self._opened = True
+        self._write(np.ascontiguousarray(frames))
+        self.num_frames += len(frames)
+
+    def close(self) -> None:
+        if self._opened:
+            self._opened = False
+            self._close()
+
+    def abort(self) -> None:
+        """Close the sink and remove the partial output."""
+        try:
+            self.close()
+        finally:
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+
+    def _open(self, height: int, width: int) -> None:
+        raise NotImplementedError
+
+    def _write(self, frames: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ImageioEncoder(VideoEncoder):
+    """imageio-ffmpeg writer; options are passed to ``imageio.get_writer`` (codec, quality, ffmpeg_params, ...)."""
+
+    def _open(self, height: int, width: int) -> None:
+        import imageio
+        self._writer = imageio.get_writer(self.output_path, fps=self.fps, **self.options)
+
+    def _write(self, frames: np.ndarray) -> None:
+        for frame in frames:
+            self._writer.append_data(frame)
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+class PyAVEncoder(VideoEncoder):
+    """
+    PyAV encoder.
+
+    Options:
+        codec: libav encoder name (default ``libx264``)
+        preset: x264/x265 speed preset (default ``veryfast``)
+        crf: constant rate factor (default 23)
+        threads: encoder threads, 0 lets libav decide (default 0)
+        pix_fmt: output pixel format (default ``yuv420p``)
+    """
+
+    def _open(self, height: int, width: int) -> None:
+        import av
+        codec = self.options.get('codec', 'libx264')
+        self._container = av.open(self.output_path, mode='w')
+        self._stream = self._container.add_stream(codec, rate=self.fps)
+        self._stream.width = width
+        self._stream.height = height
+        self._stream.pix_fmt = self.options.get('pix_fmt', 'yuv420p')
+        self._stream.thread_count = int(self.options.get('threads', 0))
+        self._stream.options = {
+            'preset': str(self.options.get('preset', 'veryfast')),
+            'crf': str(self.options.get('crf', 23)),
+        }
+        self._frame_type = av.VideoFrame
+
+    def _write(self, frames: np.ndarray) -> None:
+        for frame in frames:
+            video_frame = self._frame_type.from_ndarray(frame, format='rgb24')
+            for packet in self._stream.encode(video_frame):
+                self._container.mux(packet)
+
+    def _close(self) -> None:
+        for packet in self._stream.encode():
+            self._container.mux(packet)
+        self._container.close()
+
+
+class NpyEncoder(VideoEncoder):
+    """
+    Raw uint8 frame sink.
+
+    Frames are appended to a ``.npy`` file whose fixed-size header is rewritten
+    with the final shape on close, so the result loads with
+    ``np.load(path, mmap_mode='r')``.
+    """
+
+    extension = '.npy'
+    HEADER_SIZE = 128
+
+    def _open(self, height: int, width: int) -> None:
+        self._frame_shape = (height, width, 3)
+        self._file = open(self.output_path, 'wb')
+        self._file.write(b'\0' * self.HEADER_SIZE)
+
+    def _write(self, frames: np.ndarray) -> None:
+        if frames.shape[1:] != self._frame_shape:
+            raise ValueError(f"Frame shape changed from {self._frame_shape} to {frames.shape[1:]}")
+        self._file.write(frames.tobytes())
+
+    def _close(self) -> None:
+        shape = (self.num_frames,) + self._frame_shape
+        header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (shape,)
+        preamble = b'\x93NUMPY\x01\x00'
+        header_len = self.HEADER_SIZE - len(preamble) - 2
+        encoded = header.encode('latin1').ljust(header_len - 1, b' ') + b'\n'
+        self._file.seek(0)
+        self._file.write(preamble + struct.pack('<H', header_len) + encoded)
+        self._file.close()
+
+
+ENCODERS: Dict[str, Type[VideoEncoder]] = {
+    'imageio': ImageioEncoder,
+    'pyav': PyAVEncoder,
+    'npy': NpyEncoder,
+}
+
+
+def get_encoder(name: str, output_path: str, fps: int = 30, **options: Any) -> VideoEncoder:
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{name}'. Available: {list(ENCODERS.keys())}")
+    return ENCODERS[name](output_path, fps=fps, **options)
+
+
+def parse_encoder_options(pairs) -> Dict[str, Any]:
+    """Parse ``KEY=VALUE`` command-line pairs, converting integer values."""
+    options = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        options[key] = int(value) if value.lstrip('-').isdigit() else value
+    return options
@@ -0,0 +1,157 @@
+'''
+Video staging for QA generation
+
+Puts the source videos of a dataset into dest_dir/task without necessarily
+copying them:
+
+    hardlink  same inode, no extra disk (source and destination on one filesystem)
+    reflink   copy-on-write clone (btrfs, XFS, ...), no extra disk until modified
+    symlink   link to the absolute source path
+    copy      byte copy, run in a thread pool
+
+hardlink and reflink fall back to a copy when the filesystem refuses them.
+Every staged file is recorded in a manifest (.manifest.jsonl in the
+destination) with the source size, mtime and a checksum. A later run only
+stages files that are missing, changed at the source, or fail verification,
+so an interrupted staging pass simply resumes.
+
+A dataset extracted with --output-format frame_store has no per-episode files;
+its ids name episodes in video/frame_store/, so the shards holding them and
+the store index are staged instead.
+'''
+import os
+import errno
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from ledger import ProgressLedger
+from frame_store import FrameStore, find_frame_store, FRAME_STORE_DIRNAME
+
+LINK_MODES = ['hardlink', 'reflink', 'symlink', 'copy']
+VERIFY_MODES = ['size', 'checksum']
+MANIFEST_FILENAME = '.manifest.jsonl'
+# ioctl(dest_fd, FICLONE, src_fd) from linux/fs.h
+FICLONE = 0x40049409
+CHUNK_SIZE = 8 * 1024 * 1024
+# errors meaning "this filesystem can't link/clone here", as opposed to a real I/O failure
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK}
+
+
+def file_checksum(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy(src, tmp):
+    '''copy and checksum in one pass'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        for block in iter(lambda: fsrc.read(CHUNK_SIZE), b''):
+            digest.update(block)
+            fdst.write(block)
+    shutil.copymode(src, tmp)
+    return digest.hexdigest()
+
+
+def _reflink(src, tmp):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def stage_file(src, dst, link_mode='copy', checksum=False):
+    '''
+    stage one file atomically (written next to dst, then renamed)
+    returns (mode actually used, checksum or None)
+    '''
+    tmp = f"{dst}.staging"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    mode = link_mode
+    digest = None
+    try:
+        if mode == 'hardlink':
+            os.link(src, tmp)
+        elif mode == 'reflink':
+            _reflink(src, tmp)
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), tmp)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRNOS or mode == 'symlink':
+            raise
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        mode = 'copy'
+    if mode == 'copy':
+        digest = _copy(src, tmp)
+    elif checksum:
+        digest = file_checksum(src)
+    os.replace(tmp, dst)
+    return mode, digest
+
+
+def _is_staged(entry, src_stat, dst, verify):
+    if entry is None or entry['size'] != src_stat.st_size or entry['mtime_ns'] != src_stat.st_mtime_ns:
+        return False
+    try:
+        if os.stat(dst).st_size != entry['size']:
+            return False
+    except FileNotFoundError:
+        return False
+    if verify == 'checksum':
+        return entry.get('checksum') is not None and file_checksum(dst) == entry['checksum']
+    return True
+
+
+def stage_videos(video_names, source_video_dir, dest_video_dir, link_mode='copy', workers=8, verify='size'):
+    '''
+    stage video_names from source_video_dir into dest_video_dir
+    verify: 'size' trusts the manifest when sizes and source mtimes match,
+            'checksum' also re-hashes every staged file
+    returns {"staged": n, "skipped": n, "fallback_copies": n}
+    '''
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{link_mode}'. Available: {LINK_MODES}")
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verify mode '{verify}'. Available: {VERIFY_MODES}")
+    os.makedirs(dest_video_dir, exist_ok=True)
+    store_root = find_frame_store(source_video_dir)
+    if store_root is not None:
+        video_names = [os.path.join(FRAME_STORE_DIRNAME, name) for name in FrameStore(store_root).files(video_names)]
+        os.makedirs(os.path.join(dest_video_dir, FRAME_STORE_DIRNAME), exist_ok=True)
+    manifest = ProgressLedger(os.path.join(dest_video_dir, MANIFEST_FILENAME), sync_every=256)
+    entries = {entry['name']: entry for entry in manifest.iter_records()}
+
+    def check(name):
+        src_stat = os.stat(os.path.join(source_video_dir, name))
+        return name, src_stat, _is_staged(entries.get(name), src_stat, os.path.join(dest_video_dir, name), verify)
+
+    def stage(name, src_stat):
+        mode, digest = stage_file(os.path.join(source_video_dir, name), os.path.join(dest_video_dir, name),
+                                  link_mode, checksum=verify == 'checksum')
+        return {"name": name, "size": src_stat.st_size, "mtime_ns": src_stat.st_mtime_ns,
+                "mode": mode, "checksum": digest}
+
+    stats = {"staged": 0, "skipped": 0, "fallback_copies": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, manifest:
+        missing = []
+        for name, src_stat, staged in pool.map(check, video_names):
+            if staged:
+                stats["skipped"] += 1
+            else:
+                missing.append((name, src_stat))
+        futures = [pool.submit(stage, name, src_stat) for name, src_stat in missing]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            entry = future.result()
+            manifest.append(entry)
+            stats["staged"] += 1
+            if entry["mode"] != link_mode:
+                stats["fallback_copies"] += 1
+    manifest.compact('name')
+    return stats
@@ -0,0 +1,33 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# the scripts import each other as top-level modules (e.g. `from qa_generator import ...`)
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+
+class FakeClient:
+    '''chat client answering every request with a new question/answer pair'''
+    def __init__(self):
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        self.requests += 1
+        content = json.dumps({"question": "What is picked up?", "answer": f"answer {self.requests}"})
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    '''FakeClient in place of the OpenAI client used by GPT_API'''
+    import qa_generator
+    client = FakeClient()
+    monkeypatch.setattr(qa_generator, 'client', client)
+    return client
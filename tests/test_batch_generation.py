@@ -0,0 +1,49 @@
+import json
+import os
+import random
+
+import pytest
+
+from qa_generator import QAGenerator
+from response_cache import ResponseCache
+from jsonl_io import read_jsonl
+
+qa_generation = pytest.importorskip('qa_generation')
+
+
+def write_dataset(video_dir, count=3):
+    os.makedirs(video_dir)
+    annotations = []
+    for i in range(count):
+        video_id = f"{i:06d}.mp4"
+        with open(os.path.join(video_dir, video_id), 'wb') as f:
+            f.write(b'video')
+        annotations.append({"id": video_id, "step_instructions": [f"pick up cup {i}", "put it down"],
+                            "frame_segment": [[0, 15], [15, 30]], "temporal_segment": [[0.0, 0.5], [0.5, 1.0]],
+                            "total_frames": 30, "current_frame": 20, "horizon": 2})
+    annotation_path = os.path.join(video_dir, 'annotation.json')
+    with open(annotation_path, 'w') as f:
+        json.dump(annotations, f)
+    return annotation_path
+
+
+def test_batch_ingest_writes_output_format_and_keeps_global_random(tmp_path, fake_client):
+    video_dir = str(tmp_path / 'video')
+    annotation_path = write_dataset(video_dir)
+    dest_dir, batch_dir = str(tmp_path / 'Finetune'), str(tmp_path / 'batch')
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    generator = QAGenerator(task_list=["Object Recognition", "Action Temporal Localization"])
+
+    random.seed(1234)
+    expected = [random.random() for _ in range(3)]
+    random.seed(1234)
+    for phase in ['prepare', 'local', 'ingest']:
+        qa_generation.run_batch_phase(phase, batch_dir, video_dir, annotation_path, dest_dir, 'calvin', 'Finetune',
+                                      generator, cache, output_format='jsonl')
+    assert [random.random() for _ in range(3)] == expected
+
+    instances = read_jsonl(os.path.join(dest_dir, 'calvin.jsonl'))
+    assert len(instances) == 6
+    assert {instance['question_type'] for instance in instances} == {"Object Recognition", "Action Temporal Localization"}
+    assert not any(name.endswith('K.json') for name in os.listdir(dest_dir))
+    cache.close()
@@ -0,0 +1,49 @@
+import pytest
+
+import episode_dedup
+from qa_generator import QAGenerator, GPT_API, set_response_cache
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def fake_api(tmp_path, fake_client):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    set_response_cache(cache)
+    yield fake_client, cache
+    set_response_cache(None)
+    cache.close()
+
+
+def annotation(video_id):
+    return {"id": video_id, "step_instructions": ["pick up the cup"], "frame_segment": [[0, 30]],
+            "temporal_segment": [[0.0, 1.0]], "total_frames": 30}
+
+
+def generate_representatives(annotations, plan):
+    generator = QAGenerator(task_list=["Object Recognition"], llm=GPT_API)
+    variants = episode_dedup.cache_variants(plan)
+    return {index: generator.generate_qa_instance(annotations[index], annotations[index]['id'], 'Finetune', 'calvin',
+                                                  variant=variants[index])
+            for reps, _ in plan for index in reps}
+
+
+def test_dedup_representatives_get_their_own_cached_answers(fake_api):
+    client, cache = fake_api
+    annotations = [annotation(f"{i:06d}.mp4") for i in range(6)]
+    plan = episode_dedup.plan_dedup(annotations, representatives=4)
+    assert len(plan) == 1 and len(plan[0][0]) == 4
+
+    results = generate_representatives(annotations, plan)
+    answers = {result[0]['conversations'][1]['value'] for result in results.values()}
+    assert client.requests == 4
+    assert cache.stats()['entries'] == 4
+    assert len(answers) == 4
+
+    # a second run replays every representative's own answer from the cache
+    again = generate_representatives(annotations, plan)
+    assert client.requests == 4
+    assert again == results
+
+    fanned = episode_dedup.fan_out(plan, annotations, results, QAGenerator(task_list=["Object Recognition"]),
+                                   mode='resample')
+    assert set(fanned) == set(range(len(annotations)))
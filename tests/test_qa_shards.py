@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from qa_shards import QAShards, QAShardWriter, index_path, write_qa_shards
+
+
+def instances(count, answer='yes'):
+    return [{"video": f"{i:06d}.mp4", "question_type": "Object Recognition",
+             "conversations": [{"from": "human", "value": "<image>\nWhat is picked up?"},
+                               {"from": "gpt", "value": answer}]}
+            for i in range(count)]
+
+
+@pytest.mark.parametrize('shard_format', ['parquet', 'arrow'])
+def test_interrupted_write_keeps_previous_output(tmp_path, shard_format):
+    dest_dir = str(tmp_path)
+    path = write_qa_shards(instances(5), dest_dir, 'calvin', shard_format, rows_per_shard=2)
+    before = sorted(os.listdir(dest_dir))
+
+    with pytest.raises(RuntimeError):
+        with QAShardWriter(dest_dir, 'calvin', shard_format, rows_per_shard=2) as writer:
+            writer.write_many(instances(3, answer='no'))
+            raise RuntimeError("interrupted")
+
+    assert sorted(os.listdir(dest_dir)) == before
+    shards = QAShards(path)
+    assert len(shards) == 5
+    assert [row['conversations'][1]['value'] for row in shards.iter_instances()] == ['yes'] * 5
+
+
+def test_rewrite_removes_shards_of_previous_output(tmp_path):
+    dest_dir = str(tmp_path)
+    write_qa_shards(instances(5), dest_dir, 'calvin', 'parquet', rows_per_shard=2)
+    path = write_qa_shards(instances(2, answer='no'), dest_dir, 'calvin', 'parquet', rows_per_shard=2)
+
+    assert sorted(os.listdir(dest_dir)) == ['calvin-00000.parquet', os.path.basename(index_path(dest_dir, 'calvin'))]
+    assert [row['conversations'][1]['value'] for row in QAShards(path).iter_instances()] == ['no', 'no']
@@ -0,0 +1,22 @@
+import os
+
+from ledger import ProgressLedger
+from scripts.RLDS_reader import RLDSDatasetExtractor, LEDGER_FILENAME
+
+
+def test_resume_removes_pending_videos_past_the_ledger(tmp_path):
+    video_dir = str(tmp_path)
+    with ProgressLedger(os.path.join(video_dir, LEDGER_FILENAME)) as ledger:
+        for episode_index in range(2):
+            ledger.append({'episode_index': episode_index, 'annotation': None})
+    names = ['000000.mp4', '.pending_00000001.mp4', '.pending_00000002.mp4', '.pending_00000005.mp4']
+    for name in names:
+        open(os.path.join(video_dir, name), 'wb').close()
+
+    stats = {'total_episodes': 0, 'filtered_episodes': 0}
+    extractor = RLDSDatasetExtractor()
+    # the range is already complete, so nothing is loaded from TFDS
+    extractor._extract_with_ledger('calvin', video_dir, stats, ProgressLedger(os.path.join(video_dir, LEDGER_FILENAME)),
+                                   [], start=0, end=2)
+    assert stats == {'total_episodes': 2, 'filtered_episodes': 2}
+    assert sorted(name for name in os.listdir(video_dir) if name != LEDGER_FILENAME) == sorted(names[:2])
@@ -0,0 +1,27 @@
+import random
+
+from qa_generator import QAGenerator
+from scripts.token_usage import UsageTracker, estimate_dataset
+
+
+def annotation(video_id, step):
+    return {"id": video_id, "step_instructions": [step, "put it down"], "frame_segment": [[0, 15], [15, 30]],
+            "temporal_segment": [[0.0, 0.5], [0.5, 1.0]], "total_frames": 30, "current_frame": 20}
+
+
+def test_estimate_with_custom_tracker_keeps_per_q_type_totals():
+    annotations = [annotation(f"{i:06d}.mp4", f"pick up cup {i}") for i in range(10)]
+    tracker = UsageTracker(prices={"gpt-4o": (1.0, 0.5, 2.0)})
+    generator = QAGenerator(task_list=["Object Recognition", "Task Success Detection", "Task Planning"])
+    random.seed(0)
+    estimate = estimate_dataset(annotations, generator, "calvin", "Finetune", sample=10, tracker=tracker)
+
+    per_type = estimate["per_q_type"]
+    assert set(per_type) == {"Object Recognition", "Task Success Detection", "Task Planning"}
+    assert per_type["Object Recognition"]["requests"] == 10
+    assert per_type["Task Planning"]["requests"] == 20
+    assert estimate["requests"] == 40
+    expected = (estimate["prompt_tokens"] * 1.0 + estimate["completion_tokens"] * 2.0) / 1e6
+    assert estimate["cost_usd"] == round(expected, 2)
+    # nothing was recorded on the tracker itself
+    assert tracker.totals == {}
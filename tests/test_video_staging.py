@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+
+from frame_store import FrameStoreWriter, FRAME_STORE_DIRNAME
+from video_staging import stage_videos
+from scripts.utils import read_video_frames
+
+
+def episode(seed, length=12):
+    return np.random.default_rng(seed).integers(0, 256, size=(length, 4, 6, 3), dtype=np.uint8)
+
+
+def test_stage_frame_store_dataset(tmp_path):
+    source, dest = str(tmp_path / 'video'), str(tmp_path / 'qa' / 'calvin')
+    episodes = {f"{i:06d}": episode(i) for i in range(3)}
+    # tiny shards so the episodes land in separate shard files
+    with FrameStoreWriter(os.path.join(source, FRAME_STORE_DIRNAME), shard_bytes=1) as writer:
+        for video_id, frames in episodes.items():
+            writer.add_episode(video_id, frames)
+
+    stats = stage_videos(list(episodes), source, dest, link_mode='hardlink')
+    assert stats == {"staged": 4, "skipped": 0, "fallback_copies": 0}
+    assert sorted(os.listdir(os.path.join(dest, FRAME_STORE_DIRNAME))) == [
+        'index.jsonl', 'shard_00000.bin', 'shard_00001.bin', 'shard_00002.bin']
+
+    for video_id, frames in episodes.items():
+        sampled = read_video_frames(os.path.join(dest, video_id), policy='indices', indices=[0, -1])
+        np.testing.assert_array_equal(sampled, frames[[0, -1]])
+
+    # a rerun finds everything staged, and a subset only needs its own shard
+    assert stage_videos(list(episodes), source, dest)["skipped"] == 4
+    subset = stage_videos(['000001'], source, str(tmp_path / 'subset'))
+    assert subset["staged"] == 2